@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Benchmark seeding and writing LIGHT particles with
+:py:func:`compass.ocean.particles.write()` on synthetic meshes the size of
+QU240 and EC30to60, comparing the vectorized seeding and columnar particle
+store with the per-cell random choices and repeated concatenation they
+replaced
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import netCDF4
+import numpy
+from scipy import spatial
+
+from compass.ocean import particles
+
+
+# the number of cells in each mesh
+MESHES = {'QU240': 7153, 'EC30to60': 235160}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time seeding and writing particles on meshes the size '
+                    'of QU240 and EC30to60')
+    parser.add_argument("-m", "--meshes", dest="meshes", nargs='+',
+                        default=list(MESHES), help="The meshes to use")
+    parser.add_argument("-c", "--cores", dest="cores", type=int, default=128,
+                        help="The number of partitions of the mesh")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for mesh_name in args.meshes:
+            cells = MESHES[mesh_name]
+            init_filename = os.path.join(temp_dir, 'init.nc')
+            graph_filename = os.path.join(temp_dir, 'graph.info.part')
+            particle_filename = os.path.join(temp_dir, 'particles.nc')
+            _make_mesh(init_filename, graph_filename, cells, args.cores)
+
+            start = time.time()
+            _choose_directions_by_cell(cells)
+            legacy_directions = time.time() - start
+
+            start = time.time()
+            _choose_directions(cells)
+            directions = time.time() - start
+
+            cpts, xCell, yCell, zCell = particles._particle_coords(
+                init_filename, 0, True, False, True, 0.005,
+                rng=numpy.random.default_rng(0))
+            particle_list = _build_particle_list(
+                init_filename, cpts, xCell, yCell, zCell)
+
+            start = time.time()
+            _append_variables(particle_list)
+            legacy_concatenate = time.time() - start
+
+            start = time.time()
+            _concatenate_variables(particle_list)
+            concatenate = time.time() - start
+
+            start = time.time()
+            particles.write(init_filename, graph_filename, particle_filename,
+                            add_noise=True, seed=0)
+            write_time = time.time() - start
+
+            with netCDF4.Dataset(particle_filename) as ds:
+                nparticles = len(ds.dimensions['nParticles'])
+
+            print('{} ({} cells, {} particles):'.format(mesh_name, cells,
+                                                        nparticles))
+            print('  random directions: per cell {:.3f} s, vectorized '
+                  '{:.3f} s ({:.0f}x faster)'.format(
+                      legacy_directions, directions,
+                      legacy_directions / directions))
+            print('  particle variables: np.append on each access {:.3f} s, '
+                  'columnar {:.3f} s ({:.0f}x faster)'.format(
+                      legacy_concatenate, concatenate,
+                      legacy_concatenate / concatenate))
+            print('  particles.write(): {:.3f} s'.format(write_time))
+
+
+def _make_mesh(init_filename, graph_filename, cells, cores):
+    """
+    Make a mesh with cells evenly distributed on the sphere, each with its 6
+    nearest cells as neighbors, and a random partition of the cells
+    """
+    rng = numpy.random.default_rng(seed=0)
+    radius = 6371.22e3
+    # a Fibonacci lattice
+    indices = numpy.arange(cells) + 0.5
+    lat = numpy.arcsin(1. - 2. * indices / cells)
+    lon = numpy.pi * (1. + 5.**0.5) * indices
+    xCell = radius * numpy.cos(lat) * numpy.cos(lon)
+    yCell = radius * numpy.cos(lat) * numpy.sin(lon)
+    zCell = radius * numpy.sin(lat)
+
+    tree = spatial.cKDTree(numpy.vstack((xCell, yCell, zCell)).T)
+    _, neighbors = tree.query(numpy.vstack((xCell, yCell, zCell)).T, k=7)
+
+    with netCDF4.Dataset(init_filename, 'w') as ds:
+        ds.sphere_radius = radius
+        ds.createDimension('nCells', cells)
+        ds.createDimension('maxEdges', 6)
+        for name, data in [('xCell', xCell), ('yCell', yCell),
+                           ('zCell', zCell),
+                           ('bottomDepth', rng.uniform(10., 5000., cells))]:
+            var = ds.createVariable(name, 'f8', ('nCells',))
+            var[:] = data
+        var = ds.createVariable('cellsOnCell', 'i4', ('nCells', 'maxEdges'))
+        var[:] = neighbors[:, 1:] + 1
+
+    numpy.savetxt(graph_filename, rng.integers(0, cores, cells), fmt='%d')
+
+
+def _choose_directions_by_cell(cells):
+    """ The original random choice of 3 of the 6 directions in each cell """
+    return numpy.stack([numpy.random.choice(numpy.arange(6), size=3,
+                                            replace=False)
+                        for _ in range(cells)])
+
+
+def _choose_directions(cells):
+    """ The vectorized random choice of 3 of the 6 directions in each cell """
+    rng = numpy.random.default_rng()
+    return numpy.argsort(rng.random((cells, 6)), axis=1)[:, 0:3]
+
+
+def _build_particle_list(init_filename, cpts, xCell, yCell, zCell):
+    """ Build the particles of all types """
+    buoysurf = numpy.linspace(1028.5, 1030.0, 11)
+    return [particles._build_isopycnal_particles(cpts, xCell, yCell, zCell,
+                                                 buoysurf, None),
+            particles._build_passive_floats(cpts, xCell, yCell, zCell,
+                                            init_filename, 10, None,
+                                            'linear'),
+            particles._build_surface_floats(cpts, xCell, yCell, zCell, None)]
+
+
+# the variables that are accessed when the particles are written, some of
+# them more than once
+WRITE_VARIABLES = ['x', 'y', 'z', 'x', 'y', 'z', 'verticaltreatment',
+                   'zlevel', 'buoypart', 'cellindices', 'cellindices',
+                   'cellGlobalID']
+
+
+def _append_variables(particle_list):
+    """
+    The original concatenation of the variables of each type of particle
+    with ``np.append`` every time a variable was accessed
+    """
+    for varname in WRITE_VARIABLES:
+        var = getattr(particle_list[0], varname)
+        for alist in particle_list[1:]:
+            var = numpy.append(var, getattr(alist, varname))
+
+
+def _concatenate_variables(particle_list):
+    """ Concatenate each variable once in a columnar particle store """
+    store = particles.ParticleList(list(particle_list))
+    for varname in WRITE_VARIABLES:
+        getattr(store, varname)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark the z-star vertical coordinate from
+:py:func:`compass.ocean.vertical.zstar.compute_layer_thickness_and_zmid()`
+against the original implementation that loops over vertical levels, and
+check that the results are identical
+"""
+
+import argparse
+import sys
+import time
+
+import numpy
+import xarray
+
+from compass.ocean.vertical.zstar import compute_layer_thickness_and_zmid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the z-star vertical coordinate and compare it with '
+                    'the loop over levels it replaced')
+    parser.add_argument("-c", "--cells", dest="cells", type=int,
+                        default=100000, help="The number of cells")
+    parser.add_argument("-l", "--levels", dest="levels", type=int,
+                        default=100, help="The number of vertical levels")
+    parser.add_argument("--chunk_size", dest="chunk_size", type=int,
+                        default=None,
+                        help="The number of cells in each dask chunk")
+    args = parser.parse_args()
+
+    cellMask, refBottomDepth, bottomDepth, maxLevelCell, ssh = \
+        _make_mesh(args.cells, args.levels)
+
+    start = time.time()
+    expected = _compute_by_level(cellMask, refBottomDepth, bottomDepth,
+                                 maxLevelCell, ssh)
+    loop_time = time.time() - start
+
+    start = time.time()
+    results = compute_layer_thickness_and_zmid(
+        cellMask, refBottomDepth, bottomDepth, maxLevelCell, ssh,
+        chunk_size=args.chunk_size)
+    # compute the results together in case they are dask arrays
+    ds = xarray.Dataset({'restingThickness': results[0],
+                         'layerThickness': results[1],
+                         'zMid': results[2]}).compute()
+    results = [ds.restingThickness, ds.layerThickness, ds.zMid]
+    vectorized_time = time.time() - start
+
+    print('{} cells, {} levels: loop over levels {:.3f} s, vectorized '
+          '{:.3f} s ({:.1f}x faster)'.format(
+              args.cells, args.levels, loop_time, vectorized_time,
+              loop_time / vectorized_time))
+
+    names = ['restingThickness', 'layerThickness', 'zMid']
+    identical = True
+    for name, result, reference in zip(names, results, expected):
+        same = result.dims == reference.dims and numpy.array_equal(
+            result.values, reference.values, equal_nan=True)
+        if not same:
+            print('{} is not identical'.format(name))
+            identical = False
+    if not identical:
+        sys.exit(1)
+
+
+def _make_mesh(cells, levels):
+    """ Make a mesh with random bathymetry and sea surface height """
+    rng = numpy.random.default_rng(seed=0)
+    interfaces = numpy.linspace(0., 5000., levels + 1)**2 / 5000.
+    refBottomDepth = xarray.DataArray(interfaces[1:], dims=('nVertLevels',))
+    refTopDepth = xarray.DataArray(interfaces[0:-1], dims=('nVertLevels',))
+    bottomDepth = xarray.DataArray(rng.uniform(10., 5000., cells),
+                                   dims=('nCells',))
+    cellMask = (refTopDepth < bottomDepth).transpose('nCells', 'nVertLevels')
+    maxLevelCell = cellMask.sum(dim='nVertLevels') - 1
+    ssh = xarray.DataArray(rng.uniform(-5., 5., cells), dims=('nCells',))
+    return cellMask, refBottomDepth, bottomDepth, maxLevelCell, ssh
+
+
+def _compute_by_level(cellMask, refBottomDepth, bottomDepth, maxLevelCell,
+                      ssh):
+    """ The original implementation, which loops over levels """
+    nVertLevels = cellMask.sizes['nVertLevels']
+
+    refLayerThickness = refBottomDepth.isel(nVertLevels=0)
+
+    restingThicknesses = [cellMask.isel(nVertLevels=0) * refLayerThickness]
+    for levelIndex in range(1, nVertLevels):
+        refLayerThickness = (refBottomDepth.isel(nVertLevels=levelIndex) -
+                             refBottomDepth.isel(nVertLevels=levelIndex-1))
+        sliceThickness = \
+            cellMask.isel(nVertLevels=levelIndex)*refLayerThickness
+        mask = levelIndex == maxLevelCell
+        partialThickness = (bottomDepth -
+                            refBottomDepth.isel(nVertLevels=levelIndex-1))
+        sliceThickness = xarray.where(mask, partialThickness, sliceThickness)
+        sliceThickness = sliceThickness.where(
+            cellMask.isel(nVertLevels=levelIndex))
+        restingThicknesses.append(sliceThickness)
+
+    restingThickness = xarray.concat(restingThicknesses, dim='nVertLevels')
+    restingThickness = restingThickness.transpose('nCells', 'nVertLevels')
+
+    layerStretch = (ssh + bottomDepth) / bottomDepth
+    layerThickness = restingThickness * layerStretch
+
+    zBot = ssh - layerThickness.cumsum(dim='nVertLevels')
+
+    zMid = zBot + 0.5*layerThickness
+
+    return restingThickness, layerThickness, zMid
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Check :py:func:`compass.io.download_files()` against a local HTTP server:
+concurrent downloads, skipping files that are already complete, resuming a
+``.part`` file left by an interrupted download and starting over when a
+``.part`` file can't be resumed
+"""
+
+import argparse
+import configparser
+import contextlib
+import functools
+import hashlib
+import http.server
+import io
+import os
+import re
+import sys
+import tempfile
+import threading
+
+import numpy
+
+from compass.io import download_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Download files from a local HTTP server and check that '
+                    'they are complete')
+    parser.add_argument("-f", "--files", dest="files", type=int, default=8,
+                        help="The number of files to serve")
+    parser.add_argument("-s", "--size", dest="size", type=int,
+                        default=3 * 1024 * 1024,
+                        help="The size of each file in bytes")
+    parser.add_argument("-c", "--concurrent_downloads",
+                        dest="concurrent_downloads", type=int, default=4,
+                        help="The number of concurrent downloads")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        serve_dir = os.path.join(temp_dir, 'server')
+        dest_dir = os.path.join(temp_dir, 'dest')
+        os.makedirs(serve_dir)
+        rng = numpy.random.default_rng(seed=0)
+        file_names = ['file{}.bin'.format(index)
+                      for index in range(args.files)]
+        for file_name in file_names:
+            with open(os.path.join(serve_dir, file_name), 'wb') as f:
+                f.write(rng.bytes(args.size))
+
+        handler = functools.partial(_RangeRequestHandler,
+                                    directory=serve_dir)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+        config = configparser.ConfigParser()
+        config.read_dict({'download': {
+            'download': 'True', 'check_size': 'True', 'verify': 'True',
+            'concurrent_downloads': '{}'.format(args.concurrent_downloads)}})
+        downloads = [('{}/{}'.format(url, file_name),
+                      os.path.join(dest_dir, file_name))
+                     for file_name in file_names]
+
+        failures = list()
+        try:
+            _check(failures, 'concurrent downloads', serve_dir, dest_dir,
+                   file_names, downloads, config, expected='Downloading')
+
+            _check(failures, 'complete files are skipped', serve_dir,
+                   dest_dir, file_names, downloads, config, expected=None)
+
+            # a download that was interrupted halfway through
+            dest_path = os.path.join(dest_dir, file_names[0])
+            os.remove(dest_path)
+            with open(os.path.join(serve_dir, file_names[0]), 'rb') as f:
+                data = f.read(args.size // 2)
+            with open('{}.part'.format(dest_path), 'wb') as f:
+                f.write(data)
+            _check(failures, 'a .part file is resumed', serve_dir, dest_dir,
+                   file_names, downloads, config, expected='Resuming',
+                   ranges=['bytes={}-'.format(args.size // 2)])
+
+            # a .part file that is longer than the file on the server
+            os.remove(dest_path)
+            with open('{}.part'.format(dest_path), 'wb') as f:
+                f.write(b'x' * (args.size + 1))
+            _check(failures, 'an invalid .part file is replaced', serve_dir,
+                   dest_dir, file_names, downloads, config,
+                   expected='Downloading',
+                   ranges=['bytes={}-'.format(args.size + 1)])
+
+            # the server drops the connection partway through the file
+            os.remove(dest_path)
+            _RangeRequestHandler.truncate = args.size // 3
+            try:
+                download_files(downloads[0:1], config, exceptions=True)
+                failures.append('an interrupted download raised no error')
+            except Exception:
+                pass
+            _RangeRequestHandler.truncate = None
+            part_size = os.path.getsize('{}.part'.format(dest_path))
+            print('interrupted download: {} of {} bytes in the .part '
+                  'file'.format(part_size, args.size))
+            if os.path.exists(dest_path):
+                failures.append('an interrupted download was renamed to '
+                                'its destination')
+            _check(failures, 'an interrupted download is resumed',
+                   serve_dir, dest_dir, file_names, downloads, config,
+                   expected='Resuming',
+                   ranges=['bytes={}-'.format(part_size)])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if len(failures) > 0:
+        for failure in failures:
+            print('FAILED: {}'.format(failure))
+        sys.exit(1)
+    print('All download checks passed')
+
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve files with support for ``Range: bytes=<start>-`` requests.  If
+    ``truncate`` is set, the connection is closed after that many bytes.
+    """
+    truncate = None
+    ranges = list()
+    lock = threading.Lock()
+
+    def send_head(self):
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            return super().send_head()
+        with self.lock:
+            _RangeRequestHandler.ranges.append(range_header)
+
+        match = re.match(r'bytes=(\d+)-$', range_header)
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            self.send_error(400)
+            return None
+        start = int(match.group(1))
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+            start, size - 1, size))
+        self.send_header('Content-Length', '{}'.format(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def copyfile(self, source, outputfile):
+        if self.truncate is None:
+            super().copyfile(source, outputfile)
+            return
+        outputfile.write(source.read(self.truncate))
+        outputfile.flush()
+        self.close_connection = True
+        self.connection.shutdown(2)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _check(failures, name, serve_dir, dest_dir, file_names, downloads,
+           config, expected, ranges=None):
+    """
+    Download the files, then check their contents, the messages that were
+    printed and the range requests the server received
+    """
+    _RangeRequestHandler.ranges = list()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        download_files(downloads, config, exceptions=True)
+    lines = output.getvalue().splitlines()
+
+    passed = True
+    for file_name in file_names:
+        dest_path = os.path.join(dest_dir, file_name)
+        if _hash(dest_path) != _hash(os.path.join(serve_dir, file_name)):
+            failures.append('{}: {} is not identical'.format(name, file_name))
+            passed = False
+        if os.path.exists('{}.part'.format(dest_path)):
+            failures.append('{}: {}.part was left behind'.format(name,
+                                                                 file_name))
+            passed = False
+
+    # each message should be on its own line, not interleaved with others
+    pattern = re.compile(r'^(Downloading|Resuming) \S+( \(.*\))?\.\.\.$|'
+                         r'^  \S+ done\.$')
+    for line in lines:
+        if pattern.match(line) is None:
+            failures.append('{}: garbled output: {!r}'.format(name, line))
+            passed = False
+    if expected is None and len(lines) > 0:
+        failures.append('{}: expected no downloads'.format(name))
+        passed = False
+    elif expected is not None and \
+            not any([line.startswith(expected) for line in lines]):
+        failures.append('{}: expected "{}"'.format(name, expected))
+        passed = False
+
+    if ranges is not None and _RangeRequestHandler.ranges != ranges:
+        failures.append('{}: expected range requests {}, got {}'.format(
+            name, ranges, _RangeRequestHandler.ranges))
+        passed = False
+
+    print('{}: {} ({} messages)'.format(name, 'ok' if passed else 'FAILED',
+                                        len(lines)))
+
+
+def _hash(filename):
+    """ The MD5 hash of a file """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        md5.update(f.read())
+    return md5.hexdigest()
+
+
+if __name__ == '__main__':
+    main()
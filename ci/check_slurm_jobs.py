@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Check :py:func:`compass.job.submit_suite()` against fake ``sbatch`` and
+``squeue`` commands: the results of all test cases are collected once the
+jobs are done, results from earlier runs aren't counted for test cases whose
+jobs didn't finish, ``squeue`` is tried again if it fails temporarily and
+the wait ends with an error if ``squeue`` keeps failing
+"""
+
+import configparser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from importlib import resources
+
+from compass.job import submit_suite
+from compass.run import read_test_case_result
+
+
+_suite_name = 'fake_suite'
+
+# the fake sbatch records the job and prints its ID like "sbatch --parsable"
+_sbatch = """#!{python}
+import json
+import os
+import sys
+
+state_file = os.environ['COMPASS_FAKE_SLURM']
+with open(state_file) as f:
+    state = json.load(f)
+job_id = '{{}}'.format(state['next_id'])
+state['next_id'] += 1
+state['jobs'][job_id] = {{'script': os.path.abspath(sys.argv[-1]),
+                         'polls': 0}}
+with open(state_file, 'w') as f:
+    json.dump(state, f)
+print('{{}};fake_cluster'.format(job_id))
+"""
+
+# the fake squeue fails as many times as requested, then lists each job for
+# a few polls before "running" it by writing the results of its test cases
+_squeue = """#!{python}
+import json
+import os
+import re
+import sys
+
+state_file = os.environ['COMPASS_FAKE_SLURM']
+with open(state_file) as f:
+    state = json.load(f)
+
+if state['squeue_errors'] > 0:
+    state['squeue_errors'] -= 1
+    with open(state_file, 'w') as f:
+        json.dump(state, f)
+    sys.stderr.write('slurm_load_jobs error: Socket timed out on send/recv '
+                     'operation\\n')
+    sys.exit(1)
+
+queued = list()
+job_ids = sys.argv[sys.argv.index('-j') + 1].split(',')
+for job_id in job_ids:
+    job = state['jobs'].get(job_id)
+    if job is None or job['polls'] >= state['polls_to_finish']:
+        continue
+    job['polls'] += 1
+    if job['polls'] < state['polls_to_finish']:
+        queued.append(job_id)
+        continue
+    with open(job['script']) as f:
+        script = f.read()
+    work_dir = re.search(r'^cd (\\S+)$', script, re.MULTILINE).group(1)
+    paths = re.findall(r'^    (\\S+)', script, re.MULTILINE)
+    for path in paths:
+        if path in state['unfinished']:
+            continue
+        filename = os.path.join(work_dir, 'case_outputs', '{{}}.json'.format(
+            path.replace('/', '_')))
+        with open(filename, 'w') as f:
+            json.dump({{'path': path, 'pass': True,
+                       'status': '  test execution:      SUCCESS',
+                       'time': 1., 'steps': None}}, f)
+
+with open(state_file, 'w') as f:
+    json.dump(state, f)
+if len(queued) == 0:
+    sys.stderr.write('slurm_load_jobs error: Invalid job id specified\\n')
+    sys.exit(1)
+print('\\n'.join(queued))
+"""
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bin_dir = os.path.join(temp_dir, 'bin')
+        work_dir = os.path.join(temp_dir, 'work')
+        os.makedirs(bin_dir)
+        for command, text in [('sbatch', _sbatch), ('squeue', _squeue)]:
+            filename = os.path.join(bin_dir, command)
+            with open(filename, 'w') as f:
+                f.write(text.format(python=sys.executable))
+            os.chmod(filename, 0o755)
+        os.environ['PATH'] = '{}:{}'.format(bin_dir, os.environ['PATH'])
+        state_file = os.path.join(temp_dir, 'state.json')
+        os.environ['COMPASS_FAKE_SLURM'] = state_file
+
+        paths = _write_suite(work_dir)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        failures = list()
+        try:
+            _check(failures, 'all test cases pass', state_file, work_dir,
+                   paths, jobs=2, expected_failures=0)
+
+            _check(failures, 'packed into one job', state_file, work_dir,
+                   paths, jobs=1, expected_failures=0, packed=True)
+
+            # the results from the previous check must not be counted
+            _check(failures, 'results from earlier runs are not counted',
+                   state_file, work_dir, paths, jobs=2, expected_failures=1,
+                   unfinished=paths[-1:])
+
+            # the jobs must not be considered done after a failure
+            _check(failures, 'temporary squeue failures are retried',
+                   state_file, work_dir, paths, jobs=2, expected_failures=0,
+                   squeue_errors=2)
+
+            _check(failures, 'squeue keeps failing', state_file, work_dir,
+                   paths, jobs=2, expected_failures=None, squeue_errors=100)
+        finally:
+            os.chdir(cwd)
+
+    if len(failures) > 0:
+        for failure in failures:
+            print('FAILED: {}'.format(failure))
+        sys.exit(1)
+    print('All Slurm job checks passed')
+
+
+def _write_suite(work_dir):
+    """
+    Write the manifest and config files of a suite with three test cases,
+    the second of which depends on the output of the first
+    """
+    config = configparser.ConfigParser()
+    config.read_string(resources.read_text('compass', 'default.cfg'))
+    config.read_dict({'parallel': {'cores_per_node': '4'},
+                      'job': {'poll_interval': '0', 'squeue_retries': '3'}})
+
+    os.makedirs(os.path.join(work_dir, 'case_outputs'))
+    entries = list()
+    paths = ['ocean/fake/case{}'.format(index + 1) for index in range(3)]
+    for index, path in enumerate(paths):
+        test_dir = os.path.join(work_dir, path)
+        step_dir = os.path.join(test_dir, 'step')
+        os.makedirs(step_dir)
+        name = os.path.basename(path)
+        config_filename = '{}.cfg'.format(name)
+        with open(os.path.join(test_dir, config_filename), 'w') as f:
+            config.write(f)
+        inputs = list()
+        if index == 1:
+            inputs.append(os.path.join(work_dir, paths[0], 'step', 'out.nc'))
+        step = {'name': 'step',
+                'class': 'compass.step.Step',
+                'path': os.path.join(path, 'step'),
+                'work_dir': step_dir,
+                'cores': 4 * (index + 1),
+                'min_cores': 1,
+                'threads': 1,
+                'cores_option': None,
+                'inputs': inputs,
+                'outputs': [os.path.join(step_dir, 'out.nc')]}
+        entries.append({'name': name,
+                        'class': 'compass.testcase.TestCase',
+                        'path': path,
+                        'work_dir': test_dir,
+                        'config_filename': config_filename,
+                        'steps_to_run': ['step'],
+                        'steps': [step]})
+
+    with open(os.path.join(work_dir, '{}.json'.format(_suite_name)),
+              'w') as f:
+        json.dump({'name': _suite_name, 'work_dir': work_dir,
+                   'test_cases': entries}, f, indent=4)
+    return paths
+
+
+def _check(failures, name, state_file, work_dir, paths, jobs,
+           expected_failures, packed=False, unfinished=None,
+           squeue_errors=0):
+    """
+    Submit the suite to the fake Slurm commands, then check how many jobs
+    were submitted, whether the wait ended as expected and the results that
+    were collected.  ``expected_failures`` is ``None`` if ``squeue`` should
+    keep failing.
+    """
+    if unfinished is None:
+        unfinished = list()
+    with open(state_file, 'w') as f:
+        json.dump({'next_id': 1000, 'jobs': dict(), 'polls_to_finish': 3,
+                   'unfinished': unfinished,
+                   'squeue_errors': squeue_errors}, f)
+
+    error = None
+    exit_code = 0
+    try:
+        submit_suite(_suite_name, packed=packed)
+    except SystemExit as e:
+        exit_code = e.code
+    except subprocess.CalledProcessError as e:
+        error = e
+
+    with open(state_file) as f:
+        state = json.load(f)
+
+    passed = True
+    if len(state['jobs']) != jobs:
+        failures.append('{}: expected {} job(s), got {}'.format(
+            name, jobs, len(state['jobs'])))
+        passed = False
+
+    if expected_failures is None:
+        if error is None:
+            failures.append('{}: squeue failures were ignored'.format(name))
+            passed = False
+    elif error is not None:
+        failures.append('{}: unexpected error {}'.format(name, error))
+        passed = False
+    else:
+        if exit_code != int(expected_failures > 0):
+            failures.append('{}: exit code {}'.format(name, exit_code))
+            passed = False
+        for job in state['jobs'].values():
+            if job['polls'] < state['polls_to_finish']:
+                failures.append('{}: stopped waiting before the jobs were '
+                                'done'.format(name))
+                passed = False
+                break
+        for path in paths:
+            result = read_test_case_result(work_dir, path)
+            if path in unfinished and result is not None:
+                failures.append('{}: {} has a result although it didn\'t '
+                                'finish'.format(name, path))
+                passed = False
+            elif path not in unfinished and result is None:
+                failures.append('{}: {} has no result'.format(name, path))
+                passed = False
+
+    print('{}: {}'.format(name, 'ok' if passed else 'FAILED'))
+
+
+if __name__ == '__main__':
+    main()
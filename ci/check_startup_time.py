@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Check that ``compass list`` starts up quickly, i.e. that it still only reads
+the test-case registry rather than importing and constructing every test
+case
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time "compass list" and fail if it is too slow')
+    parser.add_argument("-n", "--repeat", dest="repeat", type=int, default=5,
+                        help="The number of times to run compass list")
+    parser.add_argument("-m", "--max_time", dest="max_time", type=float,
+                        default=1.0,
+                        help="The maximum allowed median time in seconds")
+    args = parser.parse_args()
+
+    times = list()
+    for _ in range(args.repeat):
+        start = time.time()
+        subprocess.check_call(['compass', 'list'], stdout=subprocess.DEVNULL)
+        times.append(time.time() - start)
+
+    median = numpy.median(times)
+    print('compass list: median {:.3f} s, min {:.3f} s, max {:.3f} s over {} '
+          'runs'.format(median, min(times), max(times), args.repeat))
+    if median > args.max_time:
+        print('compass list took longer than {} s'.format(args.max_time))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
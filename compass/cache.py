@@ -0,0 +1,479 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import inspect
+import tempfile
+
+import compass
+
+
+def get_step_cache_dir(step):
+    """
+    Get the directory where outputs of steps are cached, from the
+    ``cache_dir`` option in the ``step_cache`` config section or the
+    ``step_cache`` subdirectory of the base work directory by default
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step that would use the cache
+
+    Returns
+    -------
+    cache_dir : str
+        The absolute path to the cache directory
+    """
+    config = step.config
+    cache_dir = None
+    if config.has_option('step_cache', 'cache_dir'):
+        cache_dir = config.get('step_cache', 'cache_dir')
+    if cache_dir is None or cache_dir == '':
+        cache_dir = os.path.join(step.base_work_dir, 'step_cache')
+    return os.path.abspath(cache_dir)
+
+
+def get_file_cache_dir(step, subdir):
+    """
+    Get the directory where a step caches intermediate files with
+    :py:func:`compass.cache.get_cached_file()`, which is only used if the
+    ``enabled`` option in the ``step_cache`` config section is ``True``
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step that would use the cache
+
+    subdir : str
+        The subdirectory of the step cache directory for these files
+
+    Returns
+    -------
+    cache_dir : str
+        The absolute path to the cache directory, or ``None`` if the step
+        cache is not enabled, in which case files are made without caching
+    """
+    config = step.config
+    if not config.has_option('step_cache', 'enabled') or \
+            not config.getboolean('step_cache', 'enabled'):
+        return None
+    return os.path.join(get_step_cache_dir(step), subdir)
+
+
+def compute_step_hash(step):
+    """
+    Compute a hash of everything the step consumes: the step's class and
+    resources, the contents of its input files (including the model
+    executable if it is an input), the namelist and streams files in its work
+    directory and its config options
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step to hash
+
+    Returns
+    -------
+    step_hash : str
+        A hexadecimal hash that identifies the step's results
+    """
+    sha = hashlib.sha256()
+    step_class = type(step)
+    _update(sha, 'compass {}'.format(compass.__version__))
+    _update(sha, '{}.{}'.format(step_class.__module__, step_class.__name__))
+    _update(sha, step.path)
+    _update(sha, 'cores {} threads {}'.format(step.cores, step.threads))
+
+    source_file = inspect.getsourcefile(step_class)
+    if source_file is not None:
+        _update(sha, hash_file(source_file))
+
+    for input_file in sorted(step.inputs):
+        _update(sha, os.path.basename(input_file))
+        _update(sha, _hash_path(input_file))
+
+    patterns = ['namelist.*', 'streams.*']
+    for pattern in patterns:
+        for filename in sorted(glob.glob(os.path.join(step.work_dir,
+                                                      pattern))):
+            _update(sha, os.path.basename(filename))
+            _update(sha, hash_file(filename))
+
+    config = step.config
+    for section in sorted(config.sections()):
+        if section in _ignored_config_sections:
+            continue
+        _update(sha, '[{}]'.format(section))
+        for option, value in sorted(config.items(section)):
+            _update(sha, '{} = {}'.format(option, value))
+
+    return sha.hexdigest()
+
+
+def restore_step_outputs(step, step_hash):
+    """
+    Restore the outputs of a step from the cache by hard-linking (or copying)
+    them into the step's work directory
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step whose outputs should be restored
+
+    step_hash : str
+        The hash of the step from :py:func:`compass.cache.compute_step_hash()`
+
+    Returns
+    -------
+    restored : bool
+        Whether the outputs were found in the cache and restored
+    """
+    entry_dir = _get_entry_dir(step, step_hash)
+    manifest_filename = os.path.join(entry_dir, 'manifest.json')
+    if not os.path.exists(manifest_filename):
+        return False
+
+    with open(manifest_filename) as f:
+        manifest = json.load(f)
+
+    outputs = _get_relative_outputs(step)
+    if outputs is None or sorted(outputs) != sorted(manifest['outputs']):
+        return False
+
+    for filename in outputs:
+        cached = os.path.join(entry_dir, 'outputs', filename)
+        if not os.path.exists(cached):
+            return False
+
+    for filename in outputs:
+        cached = os.path.join(entry_dir, 'outputs', filename)
+        output_file = os.path.join(step.work_dir, filename)
+        if os.path.lexists(output_file):
+            os.remove(output_file)
+        _link_or_copy(cached, output_file)
+
+    return True
+
+
+def store_step_outputs(step, step_hash):
+    """
+    Store the outputs of a step that has run successfully in the cache.  The
+    outputs are hard-linked (or copied) into the cache under ``step_hash``.
+    If the step modified its namelist or streams files while running, the
+    entry is also made available under the hash of the step as it is now, so
+    the next run of the unchanged step finds it.
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step whose outputs should be stored
+
+    step_hash : str
+        The hash of the step from :py:func:`compass.cache.compute_step_hash()`
+        before it ran
+
+    Returns
+    -------
+    stored : bool
+        Whether the outputs were stored
+    """
+    outputs = _get_relative_outputs(step)
+    if outputs is None or len(outputs) == 0:
+        return False
+
+    entry_dir = _get_entry_dir(step, step_hash)
+    if not os.path.exists(entry_dir):
+        parent_dir = os.path.dirname(entry_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        # build the entry in a temporary directory and rename it into place
+        # so an interrupted run never leaves a partial entry
+        temp_dir = tempfile.mkdtemp(dir=parent_dir)
+        try:
+            for filename in outputs:
+                cached = os.path.join(temp_dir, 'outputs', filename)
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                _link_or_copy(os.path.join(step.work_dir, filename), cached)
+            manifest = dict(step=step.path, outputs=outputs)
+            with open(os.path.join(temp_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=4)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                raise
+
+    new_hash = compute_step_hash(step)
+    if new_hash != step_hash:
+        alias_dir = _get_entry_dir(step, new_hash)
+        if not os.path.lexists(alias_dir):
+            os.makedirs(os.path.dirname(alias_dir), exist_ok=True)
+            try:
+                os.symlink(entry_dir, alias_dir)
+            except FileExistsError:
+                pass
+
+    return True
+
+
+def read_cached(filename, read, *args):
+    """
+    Read a file with the given function, reusing the result from an earlier
+    call in this process if the file has not been modified since (as
+    determined from its modification time and size)
+
+    Parameters
+    ----------
+    filename : str
+        The file to read
+
+    read : function
+        The function that reads the file, called as ``read(filename, *args)``
+
+    *args
+        Additional arguments to ``read``, which must be hashable
+
+    Returns
+    -------
+    result : object
+        The result of ``read``, which is shared between callers so it must
+        not be modified
+    """
+    filename = os.path.realpath(filename)
+    stat = os.stat(filename)
+    key = (filename, read) + args
+    version = (stat.st_mtime_ns, stat.st_size)
+    if key not in _read_results or _read_results[key][0] != version:
+        _read_results[key] = (version, read(filename, *args))
+    return _read_results[key][1]
+
+
+def hash_file(filename):
+    """
+    Compute a hash of the contents of a file, reusing the hash if the file
+    has not been modified since it was last hashed
+
+    Parameters
+    ----------
+    filename : str
+        The file to hash
+
+    Returns
+    -------
+    file_hash : str
+        The hexadecimal sha256 hash of the file
+    """
+    return read_cached(filename, _hash_contents)
+
+
+def hash_mesh(filename):
+    """
+    Compute a hash of the coordinates and connectivity of the MPAS mesh in a
+    file.  Unlike a hash of the whole file, this doesn't change when the same
+    mesh is made again (e.g. with a new random ``file_id``) or when the file
+    also contains other variables (e.g. the model state in a restart file).
+
+    Parameters
+    ----------
+    filename : str
+        A file with an MPAS mesh
+
+    Returns
+    -------
+    mesh_hash : str
+        The hexadecimal sha256 hash of the mesh
+    """
+    return read_cached(filename, _hash_mesh_variables)
+
+
+def hash_items(items):
+    """
+    Compute a hash of items (e.g. names, options, versions and hashes of
+    input files) that together determine the contents of a file
+
+    Parameters
+    ----------
+    items : list
+        The items to hash, each of which is converted to a string
+
+    Returns
+    -------
+    key : str
+        A hexadecimal hash of the items, e.g. for
+        :py:func:`compass.cache.get_cached_file()`
+    """
+    sha = hashlib.sha256()
+    for item in items:
+        _update(sha, '{}'.format(item))
+    return sha.hexdigest()
+
+
+def get_cached_file(filename, key, cache_dir, make):
+    """
+    Restore a file from a cache directory by hard-linking (or copying) it if
+    it has been made before with the same key.  Otherwise, make the file and
+    add it to the cache.
+
+    Parameters
+    ----------
+    filename : str
+        The file to restore or make
+
+    key : str
+        A hash of everything the contents of the file depend on
+
+    cache_dir : str
+        The cache directory, or ``None`` to always make the file without
+        caching it
+
+    make : function
+        A function with no arguments that makes ``filename``
+
+    Returns
+    -------
+    restored : bool
+        Whether the file was restored from the cache
+    """
+    # the file may be a hard link to a cached file that must not be modified
+    if os.path.lexists(filename):
+        os.remove(filename)
+
+    if cache_dir is None:
+        make()
+        return False
+
+    entry_dir = os.path.join(cache_dir, key[0:2], key)
+    cached = os.path.join(entry_dir, os.path.basename(filename))
+    if os.path.exists(cached):
+        _link_or_copy(cached, filename)
+        return True
+
+    make()
+
+    parent_dir = os.path.dirname(entry_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    # as for step outputs, the entry is renamed into place once it's complete
+    temp_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        _link_or_copy(filename, os.path.join(temp_dir,
+                                             os.path.basename(filename)))
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.exists(entry_dir):
+            raise
+    return False
+
+
+def clear_stale_outputs(step):
+    """
+    Remove outputs of a step that are hard links (e.g. to the cache) before
+    the step runs, so that writing new outputs in place cannot modify cached
+    files
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step that is about to run
+    """
+    for output_file in step.outputs:
+        if os.path.isfile(output_file) and \
+                os.stat(output_file).st_nlink > 1:
+            os.remove(output_file)
+
+
+# the variables that define the horizontal coordinates and connectivity of an
+# MPAS mesh, those in a file are included in its hash
+_mesh_variables = ['xCell', 'yCell', 'zCell', 'latCell', 'lonCell',
+                   'xEdge', 'yEdge', 'zEdge', 'latEdge', 'lonEdge',
+                   'xVertex', 'yVertex', 'zVertex', 'latVertex', 'lonVertex',
+                   'nEdgesOnCell', 'cellsOnCell', 'edgesOnCell',
+                   'verticesOnCell', 'cellsOnEdge', 'verticesOnEdge',
+                   'cellsOnVertex', 'edgesOnVertex']
+
+# config sections that don't affect the results of a step
+_ignored_config_sections = ['test_case', 'step_cache', 'deploy']
+
+# the results of read_cached() with the file, the function that read it and
+# its arguments as keys, and the modification time and size of the file
+# along with each result
+_read_results = dict()
+
+
+def _get_entry_dir(step, step_hash):
+    """ Get the directory for a cache entry """
+    return os.path.join(get_step_cache_dir(step), step_hash[0:2], step_hash)
+
+
+def _get_relative_outputs(step):
+    """
+    Get the outputs relative to the step's work directory, or ``None`` if any
+    are outside of it
+    """
+    outputs = list()
+    for output_file in step.outputs:
+        filename = os.path.relpath(output_file, step.work_dir)
+        if filename.startswith('..'):
+            return None
+        outputs.append(filename)
+    return outputs
+
+
+def _link_or_copy(source, dest):
+    """ Make a hard link if possible, falling back on a copy """
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def _update(sha, text):
+    sha.update(text.encode('utf-8'))
+    sha.update(b'\0')
+
+
+def _hash_contents(filename):
+    """ Compute a hash of the contents of a file """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _hash_mesh_variables(filename):
+    """ Compute a hash of the mesh variables in a file """
+    # netCDF4 is slow to import and only needed here
+    import netCDF4
+
+    sha = hashlib.sha256()
+    with netCDF4.Dataset(filename, 'r') as ds:
+        ds.set_auto_mask(False)
+        _update(sha, 'on_a_sphere {}'.format(
+            getattr(ds, 'on_a_sphere', 'NO')))
+        for name in _mesh_variables:
+            if name not in ds.variables:
+                continue
+            var = ds.variables[name]
+            _update(sha, '{} {} {}'.format(name, var.dtype, var.shape))
+            # read large variables a slice at a time along the first dimension
+            for start in range(0, var.shape[0], 2**20):
+                sha.update(var[start:start + 2**20].tobytes())
+    return sha.hexdigest()
+
+
+def _hash_path(path):
+    """ Hash a file or the contents of a directory """
+    if os.path.isdir(path):
+        sha = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                full_path = os.path.join(root, filename)
+                _update(sha, os.path.relpath(full_path, path))
+                _update(sha, hash_file(full_path))
+        return sha.hexdigest()
+    elif os.path.exists(path):
+        return hash_file(path)
+    else:
+        return 'missing'
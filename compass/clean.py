@@ -3,7 +3,7 @@ import sys
 import os
 import shutil
 
-from compass.mpas_cores import get_mpas_cores
+from compass.mpas_cores import get_test_case_paths, get_test_cases
 from compass import provenance
 
 
@@ -29,29 +29,22 @@ def clean_cases(tests=None, numbers=None, work_dir=None):
     if work_dir is None:
         work_dir = os.getcwd()
 
-    mpas_cores = get_mpas_cores()
-    all_test_cases = dict()
-    for mpas_core in mpas_cores:
-        for test_group in mpas_core.test_groups.values():
-            for test_case in test_group.test_cases.values():
-                all_test_cases[test_case.path] = test_case
-
-    test_cases = dict()
+    # only the test groups with the requested test cases are constructed
+    paths = list()
     if numbers is not None:
-        keys = list(all_test_cases)
+        keys = get_test_case_paths()
         for number in numbers:
             if number >= len(keys):
                 raise ValueError('test number {} is out of range.  There are '
                                  'only {} tests.'.format(number, len(keys)))
-            path = keys[number]
-            test_cases[path] = all_test_cases[path]
+            paths.append(keys[number])
 
     if tests is not None:
         for path in tests:
-            if path not in all_test_cases:
-                raise ValueError('Test case with path {} is not in '
-                                 'the list of test cases'.format(path))
-            test_cases[path] = all_test_cases[path]
+            if path not in paths:
+                paths.append(path)
+
+    test_cases = get_test_cases(paths)
 
     provenance.write(work_dir, test_cases)
 
@@ -1,8 +1,17 @@
 import os
 import tempfile
+import threading
 import requests
+import requests.adapters
 import progressbar
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# the size of chunks to read and write while downloading
+_chunk_size = 1024 * 1024
+
+# a lock so messages from concurrent downloads don't get interleaved
+_print_lock = threading.Lock()
 
 
 def download(url, dest_path, config, exceptions=True):
@@ -31,9 +40,7 @@ def download(url, dest_path, config, exceptions=True):
         The resulting file name if the download was successful, or None if not
     """
 
-    in_file_name = os.path.basename(urlparse(url).path)
     dest_path = os.path.abspath(dest_path)
-    out_file_name = os.path.basename(dest_path)
 
     do_download = config.getboolean('download', 'download')
     check_size = config.getboolean('download', 'check_size')
@@ -52,85 +59,79 @@ def download(url, dest_path, config, exceptions=True):
     if not verify:
         session.verify = False
 
-    # dest_path contains full path, so we need to make the relevant
-    # subdirectories if they do not exist already
-    directory = os.path.dirname(dest_path)
-    try:
-        os.makedirs(directory)
-    except OSError:
-        pass
+    if not _download_with_exceptions(session, url, dest_path, check_size,
+                                     exceptions, progress=True):
+        return None
 
-    try:
-        response = session.get(url, stream=True)
-        totalSize = response.headers.get('content-length')
-    except requests.exceptions.RequestException:
-        if exceptions:
-            raise
-        else:
-            print('  {} could not be reached!'.format(url))
-            return None
+    return dest_path
 
-    try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        if exceptions:
-            raise
-        else:
-            print('ERROR while downloading {}:'.format(in_file_name))
-            print(e)
-            return None
 
-    if totalSize is None:
-        # no content length header
-        if not os.path.exists(dest_path):
-            with open(dest_path, 'wb') as f:
-                print('Downloading {}...'.format(in_file_name))
-                try:
-                    f.write(response.content)
-                except requests.exceptions.RequestException:
-                    if exceptions:
-                        raise
-                    else:
-                        print('  {} failed!'.format(in_file_name))
-                        return None
-                else:
-                    print('  {} done.'.format(in_file_name))
+def download_files(downloads, config, exceptions=True):
+    """
+    Download many files concurrently through a pool of connections.  Files
+    that were partially downloaded (e.g. because setup was interrupted) are
+    resumed if the server supports it, and each file is written to a
+    temporary file that is only renamed to ``dest_path`` once the download
+    is complete.
+
+    Parameters
+    ----------
+    downloads : list of tuple
+        The URL and destination path of each file to download.  Duplicate
+        destination paths are only downloaded once.
+
+    config : configparser.ConfigParser
+        Configuration options for downloading, including the number of
+        ``concurrent_downloads``
+
+    exceptions : bool, optional
+        Whether to raise exceptions when a download fails
+    """
+
+    do_download = config.getboolean('download', 'download')
+    check_size = config.getboolean('download', 'check_size')
+    verify = config.getboolean('download', 'verify')
+    if config.has_option('download', 'concurrent_downloads'):
+        max_workers = config.getint('download', 'concurrent_downloads')
     else:
-        # we can do the download in chunks and use a progress bar, yay!
+        max_workers = 1
 
-        totalSize = int(totalSize)
-        if os.path.exists(dest_path) and \
-                totalSize == os.path.getsize(dest_path):
-            # we already have the file, so just return
-            return dest_path
-
-        if out_file_name == in_file_name:
-            file_names = in_file_name
-        else:
-            file_names = '{} as {}'.format(in_file_name, out_file_name)
-        print('Downloading {} ({})...'.format(file_names,
-                                              _sizeof_fmt(totalSize)))
-        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
-                   ' ', progressbar.ETA()]
-        bar = progressbar.ProgressBar(widgets=widgets,
-                                      max_value=totalSize).start()
-        size = 0
-        with open(dest_path, 'wb') as f:
-            try:
-                for data in response.iter_content(chunk_size=4096):
-                    size += len(data)
-                    f.write(data)
-                    bar.update(size)
-                bar.finish()
-            except requests.exceptions.RequestException:
-                if exceptions:
-                    raise
-                else:
-                    print('  {} failed!'.format(in_file_name))
-                    return None
-            else:
-                print('  {} done.'.format(in_file_name))
-    return dest_path
+    to_download = dict()
+    for url, dest_path in downloads:
+        dest_path = os.path.abspath(dest_path)
+        if dest_path in to_download:
+            continue
+        if not do_download:
+            if not os.path.exists(dest_path):
+                raise OSError('File not found and downloading is disabled: '
+                              '{}'.format(dest_path))
+            continue
+        if not check_size and os.path.exists(dest_path):
+            continue
+        to_download[dest_path] = url
+
+    if len(to_download) == 0:
+        return
+
+    max_workers = max(1, min(max_workers, len(to_download)))
+
+    session = requests.Session()
+    if not verify:
+        session.verify = False
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                            pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = list()
+        for dest_path, url in to_download.items():
+            futures.append(executor.submit(
+                _download_with_exceptions, session, url, dest_path,
+                check_size, exceptions, progress=False))
+        for future in as_completed(futures):
+            # raise any exceptions from the download
+            future.result()
 
 
 def symlink(target, link_name, overwrite=True):
@@ -185,6 +186,125 @@ def symlink(target, link_name, overwrite=True):
         raise
 
 
+def _download_with_exceptions(session, url, dest_path, check_size,
+                              exceptions, progress):
+    """
+    Download a file, raising exceptions or printing errors and returning
+    ``False`` if the download failed
+    """
+    in_file_name = os.path.basename(urlparse(url).path)
+    try:
+        _download_file(session, url, dest_path, check_size, progress)
+    except requests.exceptions.HTTPError as e:
+        if exceptions:
+            raise
+        _print('ERROR while downloading {}:\n{}'.format(in_file_name, e))
+        return False
+    except (requests.exceptions.RequestException, OSError):
+        if exceptions:
+            raise
+        _print('  {} failed!'.format(in_file_name))
+        return False
+    return True
+
+
+def _download_file(session, url, dest_path, check_size, progress):
+    """
+    Download a file to a temporary ``.part`` file (resuming a previous partial
+    download if possible) and rename it to ``dest_path`` when it is complete
+    """
+    in_file_name = os.path.basename(urlparse(url).path)
+    out_file_name = os.path.basename(dest_path)
+
+    if check_size and os.path.exists(dest_path):
+        response = session.head(url, allow_redirects=True)
+        response.raise_for_status()
+        total_size = response.headers.get('content-length')
+        if total_size is None or \
+                int(total_size) == os.path.getsize(dest_path):
+            # we already have the file, so just return
+            return
+
+    # dest_path contains full path, so we need to make the relevant
+    # subdirectories if they do not exist already
+    directory = os.path.dirname(dest_path)
+    os.makedirs(directory, exist_ok=True)
+
+    part_path = '{}.part'.format(dest_path)
+    offset = 0
+    headers = dict()
+    if os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+    response = session.get(url, stream=True, headers=headers)
+    if response.status_code == 416:
+        # the partial file can't be resumed, so start over
+        response.close()
+        offset = 0
+        response = session.get(url, stream=True)
+    response.raise_for_status()
+
+    if response.status_code != 206:
+        # the server sent the whole file
+        offset = 0
+
+    total_size = response.headers.get('content-length')
+    if total_size is not None:
+        total_size = int(total_size) + offset
+
+    if out_file_name == in_file_name:
+        file_names = in_file_name
+    else:
+        file_names = '{} as {}'.format(in_file_name, out_file_name)
+    if total_size is None:
+        _print('Downloading {}...'.format(file_names))
+    elif offset > 0:
+        _print('Resuming {} ({} of {})...'.format(
+            file_names, _sizeof_fmt(offset), _sizeof_fmt(total_size)))
+    else:
+        _print('Downloading {} ({})...'.format(file_names,
+                                               _sizeof_fmt(total_size)))
+
+    bar = None
+    if progress and total_size is not None:
+        widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
+                   ' ', progressbar.ETA()]
+        bar = progressbar.ProgressBar(widgets=widgets,
+                                      max_value=total_size).start()
+
+    size = offset
+    if offset > 0:
+        mode = 'ab'
+    else:
+        mode = 'wb'
+    with open(part_path, mode) as f:
+        for data in response.iter_content(chunk_size=_chunk_size):
+            size += len(data)
+            f.write(data)
+            if bar is not None:
+                bar.update(size)
+    if bar is not None:
+        bar.finish()
+
+    if total_size is not None and size != total_size:
+        raise OSError('Download of {} is incomplete: {} of {} bytes'.format(
+            in_file_name, size, total_size))
+
+    os.replace(part_path, dest_path)
+    _print('  {} done.'.format(in_file_name))
+
+
+def _print(message):
+    """
+    Print a message from a download in one piece, even if other downloads
+    are printing at the same time
+    """
+    with _print_lock:
+        print(message, flush=True)
+
+
 # From https://stackoverflow.com/a/1094933/7728169
 def _sizeof_fmt(num, suffix='B'):
     """
@@ -0,0 +1,389 @@
+import os
+import sys
+import time
+import configparser
+import subprocess
+from importlib import resources
+
+import numpy
+from jinja2 import Template
+from mpas_tools.logging import LoggingContext
+
+from compass.manifest import read_suite_manifest
+from compass.parallel import get_test_case_dependencies, get_test_case_cores
+from compass.profile import write_suite_profile
+from compass.run import read_test_case_result, remove_test_case_result, \
+    log_suite_summary, fail_str
+
+
+def plan_jobs(suite_name, packed=False):
+    """
+    Divide a test suite that has been set up into Slurm batch jobs.  By
+    default, there is one job for each independent chain of test cases (test
+    cases that depend on one another's outputs), each with enough nodes for
+    the largest step in the chain.  Alternatively, all test cases can be
+    packed into a single multi-node job.  The wall-clock time of each job is
+    estimated from the runtimes of the test cases the last time they ran as
+    part of the suite.
+
+    Parameters
+    ----------
+    suite_name : str
+        The name of the test suite, which must have been set up in the current
+        directory
+
+    packed : bool, optional
+        Whether to pack all test cases into one job
+
+    Returns
+    -------
+    jobs : list of dict
+        The jobs, each with the ``name`` of the job, the ``test_cases`` (the
+        paths of the test cases) it runs, the number of ``nodes`` and the
+        wall-clock ``time`` in minutes to request
+    """
+    test_suite = _read_suite(suite_name)
+    test_cases = test_suite['test_cases']
+    config = _get_config(test_cases)
+    cores_per_node = config.getint('parallel', 'cores_per_node')
+    max_nodes = config.getint('job', 'max_nodes')
+
+    dependencies = get_test_case_dependencies(test_cases)
+    test_cores = dict()
+    runtimes = dict()
+    default_time = 60. * config.getfloat('job', 'default_test_case_time')
+    for path, test_case in test_cases.items():
+        test_config = _get_test_case_config(test_case)
+        test_cores[path] = get_test_case_cores(test_case, sys.maxsize,
+                                               test_config)
+        result = read_test_case_result(test_suite['work_dir'], path)
+        if result is None:
+            runtimes[path] = default_time
+        else:
+            runtimes[path] = result['time']
+
+    if packed:
+        groups = [list(test_cases)]
+    else:
+        groups = _get_chains(list(test_cases), dependencies)
+
+    jobs = list()
+    for index, paths in enumerate(groups):
+        max_cores = max([test_cores[path] for path in paths])
+        nodes = int(numpy.ceil(max_cores / cores_per_node))
+        if packed:
+            total_cores = sum([test_cores[path] for path in paths])
+            nodes = max(nodes, min(max_nodes, int(numpy.ceil(
+                total_cores / cores_per_node))))
+
+        makespan = _estimate_makespan(paths, dependencies, test_cores,
+                                      runtimes, nodes * cores_per_node)
+        job_time = _get_job_time(makespan, config)
+
+        if len(groups) == 1:
+            name = 'compass_{}'.format(suite_name)
+        else:
+            name = 'compass_{}_{}'.format(suite_name, index + 1)
+        jobs.append({'name': name,
+                     'test_cases': paths,
+                     'nodes': nodes,
+                     'time': job_time})
+
+    return jobs
+
+
+def write_job_scripts(suite_name, packed=False):
+    """
+    Write a Slurm job script for each of the jobs from
+    :py:func:`compass.job.plan_jobs()` to the ``jobs`` subdirectory of the
+    suite's work directory.  Each job runs its test cases with
+    ``compass run --parallel``, so steps run concurrently (with ``srun``)
+    inside the job's allocation.
+
+    Parameters
+    ----------
+    suite_name : str
+        The name of the test suite, which must have been set up in the current
+        directory
+
+    packed : bool, optional
+        Whether to pack all test cases into one job
+
+    Returns
+    -------
+    jobs : list of dict
+        The jobs from :py:func:`compass.job.plan_jobs()`, with the absolute
+        path of the job ``script`` added
+    """
+    test_suite = _read_suite(suite_name)
+    work_dir = test_suite['work_dir']
+    config = _get_config(test_suite['test_cases'])
+    jobs = plan_jobs(suite_name, packed=packed)
+
+    account = config.get('job', 'account')
+    if account == '' and config.has_option('parallel', 'account'):
+        account = config.get('parallel', 'account')
+
+    load_script = os.path.join(work_dir, 'load_compass_env.sh')
+    if not os.path.exists(load_script):
+        load_script = None
+
+    jobs_dir = os.path.join(work_dir, 'jobs')
+    try:
+        os.makedirs(jobs_dir)
+    except OSError:
+        pass
+
+    template = Template(resources.read_text('compass.machines',
+                                            'job_script.slurm.template'))
+    for job in jobs:
+        hours, minutes = divmod(job['time'], 60)
+        job_info = dict(job)
+        job_info.update({'time': '{:02d}:{:02d}:00'.format(hours, minutes),
+                         'account': account,
+                         'qos': config.get('job', 'qos'),
+                         'partition': config.get('job', 'partition'),
+                         'load_script': load_script,
+                         'work_dir': work_dir,
+                         'suite': suite_name})
+        script = os.path.join(jobs_dir, '{}.sh'.format(job['name']))
+        with open(script, 'w') as f:
+            f.write(template.render(job=job_info))
+        job['script'] = script
+
+    return jobs
+
+
+def submit_suite(suite_name, packed=False, wait=True):
+    """
+    Submit a test suite as Slurm batch jobs and, optionally, wait for the
+    jobs to finish and log a summary of the results of all the jobs
+
+    Parameters
+    ----------
+    suite_name : str
+        The name of the test suite, which must have been set up in the current
+        directory
+
+    packed : bool, optional
+        Whether to pack all test cases into one job
+
+    wait : bool, optional
+        Whether to wait for the jobs to finish and log a summary of the
+        results
+    """
+    test_suite = _read_suite(suite_name)
+    config = _get_config(test_suite['test_cases'])
+
+    with LoggingContext(suite_name) as logger:
+        jobs = write_job_scripts(suite_name, packed=packed)
+        work_dir = test_suite['work_dir']
+        jobs_dir = os.path.join(work_dir, 'jobs')
+        for job in jobs:
+            # results from earlier runs would be collected in place of those
+            # of test cases that don't finish (e.g. if the job times out)
+            for path in job['test_cases']:
+                remove_test_case_result(work_dir, path)
+            output = subprocess.check_output(
+                ['sbatch', '--parsable', job['script']], cwd=jobs_dir)
+            # the output is the job ID, possibly followed by the cluster
+            job['id'] = output.decode('utf-8').strip().split(';')[0]
+            logger.info('Submitted job {} ({} on {} node(s) for {} min): {}'
+                        ''.format(job['id'], job['name'], job['nodes'],
+                                  job['time'], ', '.join(job['test_cases'])))
+
+        if not wait:
+            return
+
+        start = time.time()
+        poll_interval = config.getfloat('job', 'poll_interval')
+        max_retries = config.getint('job', 'squeue_retries')
+        retries = 0
+        job_ids = [job['id'] for job in jobs]
+        while len(job_ids) > 0:
+            time.sleep(poll_interval)
+            try:
+                job_ids = _get_queued_jobs(job_ids)
+                retries = 0
+            except subprocess.CalledProcessError as e:
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                logger.warning('squeue failed, trying again: {}'.format(
+                    e.stderr.decode('utf-8').strip()))
+
+        failures = collect_results(suite_name, logger,
+                                   suite_time=time.time() - start)
+        if failures > 0:
+            sys.exit(1)
+
+
+def collect_results(suite_name, logger, suite_time=0.):
+    """
+    Collect the results of all test cases in a suite (e.g. run in several
+    batch jobs) and log them as ``compass run`` would for the whole suite.
+    Test cases without results (e.g. because a job ran out of time) are
+    counted as failures.  The profiles of the steps in all jobs are written
+    together with :py:func:`compass.profile.write_suite_profile()`.
+
+    Parameters
+    ----------
+    suite_name : str
+        The name of the test suite, which must have been set up in the current
+        directory
+
+    logger : logging.Logger
+        The logger for the suite
+
+    suite_time : float, optional
+        The wall-clock time in seconds the suite took to run
+
+    Returns
+    -------
+    failures : int
+        The number of test cases that failed
+    """
+    test_suite = _read_suite(suite_name)
+    work_dir = test_suite['work_dir']
+    results = dict()
+    profiles = dict()
+    for path in test_suite['test_cases']:
+        result = read_test_case_result(work_dir, path)
+        profiles[path] = result
+        logger.info('{}'.format(path))
+        if result is None:
+            results[path] = (False, '  test execution:      {}'.format(
+                fail_str), 0.)
+            logger.error('  test case did not finish, see the job output '
+                         'in: jobs')
+        else:
+            results[path] = (result['pass'], result['status'],
+                             result['time'])
+            if result['pass']:
+                logger.info(result['status'])
+            else:
+                test_name = path.replace('/', '_')
+                logger.error(result['status'])
+                logger.error('  see: case_outputs/{}.log'.format(test_name))
+
+    write_suite_profile(work_dir, suite_name, profiles)
+
+    return log_suite_summary(logger, results, suite_time)
+
+
+def _read_suite(suite_name):
+    """ Read the manifest of a suite set up in the current directory """
+    manifest_file = '{}.json'.format(suite_name)
+    if not os.path.exists(manifest_file):
+        raise ValueError('The suite "{}" doesn\'t appear to have been set up '
+                         'here.'.format(suite_name))
+    return read_suite_manifest(manifest_file)
+
+
+def _get_config(test_cases):
+    """ Read the config options of the first test case in a suite """
+    return _get_test_case_config(next(iter(test_cases.values())))
+
+
+def _get_test_case_config(test_case):
+    """ Read the config options of a test case in a suite """
+    config = configparser.ConfigParser(
+        interpolation=configparser.ExtendedInterpolation())
+    config.read(os.path.join(test_case.work_dir, test_case.config_filename))
+    return config
+
+
+def _get_chains(paths, dependencies):
+    """
+    Group test cases into chains that depend on each other's outputs,
+    keeping the order of the test cases in the suite
+    """
+    neighbors = {path: set() for path in paths}
+    for path in paths:
+        for other in dependencies[path]:
+            neighbors[path].add(other)
+            neighbors[other].add(path)
+
+    chains = list()
+    assigned = set()
+    for path in paths:
+        if path in assigned:
+            continue
+        chain = set()
+        stack = [path]
+        while len(stack) > 0:
+            current = stack.pop()
+            if current not in chain:
+                chain.add(current)
+                stack.extend(neighbors[current])
+        assigned.update(chain)
+        chains.append([other for other in paths if other in chain])
+    return chains
+
+
+def _estimate_makespan(paths, dependencies, test_cores, runtimes,
+                       available_cores):
+    """
+    Estimate the time it takes to run test cases concurrently on the given
+    number of cores, launching each once the test cases it depends on have
+    finished and enough cores are free, as in ``compass run --parallel``
+    """
+    now = 0.
+    free_cores = available_cores
+    pending = list(paths)
+    running = list()
+    finished = set()
+    while len(pending) > 0 or len(running) > 0:
+        for path in list(pending):
+            if not dependencies[path].issubset(finished):
+                continue
+            cores = min(test_cores[path], available_cores)
+            if cores > free_cores and len(running) > 0:
+                continue
+            running.append((now + runtimes[path], path))
+            free_cores -= cores
+            pending.remove(path)
+
+        if len(running) == 0:
+            raise ValueError('Circular dependencies between test cases: '
+                             '{}'.format(', '.join(pending)))
+
+        running.sort()
+        now, path = running.pop(0)
+        free_cores += min(test_cores[path], available_cores)
+        finished.add(path)
+
+    return now
+
+
+def _get_job_time(makespan, config):
+    """
+    Get the wall-clock time in minutes to request for a job, adding a margin
+    to the estimated time and keeping it within the allowed range
+    """
+    margin = config.getfloat('job', 'time_margin')
+    min_time = config.getint('job', 'min_time')
+    max_time = config.getint('job', 'max_time')
+    job_time = int(numpy.ceil(margin * makespan / 60.))
+    return min(max(job_time, min_time), max_time)
+
+
+def _get_queued_jobs(job_ids):
+    """
+    Get the jobs in a list that are still pending or running, raising a
+    ``subprocess.CalledProcessError`` if ``squeue`` fails for any other reason
+    than that the jobs are no longer known
+    """
+    args = ['squeue', '--noheader', '-o', '%i', '-j', ','.join(job_ids)]
+    process = subprocess.run(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        # squeue fails if none of the jobs are known anymore, because they
+        # finished long enough ago
+        if 'Invalid job id' in process.stderr.decode('utf-8'):
+            return list()
+        raise subprocess.CalledProcessError(
+            process.returncode, args, output=process.stdout,
+            stderr=process.stderr)
+    queued = process.stdout.decode('utf-8').split()
+    return [job_id for job_id in job_ids if job_id in queued]
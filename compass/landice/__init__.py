@@ -1,9 +1,4 @@
 from compass.mpas_core import MpasCore
-from compass.landice.tests.dome import Dome
-from compass.landice.tests.eismint2 import Eismint2
-from compass.landice.tests.enthalpy_benchmark import EnthalpyBenchmark
-from compass.landice.tests.greenland import Greenland
-from compass.landice.tests.hydro_radial import HydroRadial
 
 
 class Landice(MpasCore):
@@ -11,14 +6,25 @@ class Landice(MpasCore):
     The collection of all test case for the MALI core
     """
 
-    def __init__(self):
+    def __init__(self, test_group_names=None):
         """
         Construct the collection of MALI test cases
+
+        Parameters
+        ----------
+        test_group_names : list of str, optional
+            The names of the test groups to add.  By default, all test groups
+            are added.
         """
-        super().__init__(name='landice')
+        super().__init__(name='landice', test_group_names=test_group_names)
 
-        self.add_test_group(Dome(mpas_core=self))
-        self.add_test_group(Eismint2(mpas_core=self))
-        self.add_test_group(EnthalpyBenchmark(mpas_core=self))
-        self.add_test_group(Greenland(mpas_core=self))
-        self.add_test_group(HydroRadial(mpas_core=self))
+        self.add_test_group_from_package(
+            'compass.landice.tests.dome', 'Dome')
+        self.add_test_group_from_package(
+            'compass.landice.tests.eismint2', 'Eismint2')
+        self.add_test_group_from_package(
+            'compass.landice.tests.enthalpy_benchmark', 'EnthalpyBenchmark')
+        self.add_test_group_from_package(
+            'compass.landice.tests.greenland', 'Greenland')
+        self.add_test_group_from_package(
+            'compass.landice.tests.hydro_radial', 'HydroRadial')
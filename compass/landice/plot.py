@@ -0,0 +1,35 @@
+def plot_figure(step, hide_figs, filename, function, **kwargs):
+    """
+    Draw a figure for a visualization step.  If figures are hidden, the
+    figure is rendered in the background by the step (see
+    :py:meth:`compass.Step.add_plot()`), or not at all if it isn't saved to
+    a file either.  Otherwise, the figure is drawn right away so it can be
+    shown with ``plt.show()`` once all figures have been drawn.
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step to render the figure, or ``None`` to draw it right away
+
+    hide_figs : bool
+        Whether figures are hidden rather than shown
+
+    filename : str
+        The image file to save the figure to, or ``None`` if it isn't saved
+
+    function : function
+        A function at the top level of a module that draws the figure,
+        saving it to its ``out_filename`` argument if it is not ``None``
+
+    **kwargs
+        Keyword arguments to ``function`` other than ``out_filename``,
+        typically the data to plot
+    """
+    if hide_figs and filename is None:
+        # there's nothing to show or save
+        return
+
+    if hide_figs and step is not None:
+        step.add_plot(filename, function, out_filename=filename, **kwargs)
+    else:
+        function(out_filename=filename, **kwargs)
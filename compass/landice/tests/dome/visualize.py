@@ -2,6 +2,7 @@ import numpy
 import netCDF4
 import matplotlib.pyplot as plt
 
+from compass.landice.plot import plot_figure
 from compass.step import Step
 
 
@@ -52,10 +53,11 @@ class Visualize(Step):
         """
         Run this step of the test case
         """
-        visualize_dome(self.config, self.logger, filename='output.nc')
+        visualize_dome(self.config, self.logger, filename='output.nc',
+                       step=self)
 
 
-def visualize_dome(config, logger, filename):
+def visualize_dome(config, logger, filename, step=None):
     """
     Plot the output from a dome test case
 
@@ -70,6 +72,10 @@ def visualize_dome(config, logger, filename):
 
     filename : str
         file to visualize
+
+    step : compass.Step, optional
+        If provided and figures are hidden, the step renders the figures in
+        the background
     """
     section = config['dome_viz']
 
@@ -86,11 +92,11 @@ def visualize_dome(config, logger, filename):
     thickness = f.variables['thickness']
     # dcEdge = f.variables['dcEdge']
     # bedTopography = f.variables['bedTopography']  # not needed
-    xCell = f.variables['xCell']
-    yCell = f.variables['yCell']
-    xEdge = f.variables['xEdge']
-    yEdge = f.variables['yEdge']
-    angleEdge = f.variables['angleEdge']
+    xCell = f.variables['xCell'][:]
+    yCell = f.variables['yCell'][:]
+    xEdge = f.variables['xEdge'][:]
+    yEdge = f.variables['yEdge'][:]
+    angleEdge = f.variables['angleEdge'][:]
     temperature = f.variables['temperature']
     lowerSurface = f.variables['lowerSurface']
     upperSurface = f.variables['upperSurface']
@@ -106,101 +112,142 @@ def visualize_dome(config, logger, filename):
     logger.info("vert_levs = {};  time_length = {}".format(vert_levs,
                                                            time_length))
 
-    var_slice = thickness[time_slice, :]
+    if save_images:
+        logger.info("Saving figures to files.")
+
+    def image(name):
+        if save_images:
+            return 'dome_{}.png'.format(name)
+        return None
+
+    plot_figure(step, hide_figs, image('thickness'), _plot_thickness,
+                xCell=xCell, yCell=yCell,
+                thickness=thickness[time_slice, :], time_slice=time_slice)
+
+    plot_figure(step, hide_figs, image('surfaces'), _plot_surfaces,
+                xCell=xCell, yCell=yCell,
+                lowerSurface=lowerSurface[time_slice, :],
+                upperSurface=upperSurface[time_slice, :],
+                time_slice=time_slice)
+
+    plot_figure(step, hide_figs, image('temperature'), _plot_temperature,
+                xCell=xCell, yCell=yCell,
+                temperature=temperature[time_slice, :, :],
+                time_slice=time_slice)
+
+    plot_figure(step, hide_figs, image('normalVelocity'),
+                _plot_normal_velocity, xEdge=xEdge, yEdge=yEdge,
+                angleEdge=angleEdge,
+                normalVelocity=normalVelocity[time_slice, :, :] * secInYr,
+                time_slice=time_slice)
+
+    plot_figure(step, hide_figs, image('uReconstruct'), _plot_reconstruct,
+                xCell=xCell, yCell=yCell,
+                uReconstructX=uReconstructX[time_slice, :, 0] * secInYr,
+                uReconstructY=uReconstructY[time_slice, :, 0] * secInYr,
+                time_slice=time_slice)
+
+    if hide_figs:
+        logger.info("Plot display disabled with hide_plot config option.")
+    else:
+        plt.show()
 
-    fig = plt.figure(1, facecolor='w')
+    f.close()
+
+
+def _plot_thickness(out_filename, xCell, yCell, thickness, time_slice):
+    """ Plot the thickness """
+    fig = plt.figure(facecolor='w')
     fig.add_subplot(111, aspect='equal')
     # C = plt.contourf(xCell, yCell, var_slice )
-    plt.scatter(xCell[:], yCell[:], 80, var_slice, marker='h',
-                edgecolors='none')
+    plt.scatter(xCell, yCell, 80, thickness, marker='h', edgecolors='none')
     plt.colorbar()
     plt.title('thickness at time {}'.format(time_slice))
     plt.draw()
-    if save_images:
-        logger.info("Saving figures to files.")
-        plt.savefig('dome_thickness.png')
+    if out_filename is not None:
+        plt.savefig(out_filename)
 
-    fig = plt.figure(2)
+
+def _plot_surfaces(out_filename, xCell, yCell, lowerSurface, upperSurface,
+                   time_slice):
+    """ Plot the lower and upper surfaces """
+    fig = plt.figure()
     fig.add_subplot(121, aspect='equal')
-    plt.scatter(xCell[:], yCell[:], 80, lowerSurface[time_slice, :],
-                marker='h', edgecolors='none')
+    plt.scatter(xCell, yCell, 80, lowerSurface, marker='h',
+                edgecolors='none')
     plt.colorbar()
     plt.title('lower surface at time {}'.format(time_slice))
     plt.draw()
     fig.add_subplot(122, aspect='equal')
-    plt.scatter(xCell[:], yCell[:], 80, upperSurface[time_slice, :],
-                marker='h', edgecolors='none')
+    plt.scatter(xCell, yCell, 80, upperSurface, marker='h',
+                edgecolors='none')
     plt.colorbar()
     plt.title('upper surface at time {}'.format(time_slice))
     plt.draw()
-    if save_images:
-        plt.savefig('dome_surfaces.png')
+    if out_filename is not None:
+        plt.savefig(out_filename)
 
-    fig = plt.figure(3)
+
+def _plot_temperature(out_filename, xCell, yCell, temperature, time_slice):
+    """ Plot the temperature at each level """
+    vert_levs = temperature.shape[1]
+    fig = plt.figure()
     for templevel in range(0, vert_levs):
         fig.add_subplot(3, 4, templevel+1, aspect='equal')
-        var_slice = temperature[time_slice, :, templevel]
+        var_slice = temperature[:, templevel]
         # C = plt.contourf(xCell, yCell, var_slice )
-        plt.scatter(xCell[:], yCell[:], 40, var_slice, marker='h',
+        plt.scatter(xCell, yCell, 40, var_slice, marker='h',
                     edgecolors='none')
         plt.colorbar()
         plt.title('temperature at level {} at time {}'.format(templevel,
                                                               time_slice))
         plt.draw()
-    if save_images:
-        plt.savefig('dome_temperature.png')
+    if out_filename is not None:
+        plt.savefig(out_filename)
 
-    fig = plt.figure(4)
+
+def _plot_normal_velocity(out_filename, xEdge, yEdge, angleEdge,
+                          normalVelocity, time_slice):
+    """ Plot the normal velocity (per year) of the bottom and top layers """
+    vert_levs = normalVelocity.shape[1]
+    fig = plt.figure()
     fig.add_subplot(121, aspect='equal')
-    plt.scatter(xEdge[:], yEdge[:], 80,
-                normalVelocity[time_slice, :, vert_levs-1] * secInYr,
-                marker='h', edgecolors='none')
+    normalVel = normalVelocity[:, vert_levs-1]
+    plt.scatter(xEdge, yEdge, 80, normalVel, marker='h', edgecolors='none')
     plt.colorbar()
-    normalVel = normalVelocity[time_slice, :, vert_levs-1]
-    plt.quiver(xEdge[:], yEdge[:],
-               numpy.cos(angleEdge[:]) * normalVel * secInYr,
-               numpy.sin(angleEdge[:]) * normalVel * secInYr)
+    plt.quiver(xEdge, yEdge, numpy.cos(angleEdge) * normalVel,
+               numpy.sin(angleEdge) * normalVel)
     plt.title('normalVelocity of bottom layer at time {}'.format(time_slice))
     plt.draw()
     fig.add_subplot(122, aspect='equal')
-    plt.scatter(xEdge[:], yEdge[:], 80,
-                normalVelocity[time_slice, :, 0] * secInYr, marker='h',
-                edgecolors='none')
+    normalVel = normalVelocity[:, 0]
+    plt.scatter(xEdge, yEdge, 80, normalVel, marker='h', edgecolors='none')
     plt.colorbar()
-    normalVel = normalVelocity[time_slice, :, 0]
-    plt.quiver(xEdge[:], yEdge[:],
-               numpy.cos(angleEdge[:]) * normalVel * secInYr,
-               numpy.sin(angleEdge[:]) * normalVel * secInYr)
+    plt.quiver(xEdge, yEdge, numpy.cos(angleEdge) * normalVel,
+               numpy.sin(angleEdge) * normalVel)
     plt.title('normalVelocity of top layer at time {}'.format(time_slice))
     plt.draw()
-    if save_images:
-        plt.savefig('dome_normalVelocity.png')
+    if out_filename is not None:
+        plt.savefig(out_filename)
+
 
-    fig = plt.figure(5, facecolor='w')
+def _plot_reconstruct(out_filename, xCell, yCell, uReconstructX, uReconstructY,
+                      time_slice):
+    """ Plot the reconstructed velocity (per year) of the top layer """
+    fig = plt.figure(facecolor='w')
     fig.add_subplot(121, aspect='equal')
-    plt.scatter(xCell[:], yCell[:], 80,
-                uReconstructX[time_slice, :, 0] * secInYr, marker='h',
+    plt.scatter(xCell, yCell, 80, uReconstructX, marker='h',
                 edgecolors='none')
     plt.colorbar()
-    plt.quiver(xCell[:], yCell[:], uReconstructX[time_slice, :, 0] * secInYr,
-               uReconstructY[time_slice, :, 0] * secInYr)
+    plt.quiver(xCell, yCell, uReconstructX, uReconstructY)
     plt.title('uReconstructX of top layer at time {}'.format(time_slice))
     plt.draw()
     fig.add_subplot(122, aspect='equal')
-    plt.scatter(xCell[:], yCell[:], 80,
-                uReconstructY[time_slice, :, 0] * secInYr, marker='h',
+    plt.scatter(xCell, yCell, 80, uReconstructY, marker='h',
                 edgecolors='none')
     plt.colorbar()
-    plt.quiver(xCell[:], yCell[:], uReconstructX[time_slice, :, 0] * secInYr,
-               uReconstructY[time_slice, :, 0] * secInYr)
+    plt.quiver(xCell, yCell, uReconstructX, uReconstructY)
     plt.title('uReconstructY of top layer at time {}'.format(time_slice))
     plt.draw()
-    if save_images:
-        plt.savefig('dome_uReconstruct.png')
-
-    if hide_figs:
-        logger.info("Plot display disabled with hide_plot config option.")
-    else:
-        plt.show()
-
-    f.close()
+    if out_filename is not None:
+        plt.savefig(out_filename)
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy.interpolate import griddata
 
+from compass.landice.plot import plot_figure
 from compass.step import Step
 
 
@@ -42,10 +43,10 @@ class Visualize(Step):
 
         for experiment in experiments:
             logger.info('Plotting Experiment {}'.format(experiment))
-            visualize_eismint2(config, logger, experiment)
+            visualize_eismint2(config, logger, experiment, step=self)
 
 
-def visualize_eismint2(config, logger, experiment):
+def visualize_eismint2(config, logger, experiment, step=None):
     """
     Plot the output from an EISMINT2 experiment
 
@@ -60,12 +61,21 @@ def visualize_eismint2(config, logger, experiment):
 
     experiment : {'a', 'b', 'c', 'd', 'f', 'g'}
         The name of the experiment
+
+    step : compass.Step, optional
+        If provided and figures are hidden, the step renders the figures in
+        the background
     """
 
     section = config['eismint2_viz']
     save_images = section.getboolean('save_images')
     hide_figs = section.getboolean('hide_figs')
 
+    def image(name):
+        if save_images:
+            return 'EISMINT2-{}-{}.png'.format(experiment, name)
+        return None
+
     filename = '../experiment_{}/output.nc'.format(experiment)
 
     # open supplied MPAS output file and get variables needed
@@ -111,111 +121,41 @@ def visualize_eismint2(config, logger, experiment):
         markershape = '.'
     logger.info('Using a markersize of {}'.format(markersize))
 
-    fig = plt.figure(1, facecolor='w')
-    fig.suptitle('Payne et al. Fig. 1, 3, 6, 9, or 11', fontsize=10, fontweight='bold')
-
     iceIndices = np.where(thickness[timelev, :] > 10.0)[0]
-    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
-                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
-                edgecolors='none')
+    ice = dict(xCell=xCell, yCell=yCell, iceIndices=iceIndices,
+               markersize=markersize, markershape=markershape)
 
-    # add contours of ice temperature over the top
     basalTemp = basalTemperature[timelev, :]
     # fill places below dynamic limit with non-ice value of 273.15
     basalTemp[np.where(thickness[timelev, :] < 10.0)] = 273.15
-    _contour_mpas(basalTemp, nCells, xCell, yCell,
-                  contour_levs=np.linspace(240.0, 275.0, 8))
-
-    plt.axis('equal')
-    plt.title('Modeled basal temperature (K) \n at time {}'.format(
-        netCDF4.chartostring(xtime)[timelev].strip()))
-    plt.xlim((0.0, 1500.0))
-    plt.ylim((0.0, 1500.0))
-    plt.xlabel('X position (km)')
-    plt.ylabel('Y position (km)')
 
-    if save_images:
-        plt.savefig('EISMINT2-{}-basaltemp.png'.format(experiment), dpi=150)
+    plot_figure(step, hide_figs, image('basaltemp'), _plot_basal_temperature,
+                basalTemp=basalTemp,
+                time=netCDF4.chartostring(xtime)[timelev].strip(), **ice)
 
     # ================
     # STEADY STATE MAPS -  panels b and c are switched and with incorrect units in the paper
     # ================
-    fig = plt.figure(2, facecolor='w', figsize=(12, 6), dpi=72)
-    fig.suptitle('Payne et al. Fig. 2 or 4', fontsize=10, fontweight='bold')
-
-    # ================
-    # panel a - thickness
-    ax1 = fig.add_subplot(131)
-
-    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
-                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
-                edgecolors='none')
-
-    # add contours of ice thickness over the top
-    contour_intervals = np.linspace(0.0, 5000.0,  int(5000.0/250.0)+1)
-    _contour_mpas(thickness[timelev, :], nCells, xCell, yCell,
-                  contour_levs=contour_intervals)
-
-    plt.title('Final thickness (m)')
-    ax1.set_aspect('equal')
-    plt.xlabel('X position (km)')
-    plt.ylabel('Y position (km)')
-
-    # ================
-    # panel c - flux
-    ax = fig.add_subplot(133, sharex=ax1, sharey=ax1)
-
     flux = np.zeros((nCells,))
     for k in range(nVertLevels):
         speedLevel = (uReconstructX[timelev, :, k:k+2].mean(axis=1)**2 +
                       uReconstructY[timelev, :, k:k+2].mean(axis=1)**2)**0.5
         flux += speedLevel * thickness[timelev, :] * layerThicknessFractions[k]
 
-    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
-                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
-                edgecolors='none')
-
-    # add contours over the top
-    contour_intervals = np.linspace(0.0, 20.0,  11)
-    _contour_mpas(flux * 3600.0*24.0*365.0 / 10000.0, nCells, xCell, yCell,
-                  contour_levs=contour_intervals)
-    ax.set_aspect('equal')
-    plt.title('Final flux (m$^2$ a$^{-1}$ / 10000)')
-    plt.xlabel('X position (km)')
-    plt.ylabel('Y position (km)')
-
-    # ================
-    # panel b - flow factor
-    ax = fig.add_subplot(132, sharex=ax1, sharey=ax1)
-
-    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
-                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
-                edgecolors='none')
-
-    # add contours over the top
-    # contour_intervals = np.linspace(0.0, 16.0, int(16.0/0.5)+1)
-
     # this is not used if FO velo solver is used
     if flwa[timelev, :, :].max() > 0.0:
         # NOT SURE WHICH LEVEL FLWA SHOULD COME FROM - so taking column average
-        _contour_mpas(
-            flwa[timelev, :, :].mean(axis=1) * 3600.0*24.0*365.0 / 1.0e-17,
-            nCells, xCell, yCell)
-    ax.set_aspect('equal')
-    # Note: the paper's figure claims units of 10$^{-25}$ Pa$^{-3}$ a$^{-1}$
-    # but the time unit appears to be 10^-17
-    plt.title('Final flow factor (10$^{-17}$ Pa$^{-3}$ a$^{-1}$)')
-    plt.xlabel('X position (km)')
-    plt.ylabel('Y position (km)')
+        flowFactor = flwa[timelev, :, :].mean(axis=1)
+    else:
+        flowFactor = None
 
-    if save_images:
-        plt.savefig('EISMINT2-{}-steady.png'.format(experiment), dpi=150)
+    plot_figure(step, hide_figs, image('steady'), _plot_steady_state,
+                thickness=thickness[timelev, :], flux=flux,
+                flowFactor=flowFactor, **ice)
 
     # ================
     # DIVIDE EVOLUTION TIME SERIES
     # ================
-    fig = plt.figure(3, facecolor='w')
-    fig.suptitle('Payne et al. Fig. 5, 7, or 8', fontsize=10, fontweight='bold')
 
     # get indices for given time
     if experiment == 'b':
@@ -229,22 +169,11 @@ def visualize_eismint2(config, logger, experiment):
     # get index at divide - we set this up to be 750,750
     divideIndex = np.logical_and(xCell == 750.0, yCell == 750.0)
 
-    # panel a - thickness
-    fig.add_subplot(211)
     timeInd = np.nonzero(years <= endTime)[0][0:]
-    plt.plot(years[timeInd]/1000.0, thickness[timeInd, divideIndex], 'k.-')
-    plt.ylabel('Thickness (m)')
-
-    # panel b - basal temperature
-    fig.add_subplot(212)
-    # skip the first index cause basalTemperature isn't calculated then
-    timeInd = np.nonzero(years <= endTime)[0][1:]
-    plt.plot(years[timeInd]/1000.0, basalTemperature[timeInd, divideIndex], 'k.-')
-    plt.ylabel('Basal temperature (K)')
-    plt.xlabel('Time (kyr)')
-
-    if save_images:
-        plt.savefig('EISMINT2-{}-divide.png'.format(experiment), dpi=150)
+    plot_figure(step, hide_figs, image('divide'), _plot_divide,
+                years=years[timeInd],
+                thickness=thickness[timeInd, divideIndex],
+                basalTemperature=basalTemperature[timeInd, divideIndex])
 
     # ================
     # TABLES
@@ -290,46 +219,24 @@ def visualize_eismint2(config, logger, experiment):
 
     # Get the benchmark dictionary
     bench = benchmarks[experiment]
+    relative = bench['stattype'] == 'relative'
 
-    fig = plt.figure(4, facecolor='w')
-    fig.suptitle('Payne et al. Table 4, 5, 6, 7, 8, or 9: showing '
-                 'min/mean/max of community', fontsize=10, fontweight='bold')
-
-    fig.add_subplot(151)
     volume = ((thickness[timelev, iceIndices] * areaCell[iceIndices]).sum()
               / 1000.0**3 / 10.0**6)
-    # benchmark results
-    plt.plot(np.zeros((3,)), bench['volume'], 'k*')
-    if bench['stattype'] == 'relative':
+    if relative:
         initIceIndices = np.where(thickness[0, :] > 0.0)[0]
         total_volume = \
             (thickness[0, initIceIndices] * areaCell[initIceIndices]).sum()
         volume = (volume / (total_volume / 1000.0**3 / 10.0**6) - 1.0) * 100.0
-        plt.ylabel('Volume change (%)')
-    else:
-        plt.ylabel('Volume (10$^6$ km$^3$)')
-    # MPAS results
-    plt.plot((0.0,), volume, 'ro')
-    plt.xticks(())
     logger.info("MALI volume = {}".format(volume))
 
-    fig.add_subplot(152)
     area = (areaCell[iceIndices]).sum() / 1000.0**2 / 10.0**6
     areaAbsolute = area
-    # benchmark results
-    plt.plot(np.zeros((3,)), bench['area'], 'k*')
-    if bench['stattype'] == 'relative':
+    if relative:
         initArea = (areaCell[initIceIndices]).sum() / 1000.0**2 / 10.0**6
         area = (area / initArea - 1.0) * 100.0
-        plt.ylabel('Area change (%)')
-    else:
-        plt.ylabel('Area (10$^6$ km$^2$)')
-    # MPAS results
-    plt.plot((0.0,), area, 'ro')
-    plt.xticks(())
     logger.info("MALI area = {}".format(area))
 
-    fig.add_subplot(153)
     # using threshold here to identify melted locations
     warmBedIndices = np.where(
         np.logical_and(thickness[timelev, :] > 0.0,
@@ -337,9 +244,7 @@ def visualize_eismint2(config, logger, experiment):
                        (basalPmpTemperature[timelev, :] - 0.01)))[0]
     meltfraction = (areaCell[warmBedIndices].sum() / 1000.0**2 / 10.0**6 /
                     areaAbsolute)
-    # benchmark results
-    plt.plot(np.zeros((3,)), bench['meltfraction'], 'k*')
-    if bench['stattype'] == 'relative':
+    if relative:
         # use time 1 instead of 0 since these fields aren't fully populated at
         # time 0
         initIceIndices = np.where(thickness[1, :] > 0.0)[0]
@@ -353,49 +258,28 @@ def visualize_eismint2(config, logger, experiment):
                         10.0**6)
         initMeltFraction = initWarmArea / initArea
         meltfraction = (meltfraction / initMeltFraction - 1.0) * 100.0
-        plt.ylabel('Melt fraction change (%)')
-    else:
-        plt.ylabel('Melt fraction')
-    # MPAS results
-    plt.plot((0.0,), meltfraction, 'ro')
-    plt.xticks(())
     logger.info("MALI melt fraction = {}".format(meltfraction))
 
-    fig.add_subplot(154)
     dividethickness = thickness[timelev, divideIndex]
-    # benchmark results
-    plt.plot(np.zeros((3,)), bench['dividethickness'], 'k*')
-    if bench['stattype'] == 'relative':
+    if relative:
         dividethickness = \
             (dividethickness / thickness[0, divideIndex] - 1.0) * 100.0
-        plt.ylabel('Divide thickness change (%)')
-    else:
-        plt.ylabel('Divide thickness (m)')
-    plt.plot((0.0,), dividethickness, 'ro')  # MPAS results
-    plt.xticks(())
     logger.info("MALI divide thickness = {}".format(dividethickness[0]))
 
-    fig.add_subplot(155)
     dividebasaltemp = basalTemperature[timelev, divideIndex]
-    # benchmark results
-    plt.plot(np.zeros((3,)), bench['dividebasaltemp'], 'k*')
-    if bench['stattype'] == 'relative':
+    if relative:
         # use time 1 instead of 0 since these fields aren't fully populated at
         # time 0
         dividebasaltemp = dividebasaltemp - basalTemperature[1, divideIndex]
-        plt.ylabel('Divide basal temp. change (K)')
-    else:
-        plt.ylabel('Divide basal temp. (K)')
-    plt.plot((0.0,), dividebasaltemp, 'ro')  # MPAS results
-    plt.xticks(())
     logger.info(
         "MALI divide basal temperature = {}".format(dividebasaltemp[0]))
 
-    plt.tight_layout()
-
-    plt.draw()
-    if save_images:
-        plt.savefig('EISMINT2-{}-table.png'.format(experiment), dpi=150)
+    plot_figure(step, hide_figs, image('table'), _plot_table, bench=bench,
+                results={'volume': volume,
+                         'area': area,
+                         'meltfraction': meltfraction,
+                         'dividethickness': dividethickness,
+                         'dividebasaltemp': dividebasaltemp})
 
     if hide_figs:
         logger.info("Plot display disabled with hide_plot config option.")
@@ -405,6 +289,164 @@ def visualize_eismint2(config, logger, experiment):
     plt.close('all')
 
 
+def _plot_basal_temperature(out_filename, xCell, yCell, iceIndices, markersize,
+                            markershape, basalTemp, time):
+    """ Plot a map of the basal temperature """
+    fig = plt.figure(facecolor='w')
+    fig.suptitle('Payne et al. Fig. 1, 3, 6, 9, or 11', fontsize=10,
+                 fontweight='bold')
+
+    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
+                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
+                edgecolors='none')
+
+    # add contours of ice temperature over the top
+    _contour_mpas(basalTemp, len(xCell), xCell, yCell,
+                  contour_levs=np.linspace(240.0, 275.0, 8))
+
+    plt.axis('equal')
+    plt.title('Modeled basal temperature (K) \n at time {}'.format(time))
+    plt.xlim((0.0, 1500.0))
+    plt.ylim((0.0, 1500.0))
+    plt.xlabel('X position (km)')
+    plt.ylabel('Y position (km)')
+
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
+
+
+def _plot_steady_state(out_filename, xCell, yCell, iceIndices, markersize,
+                       markershape, thickness, flux, flowFactor):
+    """
+    Plot maps of the final thickness, flux and (if it is available) flow
+    factor
+    """
+    nCells = len(xCell)
+    fig = plt.figure(facecolor='w', figsize=(12, 6), dpi=72)
+    fig.suptitle('Payne et al. Fig. 2 or 4', fontsize=10, fontweight='bold')
+
+    # ================
+    # panel a - thickness
+    ax1 = fig.add_subplot(131)
+
+    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
+                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
+                edgecolors='none')
+
+    # add contours of ice thickness over the top
+    contour_intervals = np.linspace(0.0, 5000.0,  int(5000.0/250.0)+1)
+    _contour_mpas(thickness, nCells, xCell, yCell,
+                  contour_levs=contour_intervals)
+
+    plt.title('Final thickness (m)')
+    ax1.set_aspect('equal')
+    plt.xlabel('X position (km)')
+    plt.ylabel('Y position (km)')
+
+    # ================
+    # panel c - flux
+    ax = fig.add_subplot(133, sharex=ax1, sharey=ax1)
+
+    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
+                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
+                edgecolors='none')
+
+    # add contours over the top
+    contour_intervals = np.linspace(0.0, 20.0,  11)
+    _contour_mpas(flux * 3600.0*24.0*365.0 / 10000.0, nCells, xCell, yCell,
+                  contour_levs=contour_intervals)
+    ax.set_aspect('equal')
+    plt.title('Final flux (m$^2$ a$^{-1}$ / 10000)')
+    plt.xlabel('X position (km)')
+    plt.ylabel('Y position (km)')
+
+    # ================
+    # panel b - flow factor
+    ax = fig.add_subplot(132, sharex=ax1, sharey=ax1)
+
+    plt.scatter(xCell[iceIndices], yCell[iceIndices], markersize,
+                c=np.array([[0.8, 0.8, 0.8], ]), marker=markershape,
+                edgecolors='none')
+
+    # add contours over the top
+    # contour_intervals = np.linspace(0.0, 16.0, int(16.0/0.5)+1)
+
+    # this is not used if FO velo solver is used
+    if flowFactor is not None:
+        _contour_mpas(flowFactor * 3600.0*24.0*365.0 / 1.0e-17, nCells,
+                      xCell, yCell)
+    ax.set_aspect('equal')
+    # Note: the paper's figure claims units of 10$^{-25}$ Pa$^{-3}$ a$^{-1}$
+    # but the time unit appears to be 10^-17
+    plt.title('Final flow factor (10$^{-17}$ Pa$^{-3}$ a$^{-1}$)')
+    plt.xlabel('X position (km)')
+    plt.ylabel('Y position (km)')
+
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
+
+
+def _plot_divide(out_filename, years, thickness, basalTemperature):
+    """
+    Plot time series of the thickness and basal temperature at the divide
+    """
+    fig = plt.figure(facecolor='w')
+    fig.suptitle('Payne et al. Fig. 5, 7, or 8', fontsize=10,
+                 fontweight='bold')
+
+    # panel a - thickness
+    fig.add_subplot(211)
+    plt.plot(years/1000.0, thickness, 'k.-')
+    plt.ylabel('Thickness (m)')
+
+    # panel b - basal temperature
+    fig.add_subplot(212)
+    # skip the first index cause basalTemperature isn't calculated then
+    plt.plot(years[1:]/1000.0, basalTemperature[1:], 'k.-')
+    plt.ylabel('Basal temperature (K)')
+    plt.xlabel('Time (kyr)')
+
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
+
+
+def _plot_table(out_filename, bench, results):
+    """
+    Plot the MALI results with the min, mean and max of the benchmark results
+    """
+    relative = bench['stattype'] == 'relative'
+
+    fig = plt.figure(facecolor='w')
+    fig.suptitle('Payne et al. Table 4, 5, 6, 7, 8, or 9: showing '
+                 'min/mean/max of community', fontsize=10, fontweight='bold')
+
+    if relative:
+        ylabels = ['Volume change (%)', 'Area change (%)',
+                   'Melt fraction change (%)', 'Divide thickness change (%)',
+                   'Divide basal temp. change (K)']
+    else:
+        ylabels = ['Volume (10$^6$ km$^3$)', 'Area (10$^6$ km$^2$)',
+                   'Melt fraction', 'Divide thickness (m)',
+                   'Divide basal temp. (K)']
+
+    names = ['volume', 'area', 'meltfraction', 'dividethickness',
+             'dividebasaltemp']
+    for index, name in enumerate(names):
+        fig.add_subplot(1, 5, index + 1)
+        # benchmark results
+        plt.plot(np.zeros((3,)), bench[name], 'k*')
+        plt.ylabel(ylabels[index])
+        # MPAS results
+        plt.plot((0.0,), results[name], 'ro')
+        plt.xticks(())
+
+    plt.tight_layout()
+
+    plt.draw()
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
+
+
 def _xtime_to_numtime(xtime):
     """
     Define a function to convert xtime character array to numeric time values
@@ -3,6 +3,7 @@ from netCDF4 import Dataset
 import matplotlib.pyplot as plt
 from scipy.io import loadmat
 
+from compass.landice.plot import plot_figure
 from compass.step import Step
 
 
@@ -40,9 +41,6 @@ class Visualize(Step):
 
         display_image = section.getboolean('display_image')
 
-        if not display_image:
-            plt.switch_backend('Agg')
-
         anaData = loadmat('enthA_analy_result.mat')
         basalMelt = anaData['basalMelt']
 
@@ -67,36 +65,48 @@ class Visualize(Step):
         basalMeanBmb = np.concatenate(basalMeanBmbs)[1::]
         basalMeanWaterThickness = np.concatenate(basalMeanWaterThicknesses)[1::]
 
-        plt.figure(1)
-        plt.subplot(311)
-        plt.plot(year, basalMeanT - 273.15)
-        plt.ylabel(r'$T_{\rm b}$ ($^\circ \rm C$)')
-        plt.text(10, -28, '(a)', fontsize=20)
-        plt.grid(True)
-
-        plt.subplot(312)
-        plt.plot(year, -basalMeanBmb * SPY)
-        plt.plot(basalMelt[1, :] / 1000.0, basalMelt[0, :], linewidth=2)
-        plt.ylabel(r'$a_{\rm b}$ (mm a$^{-1}$ w.e.)')
-        plt.text(10, -1.6, '(b)', fontsize=20)
-        plt.grid(True)
-
-        plt.subplot(313)
-        plt.plot(year, basalMeanWaterThickness * 910.0 / 1000.0)
-        plt.ylabel(r'$H_{\rm w}$ (m)')
-        plt.xlabel('Year (ka)')
-        plt.text(10, 8, '(c)', fontsize=20)
-        plt.grid(True)
-
         # Create image plot
         plotname = 'enthalpy_A_results.png'
-        plt.savefig(plotname, dpi=150)
+        plot_figure(self, not display_image, plotname, _plot, year=year,
+                    basalMeanT=basalMeanT, basalMeanBmb=basalMeanBmb,
+                    basalMeanWaterThickness=basalMeanWaterThickness,
+                    basalMelt=basalMelt, SPY=SPY)
         logger.info('Saved plot as {}'.format(plotname))
 
         if display_image:
             plt.show()
 
 
+def _plot(out_filename, year, basalMeanT, basalMeanBmb,
+          basalMeanWaterThickness, basalMelt, SPY):
+    """
+    Plot the mean basal temperature, basal mass balance and basal water
+    thickness with the analytic basal melt rate
+    """
+    plt.figure(1)
+    plt.subplot(311)
+    plt.plot(year, basalMeanT - 273.15)
+    plt.ylabel(r'$T_{\rm b}$ ($^\circ \rm C$)')
+    plt.text(10, -28, '(a)', fontsize=20)
+    plt.grid(True)
+
+    plt.subplot(312)
+    plt.plot(year, -basalMeanBmb * SPY)
+    plt.plot(basalMelt[1, :] / 1000.0, basalMelt[0, :], linewidth=2)
+    plt.ylabel(r'$a_{\rm b}$ (mm a$^{-1}$ w.e.)')
+    plt.text(10, -1.6, '(b)', fontsize=20)
+    plt.grid(True)
+
+    plt.subplot(313)
+    plt.plot(year, basalMeanWaterThickness * 910.0 / 1000.0)
+    plt.ylabel(r'$H_{\rm w}$ (m)')
+    plt.xlabel('Year (ka)')
+    plt.text(10, 8, '(c)', fontsize=20)
+    plt.grid(True)
+
+    plt.savefig(out_filename, dpi=150)
+
+
 def _get_data(filename, SPY):
     G = 0.042
     kc = 2.1
@@ -2,6 +2,7 @@ import numpy as np
 import netCDF4
 import matplotlib.pyplot as plt
 
+from compass.landice.plot import plot_figure
 from compass.step import Step
 
 
@@ -48,10 +49,10 @@ class Visualize(Step):
         """
         Run this step of the test case
         """
-        visualize_hydro_radial(self.config, self.logger)
+        visualize_hydro_radial(self.config, self.logger, step=self)
 
 
-def visualize_hydro_radial(config, logger):
+def visualize_hydro_radial(config, logger, step=None):
     """
     Plot the output from a hydro_radial test case
 
@@ -63,6 +64,10 @@ def visualize_hydro_radial(config, logger):
 
     logger : logging.Logger
         A logger for output from the step
+
+    step : compass.Step, optional
+        If provided and figures are hidden, the step renders the figures in
+        the background
     """
     section = config['hydro_radial_viz']
 
@@ -70,6 +75,11 @@ def visualize_hydro_radial(config, logger):
     save_images = section.getboolean('save_images')
     hide_figs = section.getboolean('hide_figs')
 
+    def image(name):
+        if save_images:
+            return 'hydro_radial_{}.png'.format(name)
+        return None
+
     filename = 'output.nc'
     grid_filename = 'landice_grid.nc'
 
@@ -108,8 +118,6 @@ def visualize_hydro_radial(config, logger):
 
     logger.info("start plotting.")
 
-    fig = plt.figure(1, facecolor='w')
-
     # import exact solution
     fnameSoln = 'near_exact_solution_r_P_W.txt'
     soln = np.loadtxt(fnameSoln, delimiter=',')
@@ -117,10 +125,79 @@ def visualize_hydro_radial(config, logger):
     Psoln = soln[:, 1] / 1.0e5
     Wsoln = soln[:, 2]
 
+    plot_figure(step, hide_figs, image('vs_exact'), _plot_vs_exact,
+                x=x, h=h[ind], P=P[ind], H=H[ind], rsoln=rsoln, Psoln=Psoln,
+                Wsoln=Wsoln)
+
+    # plot how close to SS we are
+    plot_figure(step, hide_figs, image('steady_state'), _plot_steady_state,
+                years=days / 365.0,
+                waterThickness=[f.variables['waterThickness'][:, i]
+                                for i in ind],
+                effectivePressure=[f.variables['effectivePressure'][:, i]
+                                   for i in ind])
+
+    # plot opening/closing rates
+    plot_figure(step, hide_figs, image('opening_closing'),
+                _plot_opening_closing, x=x, opening=opening[ind],
+                closing=closing[ind], melt=melt[ind], N=N[ind], h=h[ind],
+                u=u[ind], div=div[ind])
+
+    # plot some edge quantities
+    inde = np.nonzero(yEdge[:] == centerY)
+    xe = xEdge[inde] / 1000.0
+    ve = f.variables['waterVelocity'][time_slice, :]
+    dphie = f.variables['hydropotentialBaseSlopeNormal'][time_slice, :]
+    he = f.variables['waterThicknessEdgeUpwind'][time_slice, :]
+    fluxe = f.variables['waterFluxAdvec'][time_slice, :]
+
+    plot_figure(step, hide_figs, image('edge'), _plot_edge, x=x, P=P[ind],
+                h=h[ind], xe=xe, dphie=dphie[inde], ve=ve[inde], he=he[inde],
+                fluxe=fluxe[inde])
+
+    # ==========
+    # Make plot similar to Bueler and van Pelt Fig. 5
+
+    # get thickness/pressure at time 0 - this should be the nearly-exact
+    # solution interpolated onto the MPAS mesh
+    h0 = f.variables['waterThickness'][0, :]
+    P0 = f.variables['waterPressure'][0, :]
+    # assuming sliding has been zeroed where there is no ice, so we don't need
+    # to get the thickness field
+    hasice = sliding > 0.0
+
+    Werr = np.absolute(h - h0)
+    Perr = np.absolute(P - P0)
+    dcEdge = f.variables['dcEdge'][:]
+    # ideally should restrict this to edges with ice
+    dx = dcEdge.mean()
+
+    logger.info("avg W err={}".format(Werr[hasice].mean()))
+    logger.info("max W err={}".format(Werr[hasice].max()))
+    logger.info("avg P err={}".format(Perr[hasice].mean() / 1.0e5))
+    logger.info("max P err={}".format(Perr[hasice].max() / 1.0e5))
+
+    plot_figure(step, hide_figs, image('error'), _plot_error, dx=dx,
+                Werr=Werr[hasice], Perr=Perr[hasice])
+
+    logger.info("plotting complete")
+
+    if hide_figs:
+        logger.info("Plot display disabled with hide_plot config option.")
+    else:
+        plt.show()
+
+    f.close()
+
+
+def _plot_vs_exact(out_filename, x, h, P, H, rsoln, Psoln, Wsoln):
+    """ Plot the water thickness and pressure against the exact solution """
+    fig = plt.figure(facecolor='w')
+
     # water thickness
     ax1 = fig.add_subplot(121)
     plt.plot(rsoln, Wsoln, 'k-', label='W exact')
-    plt.plot(x, h[ind], 'r.--', label='W model')
+    plt.plot(x, h, 'r.--', label='W model')
     plt.xlabel('X-position (km)')
     plt.ylabel('water depth (m)')
     plt.legend()
@@ -129,45 +206,50 @@ def visualize_hydro_radial(config, logger):
 
     # water pressure
     fig.add_subplot(122, sharex=ax1)
-    plt.plot(x, H[ind] * 910.0 * 9.80616 / 1.0e5, 'g:', label='P_o')
+    plt.plot(x, H * 910.0 * 9.80616 / 1.0e5, 'g:', label='P_o')
     plt.plot(rsoln, Psoln, 'k-', label='P_w exact')
-    plt.plot(x, P[ind] / 1.0e5, 'r.--', label='P_w model')
+    plt.plot(x, P / 1.0e5, 'r.--', label='P_w model')
     plt.xlabel('X-position (km)')
     plt.ylabel('water pressure (bar)')
     plt.legend()
     plt.plot([5.0, 5.0], [0.0, 45.0], ':k')
     plt.grid(True)
-    if save_images:
-        plt.savefig('hydro_radial_vs_exact.png', dpi=150)
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
 
-    # plot how close to SS we are
-    fig = plt.figure(2, facecolor='w')
+
+def _plot_steady_state(out_filename, years, waterThickness, effectivePressure):
+    """ Plot how close to steady state the center row is """
+    fig = plt.figure(facecolor='w')
     ax1 = fig.add_subplot(211)
-    for i in ind:
-        plt.plot(days / 365.0, f.variables['waterThickness'][:, i])
+    for thickness in waterThickness:
+        plt.plot(years, thickness)
     plt.xlabel('Years since start')
     plt.ylabel('water thickness (m)')
     plt.grid(True)
 
     fig.add_subplot(212, sharex=ax1)
-    for i in ind:
-        plt.plot(days / 365.0, f.variables['effectivePressure'][:, i] / 1.0e6)
+    for pressure in effectivePressure:
+        plt.plot(years, pressure / 1.0e6)
     plt.xlabel('Years since start')
     plt.ylabel('effective pressure (MPa)')
     plt.grid(True)
 
-    if save_images:
-        plt.savefig('hydro_radial_steady_state.png', dpi=150)
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
 
-    # plot opening/closing rates
-    fig = plt.figure(3, facecolor='w')
+
+def _plot_opening_closing(out_filename, x, opening, closing, melt, N, h, u,
+                          div):
+    """ Plot the opening and closing rates and related quantities """
+    fig = plt.figure(facecolor='w')
 
     nplt = 5
 
     fig.add_subplot(nplt, 1, 1)
-    plt.plot(x, opening[ind], 'r', label='opening')
-    plt.plot(x, closing[ind], 'b', label='closing')
-    plt.plot(x, melt[ind] / 1000.0, 'g', label='melt')
+    plt.plot(x, opening, 'r', label='opening')
+    plt.plot(x, closing, 'b', label='closing')
+    plt.plot(x, melt / 1000.0, 'g', label='melt')
     plt.xlabel('X-position (km)')
     plt.ylabel('rate (m/s)')
     plt.legend()
@@ -175,9 +257,9 @@ def visualize_hydro_radial(config, logger):
 
     # SS N=f(h)
     fig.add_subplot(nplt, 1, 2)
-    plt.plot(x, N[ind] / 1.0e6, '.-', label='modeled transient to SS')
+    plt.plot(x, N / 1.0e6, '.-', label='modeled transient to SS')
     # steady state N=f(h) from the cavity evolution eqn
-    N = (opening[ind] / (0.04 * 3.1709792e-24 * h[ind]))**0.3333333 / 1.0e6
+    N = (opening / (0.04 * 3.1709792e-24 * h))**0.3333333 / 1.0e6
     plt.plot(x, N, '.--r', label='SS N=f(h)')
     plt.xlabel('X-position (km)')
     plt.ylabel('effective pressure (MPa)')
@@ -185,114 +267,85 @@ def visualize_hydro_radial(config, logger):
     plt.legend()
 
     fig.add_subplot(nplt, 1, 3)
-    plt.plot(x, u[ind])
+    plt.plot(x, u)
     plt.ylabel('water velocity (m/s)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 4)
-    plt.plot(x, u[ind] * h[ind])
+    plt.plot(x, u * h)
     plt.ylabel('water flux (m2/s)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 5)
-    plt.plot(x, div[ind])
-    plt.plot(x, melt[ind] / 1000.0, 'g', label='melt')
+    plt.plot(x, div)
+    plt.plot(x, melt / 1000.0, 'g', label='melt')
     plt.ylabel('divergence (m/s)')
     plt.grid(True)
 
-    if save_images:
-        plt.savefig('hydro_radial_opening_closing.png', dpi=150)
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
 
-    # plot some edge quantities
-    inde = np.nonzero(yEdge[:] == centerY)
-    xe = xEdge[inde] / 1000.0
-    ve = f.variables['waterVelocity'][time_slice, :]
-    dphie = f.variables['hydropotentialBaseSlopeNormal'][time_slice, :]
-    he = f.variables['waterThicknessEdgeUpwind'][time_slice, :]
-    fluxe = f.variables['waterFluxAdvec'][time_slice, :]
 
-    fig = plt.figure(5, facecolor='w')
+def _plot_edge(out_filename, x, P, h, xe, dphie, ve, he, fluxe):
+    """ Plot some edge quantities along the center row """
+    fig = plt.figure(facecolor='w')
     nplt = 5
 
     ax1 = fig.add_subplot(nplt, 1, 1)
-    plt.plot(xe, dphie[inde], '.')
+    plt.plot(xe, dphie, '.')
     plt.ylabel('dphidx edge)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 2, sharex=ax1)
-    plt.plot(x, P[ind], 'x')
+    plt.plot(x, P, 'x')
     plt.ylabel('dphidx edge)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 3, sharex=ax1)
-    plt.plot(xe, ve[inde], '.')
+    plt.plot(xe, ve, '.')
     plt.ylabel('vel edge)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 4, sharex=ax1)
-    plt.plot(xe, he[inde], '.')
-    plt.plot(x, h[ind], 'x')
+    plt.plot(xe, he, '.')
+    plt.plot(x, h, 'x')
     plt.ylabel('h edge)')
     plt.grid(True)
 
     fig.add_subplot(nplt, 1, 5, sharex=ax1)
-    plt.plot(xe, fluxe[inde], '.')
+    plt.plot(xe, fluxe, '.')
     plt.ylabel('flux edge)')
     plt.grid(True)
 
-    # ==========
-    # Make plot similar to Bueler and van Pelt Fig. 5
-
-    # get thickness/pressure at time 0 - this should be the nearly-exact
-    # solution interpolated onto the MPAS mesh
-    h0 = f.variables['waterThickness'][0, :]
-    P0 = f.variables['waterPressure'][0, :]
-    # assuming sliding has been zeroed where there is no ice, so we don't need
-    # to get the thickness field
-    hasice = sliding > 0.0
-
-    Werr = np.absolute(h - h0)
-    Perr = np.absolute(P - P0)
-    dcEdge = f.variables['dcEdge'][:]
-    # ideally should restrict this to edges with ice
-    dx = dcEdge.mean()
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
 
-    if save_images:
-        plt.savefig('hydro_radial_edge.png', dpi=150)
 
-    fig = plt.figure(6, facecolor='w')
+def _plot_error(out_filename, dx, Werr, Perr):
+    """
+    Plot the error in water thickness and pressure where there is ice,
+    similar to Bueler and van Pelt Fig. 5
+    """
+    fig = plt.figure(facecolor='w')
 
     ax = fig.add_subplot(2, 1, 1)
-    plt.plot(dx, Werr[hasice].mean(), 's', label='avg W err')
-    plt.plot(dx, Werr[hasice].max(), 'x', label='max W err')
+    plt.plot(dx, Werr.mean(), 's', label='avg W err')
+    plt.plot(dx, Werr.max(), 'x', label='max W err')
     ax.set_yscale('log')
     plt.grid(True)
     plt.legend()
     plt.xlabel('delta x (m)')
     plt.ylabel('error in W (m)')
-    logger.info("avg W err={}".format(Werr[hasice].mean()))
-    logger.info("max W err={}".format(Werr[hasice].max()))
 
     ax = fig.add_subplot(2, 1, 2)
-    plt.plot(dx, Perr[hasice].mean() / 1.0e5, 's', label='avg P err')
-    plt.plot(dx, Perr[hasice].max() / 1.0e5, 'x', label='max P err')
+    plt.plot(dx, Perr.mean() / 1.0e5, 's', label='avg P err')
+    plt.plot(dx, Perr.max() / 1.0e5, 'x', label='max P err')
     ax.set_yscale('log')
     plt.grid(True)
     plt.legend()
     plt.xlabel('delta x (m)')
     plt.ylabel('error in P (bar)')
-    logger.info("avg P err={}".format(Perr[hasice].mean() / 1.0e5))
-    logger.info("max P err={}".format(Perr[hasice].max() / 1.0e5))
-
-    logger.info("plotting complete")
 
     plt.draw()
-    if save_images:
-        plt.savefig('hydro_radial_error.png', dpi=150)
-
-    if hide_figs:
-        logger.info("Plot display disabled with hide_plot config option.")
-    else:
-        plt.show()
-
-    f.close()
+    if out_filename is not None:
+        plt.savefig(out_filename, dpi=150)
@@ -4,7 +4,8 @@ import sys
 import os
 from importlib.resources import contents
 
-from compass.mpas_cores import get_mpas_cores
+from compass.mpas_cores import get_mpas_core_classes, get_test_case_paths, \
+    get_test_cases, update_test_case_registry
 
 
 def list_cases(test_expr=None, number=None, verbose=False):
@@ -22,59 +23,57 @@ def list_cases(test_expr=None, number=None, verbose=False):
     verbose : bool, optional
         Whether to print details of each test or just the subdirectories
     """
-    mpas_cores = get_mpas_cores()
+    # the paths come from the test-case registry, so test cases only need to
+    # be constructed if details are requested
+    paths = get_test_case_paths()
 
     if number is None:
         print('Testcases:')
 
-    test_cases = []
-    for mpas_core in mpas_cores:
-        for test_group in mpas_core.test_groups.values():
-            for test_case in test_group.test_cases.values():
-                test_cases.append(test_case)
-
-    for test_number, test_case in enumerate(test_cases):
-        print_number = False
-        print_test = False
+    selected = list()
+    for test_number, path in enumerate(paths):
         if number is not None:
             if number == test_number:
-                print_test = True
-        elif test_expr is None or re.match(test_expr, test_case.path):
-            print_test = True
-            print_number = True
-
-        if print_test:
-            number_string = '{:d}: '.format(test_number).rjust(6)
-            if print_number:
-                prefix = number_string
-            else:
-                prefix = ''
-            if verbose:
-                lines = list()
-                to_print = {'path': test_case.path,
-                            'name': test_case.name,
-                            'MPAS core': test_case.mpas_core.name,
-                            'test group': test_case.test_group.name,
-                            'subdir': test_case.subdir}
-                for key in to_print:
-                    key_string = '{}: '.format(key).ljust(15)
-                    lines.append('{}{}{}'.format(prefix, key_string,
-                                                 to_print[key]))
-                    if print_number:
-                        prefix = '      '
-                lines.append('{}steps:'.format(prefix))
-                for step in test_case.steps.values():
-                    if step.name == step.subdir:
-                        lines.append('{} - {}'.format(prefix, step.name))
-                    else:
-                        lines.append('{} - {}: {}'.format(prefix, step.name,
-                                                          step.subdir))
-                lines.append('')
-                print_string = '\n'.join(lines)
-            else:
-                print_string = '{}{}'.format(prefix, test_case.path)
-
-            print(print_string)
+                selected.append((test_number, path, False))
+        elif test_expr is None or re.match(test_expr, path):
+            selected.append((test_number, path, True))
+
+    if verbose:
+        test_cases = get_test_cases([path for _, path, _ in selected])
+
+    for test_number, path, print_number in selected:
+        number_string = '{:d}: '.format(test_number).rjust(6)
+        if print_number:
+            prefix = number_string
+        else:
+            prefix = ''
+        if verbose:
+            test_case = test_cases[path]
+            lines = list()
+            to_print = {'path': test_case.path,
+                        'name': test_case.name,
+                        'MPAS core': test_case.mpas_core.name,
+                        'test group': test_case.test_group.name,
+                        'subdir': test_case.subdir}
+            for key in to_print:
+                key_string = '{}: '.format(key).ljust(15)
+                lines.append('{}{}{}'.format(prefix, key_string,
+                                             to_print[key]))
+                if print_number:
+                    prefix = '      '
+            lines.append('{}steps:'.format(prefix))
+            for step in test_case.steps.values():
+                if step.name == step.subdir:
+                    lines.append('{} - {}'.format(prefix, step.name))
+                else:
+                    lines.append('{} - {}: {}'.format(prefix, step.name,
+                                                      step.subdir))
+            lines.append('')
+            print_string = '\n'.join(lines)
+        else:
+            print_string = '{}{}'.format(prefix, path)
+
+        print(print_string)
 
 
 def list_machines():
@@ -87,7 +86,7 @@ def list_machines():
 
 def list_suites(cores=None):
     if cores is None:
-        cores = [mpas_core.name for mpas_core in get_mpas_cores()]
+        cores = list(get_mpas_core_classes())
     print('Suites:')
     for core in cores:
         try:
@@ -99,6 +98,30 @@ def list_suites(cores=None):
                 print('  -c {} -t {}'.format(core, os.path.splitext(suite)[0]))
 
 
+def update_registry(check=False):
+    """
+    Update the test-case registry of each MPAS core, the list of test-case
+    paths that ``compass list`` reads from, or check that it is up to date
+
+    Parameters
+    ----------
+    check : bool, optional
+        Whether to only check the registry (exiting with an error if it is
+        out of date) rather than updating it
+    """
+    outdated = update_test_case_registry(check=check)
+    if len(outdated) == 0:
+        print('The test-case registry is up to date.')
+    elif check:
+        print('The test-case registry is out of date for: {}\n'
+              'Run "compass list --update-registry" to update it.'.format(
+                  ', '.join(outdated)))
+        sys.exit(1)
+    else:
+        print('Updated the test-case registry for: {}'.format(
+            ', '.join(outdated)))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='List the available test cases or machines',
@@ -116,11 +139,21 @@ def main():
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
                         help="List details of each test case, not just the "
                              "path")
+    parser.add_argument("--update-registry", dest="update_registry",
+                        action="store_true",
+                        help="Update the list of all test-case paths after "
+                             "adding, removing or renaming test cases")
+    parser.add_argument("--check-registry", dest="check_registry",
+                        action="store_true",
+                        help="Check that the list of all test-case paths is "
+                             "up to date")
     args = parser.parse_args(sys.argv[2:])
     if args.machines:
         list_machines()
     elif args.suites:
         list_suites()
+    elif args.update_registry or args.check_registry:
+        update_registry(check=args.check_registry)
     else:
         list_cases(test_expr=args.test_expr, number=args.number,
                    verbose=args.verbose)
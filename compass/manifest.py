@@ -0,0 +1,305 @@
+import os
+import json
+import pickle
+
+
+class StepManifest:
+    """
+    A lightweight description of a step that has been set up, as recorded in
+    a manifest
+
+    Attributes
+    ----------
+    name : str
+        the name of the step
+
+    step_class : str
+        The full module and class name of the step
+
+    path : str
+        the path within the base work directory of the step
+
+    work_dir : str
+        The step's work directory
+
+    cores : int
+        the number of cores the step will use
+
+    min_cores : int
+        the minimum number of cores the step requires
+
+    threads : int
+        the number of threads the step will use
+
+    cores_option : list of str
+        The config section and option that ``cores`` is read from at
+        runtime, or ``None`` if ``cores`` is fixed at setup
+
+    inputs : list of str
+        The absolute paths of the step's input files
+
+    outputs : list of str
+        The absolute paths of the step's output files
+    """
+
+    def __init__(self, entry):
+        """
+        Create a step manifest from an entry in a manifest file
+
+        Parameters
+        ----------
+        entry : dict
+            The entry for the step from a manifest file
+        """
+        self.name = entry['name']
+        self.step_class = entry['class']
+        self.path = entry['path']
+        self.work_dir = entry['work_dir']
+        self.cores = entry['cores']
+        self.min_cores = entry['min_cores']
+        self.threads = entry['threads']
+        # manifests written before this option was added don't have it
+        self.cores_option = entry.get('cores_option')
+        self.inputs = entry['inputs']
+        self.outputs = entry['outputs']
+
+
+class TestCaseManifest:
+    """
+    A lightweight description of a test case that has been set up, as
+    recorded in a manifest.  The full test case is only unpickled when
+    ``load()`` is called.
+
+    Attributes
+    ----------
+    name : str
+        the name of the test case
+
+    test_case_class : str
+        The full module and class name of the test case
+
+    path : str
+        the path within the base work directory of the test case
+
+    work_dir : str
+        The test case's work directory
+
+    config_filename : str
+        The local name of the config file for the test case
+
+    steps : dict of compass.manifest.StepManifest
+        The steps of the test case
+
+    steps_to_run : list of str
+        The steps to run by default
+    """
+
+    def __init__(self, entry):
+        """
+        Create a test case manifest from an entry in a manifest file
+
+        Parameters
+        ----------
+        entry : dict
+            The entry for the test case from a manifest file
+        """
+        self.name = entry['name']
+        self.test_case_class = entry['class']
+        self.path = entry['path']
+        self.work_dir = entry['work_dir']
+        self.config_filename = entry['config_filename']
+        self.steps = dict()
+        for step_entry in entry['steps']:
+            step = StepManifest(step_entry)
+            self.steps[step.name] = step
+        self.steps_to_run = entry['steps_to_run']
+
+    def load(self):
+        """
+        Load the full test case from its work directory
+
+        Returns
+        -------
+        test_case : compass.TestCase
+            The test case
+        """
+        return load_test_case(self.work_dir)
+
+
+def write_test_case(test_case):
+    """
+    Pickle a test case (including its steps) in its work directory and write
+    a small manifest in each step's work directory that points to it
+
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        A test case that has been set up
+    """
+    for step in test_case.steps.values():
+        entry = get_step_entry(step)
+        entry['test_case'] = os.path.relpath(test_case.work_dir,
+                                             step.work_dir)
+        with open(os.path.join(step.work_dir, 'step.json'), 'w') as f:
+            json.dump(entry, f, indent=4)
+
+    pickle_filename = os.path.join(test_case.work_dir, 'test_case.pickle')
+    with open(pickle_filename, 'wb') as handle:
+        pickle.dump(test_case, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_test_case(work_dir):
+    """
+    Load a test case pickled by :py:func:`compass.manifest.write_test_case()`
+
+    Parameters
+    ----------
+    work_dir : str
+        The work directory of the test case
+
+    Returns
+    -------
+    test_case : compass.TestCase
+        The test case
+    """
+    pickle_filename = os.path.join(work_dir, 'test_case.pickle')
+    with open(pickle_filename, 'rb') as handle:
+        test_case = pickle.load(handle)
+    return test_case
+
+
+def load_step(work_dir):
+    """
+    Load a step and the test case it belongs to from the step's manifest
+
+    Parameters
+    ----------
+    work_dir : str
+        The work directory of the step
+
+    Returns
+    -------
+    test_case : compass.TestCase
+        The test case the step belongs to
+
+    step : compass.Step
+        The step
+    """
+    with open(os.path.join(work_dir, 'step.json')) as f:
+        entry = json.load(f)
+    test_case = load_test_case(os.path.join(work_dir, entry['test_case']))
+    return test_case, test_case.steps[entry['name']]
+
+
+def write_suite_manifest(filename, suite_name, work_dir, test_cases):
+    """
+    Write a manifest of a test suite with the information needed to schedule
+    its test cases
+
+    Parameters
+    ----------
+    filename : str
+        The manifest file to write
+
+    suite_name : str
+        The name of the test suite
+
+    work_dir : str
+        The base work directory of the suite
+
+    test_cases : dict of compass.TestCase
+        The test cases in the suite that have been set up, with their paths
+        as keys
+    """
+    manifest = {'name': suite_name,
+                'work_dir': work_dir,
+                'test_cases': [get_test_case_entry(test_case) for test_case
+                               in test_cases.values()]}
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+
+def read_suite_manifest(filename):
+    """
+    Read a manifest of a test suite
+
+    Parameters
+    ----------
+    filename : str
+        The manifest file to read
+
+    Returns
+    -------
+    test_suite : dict
+        A dictionary with the ``name`` and ``work_dir`` of the suite and its
+        ``test_cases``, a dictionary of
+        :py:class:`compass.manifest.TestCaseManifest` with the paths of the
+        test cases as keys
+    """
+    with open(filename) as f:
+        manifest = json.load(f)
+
+    test_cases = dict()
+    for entry in manifest['test_cases']:
+        test_case = TestCaseManifest(entry)
+        test_cases[test_case.path] = test_case
+
+    return {'name': manifest['name'],
+            'work_dir': manifest['work_dir'],
+            'test_cases': test_cases}
+
+
+def get_test_case_entry(test_case):
+    """
+    Get an entry describing a test case that has been set up for a manifest
+
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        A test case that has been set up
+
+    Returns
+    -------
+    entry : dict
+        The entry for the test case
+    """
+    return {'name': test_case.name,
+            'class': _get_class_name(test_case),
+            'path': test_case.path,
+            'work_dir': test_case.work_dir,
+            'config_filename': test_case.config_filename,
+            'steps_to_run': list(test_case.steps_to_run),
+            'steps': [get_step_entry(step) for step in
+                      test_case.steps.values()]}
+
+
+def get_step_entry(step):
+    """
+    Get an entry describing a step that has been set up for a manifest
+
+    Parameters
+    ----------
+    step : compass.Step
+        A step that has been set up
+
+    Returns
+    -------
+    entry : dict
+        The entry for the step
+    """
+    return {'name': step.name,
+            'class': _get_class_name(step),
+            'path': step.path,
+            'work_dir': step.work_dir,
+            'cores': step.cores,
+            'min_cores': step.min_cores,
+            'threads': step.threads,
+            'cores_option': step.cores_option,
+            'inputs': list(step.inputs),
+            'outputs': list(step.outputs)}
+
+
+def _get_class_name(obj):
+    """ Get the full module and class name of an object """
+    obj_class = type(obj)
+    return '{}.{}'.format(obj_class.__module__, obj_class.__name__)
@@ -5,6 +5,7 @@ import xarray
 from mpas_tools.logging import check_call
 
 from compass.namelist import update
+from compass.profile import profile_phase
 
 
 def run_model(step, update_pio=True, partition_graph=True,
@@ -68,7 +69,8 @@ def run_model(step, update_pio=True, partition_graph=True,
                  '-n', namelist,
                  '-s', streams])
 
-    check_call(args, logger)
+    with profile_phase(step, 'model'):
+        check_call(args, logger)
 
 
 def partition(cores, config, logger, graph_file='graph.info'):
@@ -136,7 +138,7 @@ def update_namelist_pio(namelist, config, cores, step_dir):
 
 
 def make_graph_file(mesh_filename, graph_filename='graph.info',
-                    weight_field=None):
+                    weight_field=None, chunk_size=None):
     """
     Make a graph file from the MPAS mesh for use in the Metis graph
     partitioning software
@@ -149,48 +151,121 @@ def make_graph_file(mesh_filename, graph_filename='graph.info',
     graph_filename : str, optional
         The name of the output graph file
 
-    weight_field : str
+    weight_field : str, optional
         The name of a variable in the MPAS mesh file to use as a field of
         weights
+
+    chunk_size : int, optional
+        The number of cells to read from the mesh file and write to the graph
+        file at a time, useful for limiting the memory used on very large
+        meshes.  By default, all cells are read at once.
     """
 
     with xarray.open_dataset(mesh_filename) as ds:
 
         nCells = ds.sizes['nCells']
 
-        nEdgesOnCell = ds.nEdgesOnCell.values
-        cellsOnCell = ds.cellsOnCell.values - 1
-        if weight_field is not None:
-            if weight_field in ds:
-                raise ValueError('weight_field {} not found in {}'.format(
-                    weight_field, mesh_filename))
-            weights = ds[weight_field].values
-        else:
-            weights = None
-
-    nEdges = 0
-    for i in range(nCells):
-        for j in range(nEdgesOnCell[i]):
-            if cellsOnCell[i][j] != -1:
-                nEdges = nEdges + 1
-
-    nEdges = nEdges/2
-
-    with open(graph_filename, 'w+') as graph:
-        if weights is None:
-            graph.write('{} {}\n'.format(nCells, nEdges))
-
-            for i in range(nCells):
-                for j in range(0, nEdgesOnCell[i]):
-                    if cellsOnCell[i][j] >= 0:
-                        graph.write('{} '.format(cellsOnCell[i][j]+1))
-                graph.write('\n')
-        else:
-            graph.write('{} {} 010\n'.format(nCells, nEdges))
-
-            for i in range(nCells):
-                graph.write('{} '.format(int(weights[i])))
-                for j in range(0, nEdgesOnCell[i]):
-                    if cellsOnCell[i][j] >= 0:
-                        graph.write('{} '.format(cellsOnCell[i][j] + 1))
-                graph.write('\n')
+        if weight_field is not None and weight_field not in ds:
+            raise ValueError('weight_field {} not found in {}'.format(
+                weight_field, mesh_filename))
+
+        if chunk_size is None:
+            chunk_size = nCells
+        chunk_size = max(chunk_size, 1)
+        chunks = [(start, min(start + chunk_size, nCells)) for start in
+                  range(0, nCells, chunk_size)]
+
+        # in a first pass, count the edges
+        nEdges = 0
+        cellsOnCell = None
+        for start, end in chunks:
+            cellsOnCell, mask = _read_cells_on_cell(ds, start, end)
+            nEdges += int(numpy.count_nonzero(mask))
+
+        nEdges = nEdges/2
+
+        with open(graph_filename, 'w+') as graph:
+            if weight_field is None:
+                graph.write('{} {}\n'.format(nCells, nEdges))
+            else:
+                graph.write('{} {} 010\n'.format(nCells, nEdges))
+
+            # in a second pass, write out the neighbors of each cell
+            for start, end in chunks:
+                if len(chunks) > 1:
+                    cellsOnCell, mask = _read_cells_on_cell(ds, start, end)
+                if weight_field is None:
+                    weights = None
+                else:
+                    weights = ds[weight_field].isel(
+                        nCells=slice(start, end)).values
+                graph.write(_format_graph_rows(cellsOnCell, mask, weights))
+
+
+def read_partition(partition_filename):
+    """
+    Read a graph partition file (e.g. ``graph.info.part.<cores>`` from
+    ``gpmetis``) with the partition each cell of the mesh belongs to
+
+    Parameters
+    ----------
+    partition_filename : str
+        The name of the partition file
+
+    Returns
+    -------
+    partition : numpy.ndarray
+        The zero-based partition (e.g. core) for each cell
+    """
+    # much faster than numpy.genfromtxt() or numpy.loadtxt() (in older
+    # versions of numpy) for large meshes
+    return numpy.fromfile(partition_filename, dtype=int, sep=' ')
+
+
+def _read_cells_on_cell(ds, start, end):
+    """
+    Read zero-based ``cellsOnCell`` for a range of cells and a mask of valid
+    neighbors
+    """
+    cell_slice = slice(start, end)
+    nEdgesOnCell = ds.nEdgesOnCell.isel(nCells=cell_slice).values
+    cellsOnCell = ds.cellsOnCell.isel(nCells=cell_slice).values - 1
+    maxEdges = cellsOnCell.shape[1]
+    mask = numpy.logical_and(
+        numpy.arange(maxEdges)[numpy.newaxis, :] <
+        nEdgesOnCell[:, numpy.newaxis],
+        cellsOnCell >= 0)
+    return cellsOnCell, mask
+
+
+def _format_graph_rows(cellsOnCell, mask, weights):
+    """
+    Format the rows of a graph file for the given cells in a single string,
+    with the (optional) weight and one-based index of each neighbor of a cell
+    followed by a space, and each row ending in a newline
+    """
+    nRows = cellsOnCell.shape[0]
+    counts = numpy.count_nonzero(mask, axis=1)
+    neighbors = numpy.char.add((cellsOnCell[mask] + 1).astype(str), ' ')
+
+    if weights is None:
+        extra = 1
+    else:
+        extra = 2
+
+    # each row has its neighbors, a newline and possibly a weight
+    items = numpy.empty(len(neighbors) + extra*nRows, dtype=object)
+    row_offsets = extra*numpy.arange(nRows)
+    row_starts = numpy.cumsum(counts) - counts + row_offsets
+    if weights is not None:
+        items[row_starts] = numpy.char.add(
+            weights.astype(numpy.int64).astype(str), ' ')
+        row_starts = row_starts + 1
+        row_offsets = row_offsets + 1
+
+    neighbor_indices = numpy.arange(len(neighbors)) + \
+        numpy.repeat(row_offsets, counts)
+    items[neighbor_indices] = neighbors
+    items[row_starts + counts] = '\n'
+
+    return ''.join(items.tolist())
@@ -1,3 +1,6 @@
+import importlib
+
+
 class MpasCore:
     """
     The base class for housing all the tests for a given MPAS core, such as
@@ -10,9 +13,13 @@ class MpasCore:
 
     test_groups : dict
         A dictionary of test groups for the MPAS core with their names as keys
+
+    test_group_names : list of str
+        The names of the test groups to import and add in
+        ``add_test_group_from_package()``, or ``None`` for all test groups
     """
 
-    def __init__(self, name):
+    def __init__(self, name, test_group_names=None):
         """
         Create a new container for the test groups for a given MPAS core
 
@@ -20,8 +27,14 @@ class MpasCore:
         ----------
         name : str
             the name of the MPAS core
+
+        test_group_names : list of str, optional
+            The names of the test groups to import and add in
+            ``add_test_group_from_package()``.  By default, all test groups
+            are added.
         """
         self.name = name
+        self.test_group_names = test_group_names
 
         # test groups are added with add_test_groups()
         self.test_groups = dict()
@@ -36,3 +49,36 @@ class MpasCore:
             the test group to add
         """
         self.test_groups[test_group.name] = test_group
+
+    def add_test_group_from_package(self, package, class_name):
+        """
+        Import a test group and add it to the MPAS core.  The test group is
+        only imported and constructed if its name (the last part of the
+        package name) is in ``test_group_names``, so other test groups, their
+        test cases and the modules they import are skipped entirely.
+
+        Parameters
+        ----------
+        package : str
+            the name of the package that defines the test group, e.g.
+            ``compass.ocean.tests.ziso``
+
+        class_name : str
+            the name of the test group class in the package
+        """
+        name = package.split('.')[-1]
+        if self.test_group_names is not None and \
+                name not in self.test_group_names:
+            return
+        test_group_class = getattr(importlib.import_module(package),
+                                   class_name)
+        self.add_test_group(test_group_class(mpas_core=self))
+
+    def __getstate__(self):
+        """
+        Leave out the test groups when a test case is pickled, since only the
+        test case itself is needed at runtime
+        """
+        state = self.__dict__.copy()
+        state['test_groups'] = dict()
+        return state
@@ -1,8 +1,28 @@
+import os
+import inspect
+from importlib import resources
+
 # import new MPAS cores here
 from compass.landice import Landice
 from compass.ocean import Ocean
 
 
+def get_mpas_core_classes():
+    """
+    Get the classes for the collections of tests for all MPAS cores
+
+    Returns
+    -------
+    mpas_core_classes : dict
+        A dictionary of child classes of :py:class:`compass.MpasCore` with the
+        names of the MPAS cores as keys
+    """
+    # add new MPAS cores here
+    mpas_core_classes = {'landice': Landice,
+                         'ocean': Ocean}
+    return mpas_core_classes
+
+
 def get_mpas_cores():
     """
     Get a list of all collections of tests for MPAS cores
@@ -12,6 +32,125 @@ def get_mpas_cores():
     mpas_cores : list of compass.MpasCore
         A list of MPAS cores containing all available tests
     """
-    # add new MPAS cores here
-    mpas_cores = [Landice(), Ocean()]
+    mpas_cores = [mpas_core_class() for mpas_core_class in
+                  get_mpas_core_classes().values()]
     return mpas_cores
+
+
+def get_test_case_paths():
+    """
+    Get the paths of all test cases from the test-case registry of each MPAS
+    core, without importing or constructing any test groups
+
+    Returns
+    -------
+    paths : list of str
+        The relative paths of all test cases in the same order as they are
+        constructed (and numbered by ``compass list``)
+    """
+    paths = list()
+    for mpas_core_class in get_mpas_core_classes().values():
+        try:
+            text = resources.read_text(mpas_core_class.__module__,
+                                       _registry_filename)
+        except FileNotFoundError:
+            continue
+        for line in text.split('\n'):
+            line = line.strip()
+            if len(line) > 0 and not line.startswith('#'):
+                paths.append(line)
+    return paths
+
+
+def get_test_cases(paths):
+    """
+    Construct the test cases with the given paths.  Only the test groups that
+    contain these test cases are imported and constructed.
+
+    Parameters
+    ----------
+    paths : list of str
+        The relative paths of the test cases
+
+    Returns
+    -------
+    test_cases : dict of compass.TestCase
+        A dictionary of test cases, with their paths as keys in the same order
+        as ``paths``
+    """
+    mpas_core_classes = get_mpas_core_classes()
+    test_group_names = dict()
+    for path in paths:
+        parts = path.split('/')
+        if len(parts) < 3 or parts[0] not in mpas_core_classes:
+            raise ValueError('Test case with path {} is not in '
+                             'the list of test cases'.format(path))
+        mpas_core, test_group = parts[0:2]
+        if mpas_core not in test_group_names:
+            test_group_names[mpas_core] = list()
+        if test_group not in test_group_names[mpas_core]:
+            test_group_names[mpas_core].append(test_group)
+
+    all_test_cases = dict()
+    for mpas_core_name, names in test_group_names.items():
+        mpas_core = mpas_core_classes[mpas_core_name](test_group_names=names)
+        for test_group in mpas_core.test_groups.values():
+            for test_case in test_group.test_cases.values():
+                all_test_cases[test_case.path] = test_case
+
+    test_cases = dict()
+    for path in paths:
+        if path not in all_test_cases:
+            raise ValueError('Test case with path {} is not in '
+                             'the list of test cases'.format(path))
+        test_cases[path] = all_test_cases[path]
+    return test_cases
+
+
+def update_test_case_registry(check=False):
+    """
+    Construct all test cases and write their paths to the test-case registry
+    of each MPAS core, a ``test_cases.txt`` file in the MPAS core's package.
+    This needs to be called whenever test cases are added, removed or
+    renamed.
+
+    Parameters
+    ----------
+    check : bool, optional
+        Whether to only check if the registry is up to date, rather than
+        writing it
+
+    Returns
+    -------
+    outdated : list of str
+        The names of the MPAS cores whose registries were out of date
+    """
+    outdated = list()
+    for mpas_core in get_mpas_cores():
+        lines = ['# The paths of all {} test cases, in order.  Update with:'
+                 ''.format(mpas_core.name),
+                 '#   compass list --update-registry']
+        for test_group in mpas_core.test_groups.values():
+            for test_case in test_group.test_cases.values():
+                lines.append(test_case.path)
+        text = '\n'.join(lines) + '\n'
+
+        package = type(mpas_core).__module__
+        try:
+            old_text = resources.read_text(package, _registry_filename)
+        except FileNotFoundError:
+            old_text = None
+        if text == old_text:
+            continue
+
+        outdated.append(mpas_core.name)
+        if not check:
+            package_dir = os.path.dirname(inspect.getfile(type(mpas_core)))
+            with open(os.path.join(package_dir, _registry_filename), 'w') as f:
+                f.write(text)
+
+    return outdated
+
+
+# the name of the file in each MPAS core's package with all test-case paths
+_registry_filename = 'test_cases.txt'
@@ -1,5 +1,10 @@
+import os
+import shutil
+import importlib
 from importlib import resources
 
+from compass.cache import read_cached
+
 
 def update(replacements, step_work_dir, out_name):
     """
@@ -8,6 +13,10 @@ def update(replacements, step_work_dir, out_name):
     runtime, not during setup.  For example, the number of PIO tasks and the
     stride between tasks, which are related to the number of nodes and cores.
 
+    Only the lines with options that change are modified, so the rest of the
+    file (including comments) is left as it was, and the file isn't
+    rewritten at all if none of the options change.
+
     Parameters
     ----------
     replacements : dict
@@ -24,11 +33,31 @@ def update(replacements, step_work_dir, out_name):
 
     filename = '{}/{}'.format(step_work_dir, out_name)
 
-    namelist = ingest(filename)
+    update_files({filename: replacements})
 
-    namelist = replace(namelist, replacements)
 
-    write(namelist, filename)
+def update_files(updates):
+    """
+    Update several existing namelist files, each with its own replacements,
+    in a single pass through each file.  Options in the replacements that
+    aren't in a namelist file are ignored.
+
+    Parameters
+    ----------
+    updates : dict
+        A dictionary with the paths of namelist files as keys and
+        dictionaries of options and values to replace in each file as values
+
+    Returns
+    -------
+    changed : list of str
+        The namelist files that were modified
+    """
+    changed = list()
+    for filename, replacements in updates.items():
+        if _update_file(filename, replacements):
+            changed.append(filename)
+    return changed
 
 
 def parse_replacements(package, namelist):
@@ -49,38 +78,47 @@ def parse_replacements(package, namelist):
         A dictionary of replacement namelist options
     """
 
-    lines = resources.read_text(package, namelist).split('\n')
-    replacements = dict()
-    for line in lines:
-        if '=' in line:
-            opt, val = line.split('=')
-            replacements[opt.strip()] = val.strip()
+    filename = _get_package_filename(package, namelist)
+    if filename is None:
+        replacements = _parse_replacements(
+            resources.read_text(package, namelist))
+    else:
+        replacements = read_cached(filename, _read_replacements)
 
-    return replacements
+    return dict(replacements)
 
 
-def ingest(defaults_filename):
-    """ Read the defaults file """
-    with open(defaults_filename, 'r') as f:
-        lines = f.readlines()
+def ingest(defaults_filename, cache=False):
+    """
+    Read the defaults file
 
-    namelist = dict()
-    record = None
-    for line in lines:
-        if '&' in line:
-            record = line.strip('&').strip('\n').strip()
-            namelist[record] = dict()
-        elif '=' in line:
-            if record is not None:
-                opt, val = line.strip('\n').split('=')
-                namelist[record][opt.strip()] = val.strip()
+    Parameters
+    ----------
+    defaults_filename : str
+        The namelist file to read
 
-    return namelist
+    cache : bool, optional
+        Whether to keep the parsed namelist for the rest of this process
+        (until the file is modified), e.g. for defaults files that are read
+        for many steps
+
+    Returns
+    -------
+    namelist : dict
+        A dictionary of namelist records, each a dictionary of options and
+        values
+    """
+    if cache:
+        namelist = read_cached(defaults_filename, _ingest)
+        # a copy so changes to the namelist don't affect the cache
+        return {record: dict(options) for record, options in namelist.items()}
+    return _ingest(defaults_filename)
 
 
 def replace(namelist, replacements):
     """ Replace entries in the namelist using the replacements dict """
-    new = dict(namelist)
+    # copy the records, too, so the original namelist isn't modified
+    new = {record: dict(options) for record, options in namelist.items()}
     for record in new:
         for key in replacements:
             if key in new[record]:
@@ -99,3 +137,138 @@ def write(namelist, filename):
             for key in rec:
                 f.write('    {} = {}\n'.format(key.strip(), rec[key].strip()))
             f.write('/\n')
+
+
+def _ingest(defaults_filename):
+    """ Parse a namelist file """
+    with open(defaults_filename, 'r') as f:
+        lines = f.readlines()
+
+    namelist = dict()
+    record = None
+    for line in lines:
+        if '&' in line:
+            record = line.strip('&').strip('\n').strip()
+            namelist[record] = dict()
+        elif '=' in line:
+            if record is not None:
+                opt, val = line.strip('\n').split('=', 1)
+                namelist[record][opt.strip()] = val.strip()
+
+    return namelist
+
+
+def _update_file(filename, replacements):
+    """
+    Replace the values of options in a namelist file, modifying only the
+    lines that change, and return whether the file was modified
+    """
+    replacements = {key.strip(): '{}'.format(value).strip() for key, value
+                    in replacements.items()}
+
+    with open(filename) as f:
+        lines = f.readlines()
+
+    changed = False
+    for index, line in enumerate(lines):
+        new_line = _update_line(line, replacements)
+        if new_line is not None:
+            lines[index] = new_line
+            changed = True
+
+    if changed:
+        # write to a temporary file first so the namelist is never left
+        # partially written
+        tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            f.writelines(lines)
+        shutil.copymode(filename, tmp_filename)
+        os.replace(tmp_filename, filename)
+
+    return changed
+
+
+def _update_line(line, replacements):
+    """
+    Replace the value in a ``key = value`` line of a namelist, keeping the
+    indentation and any ``!`` comment, or return ``None`` if the line doesn't
+    change.  The value is everything after the first ``=``, so values may
+    contain ``=`` themselves.
+    """
+    if '=' not in line:
+        return None
+    key, value = line.split('=', 1)
+    key = key.strip()
+    if key not in replacements:
+        return None
+
+    if value.endswith('\n'):
+        value = value[:-1]
+        newline = '\n'
+    else:
+        newline = ''
+    comment_start = _find_comment(value)
+    comment = value[comment_start:]
+    value = value[:comment_start]
+
+    new_value = replacements[key]
+    if value.strip() == new_value:
+        return None
+
+    stripped = value.lstrip()
+    leading = value[:len(value) - len(stripped)]
+    trailing = stripped[len(stripped.rstrip()):]
+    prefix = line[:line.index('=') + 1]
+    return '{}{}{}{}{}{}'.format(prefix, leading, new_value, trailing,
+                                 comment, newline)
+
+
+def _find_comment(value):
+    """
+    Find the index of the ``!`` that starts a comment in a namelist value,
+    ignoring any in quoted strings, or the length of the value if there is no
+    comment
+    """
+    quote = None
+    for index, char in enumerate(value):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '!':
+            return index
+    return len(value)
+
+
+def _read_replacements(filename):
+    """ Read and parse a file with replacement namelist options """
+    with open(filename) as f:
+        text = f.read()
+    return _parse_replacements(text)
+
+
+def _parse_replacements(text):
+    """ Parse replacement namelist options """
+    replacements = dict()
+    for line in text.split('\n'):
+        if '=' in line:
+            opt, val = line.split('=', 1)
+            replacements[opt.strip()] = val.strip()
+    return replacements
+
+
+def _get_package_filename(package, filename):
+    """
+    Get the path to a file in a package, or ``None`` if the package isn't
+    a directory on disk
+    """
+    if isinstance(package, str):
+        package = importlib.import_module(package)
+    package_file = getattr(package, '__file__', None)
+    if package_file is None:
+        return None
+    filename = os.path.join(os.path.dirname(package_file), filename)
+    if not os.path.exists(filename):
+        return None
+    return filename
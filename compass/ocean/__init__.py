@@ -1,9 +1,4 @@
 from compass.mpas_core import MpasCore
-from compass.ocean.tests.baroclinic_channel import BaroclinicChannel
-from compass.ocean.tests.global_convergence import GlobalConvergence
-from compass.ocean.tests.global_ocean import GlobalOcean
-from compass.ocean.tests.ice_shelf_2d import IceShelf2d
-from compass.ocean.tests.ziso import Ziso
 
 
 class Ocean(MpasCore):
@@ -11,14 +6,25 @@ class Ocean(MpasCore):
     The collection of all test case for the MPAS-Ocean core
     """
 
-    def __init__(self):
+    def __init__(self, test_group_names=None):
         """
         Construct the collection of MPAS-Ocean test cases
+
+        Parameters
+        ----------
+        test_group_names : list of str, optional
+            The names of the test groups to add.  By default, all test groups
+            are added.
         """
-        super().__init__(name='ocean')
+        super().__init__(name='ocean', test_group_names=test_group_names)
 
-        self.add_test_group(BaroclinicChannel(mpas_core=self))
-        self.add_test_group(GlobalConvergence(mpas_core=self))
-        self.add_test_group(GlobalOcean(mpas_core=self))
-        self.add_test_group(IceShelf2d(mpas_core=self))
-        self.add_test_group(Ziso(mpas_core=self))
+        self.add_test_group_from_package(
+            'compass.ocean.tests.baroclinic_channel', 'BaroclinicChannel')
+        self.add_test_group_from_package(
+            'compass.ocean.tests.global_convergence', 'GlobalConvergence')
+        self.add_test_group_from_package(
+            'compass.ocean.tests.global_ocean', 'GlobalOcean')
+        self.add_test_group_from_package(
+            'compass.ocean.tests.ice_shelf_2d', 'IceShelf2d')
+        self.add_test_group_from_package(
+            'compass.ocean.tests.ziso', 'Ziso')
@@ -1,9 +1,10 @@
+import os
+import json
 import numpy
 from netCDF4 import Dataset
 import shutil
 
 from mpas_tools.cime.constants import constants
-from compass.io import symlink
 from compass.model import update_namelist_pio, partition, run_model
 
 
@@ -37,11 +38,16 @@ def compute_land_ice_pressure_and_draft(ssh, modify_mask, ref_density):
     return landIcePressure, landIceDraft
 
 
-def adjust_ssh(variable, iteration_count, step):
+def adjust_ssh(variable, iteration_count, step, tolerance=None,
+               keep_snapshots=False):
     """
     Adjust the sea surface height or land-ice pressure to be dynamically
     consistent with one another.  A series of short model runs are performed,
-    each with
+    each with the SSH or land-ice pressure updated based on the change in SSH
+    during the previous run.  The mesh fields are read only once and only the
+    variables that change are written back to ``adjusting_init.nc`` after
+    each run.  The largest change in SSH in each iteration is written to
+    ``maxDeltaSSH_<iteration>.log`` and to ``convergence.json``.
 
     Parameters
     ----------
@@ -49,10 +55,25 @@ def adjust_ssh(variable, iteration_count, step):
         The variable to adjust
 
     iteration_count : int
-        The number of iterations of adjustment
+        The maximum number of iterations of adjustment
 
     step : compass.Step
         the step for performing SSH or land-ice pressure adjustment
+
+    tolerance : float, optional
+        If provided, the adjustment stops as soon as the largest change in
+        SSH (in m) during a model run is smaller than this tolerance
+
+    keep_snapshots : bool, optional
+        Whether to keep a copy of the initial condition from each iteration
+        in ``adjusting_init<iteration>.nc``
+
+    Returns
+    -------
+    history : list of dict
+        The ``iteration`` (starting at 1), the largest change in SSH
+        ``delta_ssh_max`` and the ``cell`` (zero-based index), ``ssh`` and
+        ``land_ice_pressure`` where it occurred for each iteration
     """
     cores = step.cores
     step_dir = step.work_dir
@@ -65,63 +86,69 @@ def adjust_ssh(variable, iteration_count, step):
     update_namelist_pio('namelist.ocean', config, cores, step_dir)
     partition(cores, config, logger)
 
+    # the initial condition for all model runs is modified in place, rather
+    # than being copied in each iteration
+    if os.path.lexists('adjusting_init.nc'):
+        os.remove('adjusting_init.nc')
+    shutil.copy('adjusting_init0.nc', 'adjusting_init.nc')
+
+    # the mesh and initial state are only read once
+    with Dataset('adjusting_init.nc', 'r') as ds:
+        on_a_sphere = ds.on_a_sphere.lower() == 'yes'
+        ssh = ds.variables['ssh'][0, :]
+        bottomDepth = ds.variables['bottomDepth'][:]
+        modifyLandIcePressureMask = \
+            ds.variables['modifyLandIcePressureMask'][0, :]
+        landIcePressure = ds.variables['landIcePressure'][0, :]
+        if on_a_sphere:
+            xCell = ds.variables['lonCell'][:]
+            yCell = ds.variables['latCell'][:]
+        else:
+            xCell = ds.variables['xCell'][:]
+            yCell = ds.variables['yCell'][:]
+        maxLevelCell = ds.variables['maxLevelCell'][:]
+        if variable == 'ssh':
+            layerThickness = ds.variables['layerThickness'][0, :, :]
+
+    mask = numpy.logical_and(maxLevelCell > 0,
+                             modifyLandIcePressureMask == 1)
+    gravity = constants['SHR_CONST_G']
+
+    history = list()
     for iterIndex in range(iteration_count):
         logger.info(" * Iteration {}/{}".format(iterIndex + 1,
                                                 iteration_count))
 
-        symlink('adjusting_init{}.nc'.format(iterIndex), 'adjusting_init.nc')
-
         logger.info("   * Running forward model")
         run_model(step, update_pio=False, partition_graph=False)
         logger.info("   - Complete")
 
         logger.info("   * Updating SSH or land-ice pressure")
 
-        # copy the init file first
-        shutil.copy('adjusting_init{}.nc'.format(iterIndex),
-                    'adjusting_init{}.nc'.format(iterIndex+1))
-
-        symlink('adjusting_init{}.nc'.format(iterIndex+1),
-                'adjusting_init.nc')
+        initSSH = ssh
 
-        with Dataset('adjusting_init.nc', 'r+') as ds:
-
-            on_a_sphere = ds.on_a_sphere.lower() == 'yes'
-
-            nVertLevels = len(ds.dimensions['nVertLevels'])
-            initSSH = ds.variables['ssh'][0, :]
-            bottomDepth = ds.variables['bottomDepth'][:]
-            modifyLandIcePressureMask = ds.variables['modifyLandIcePressureMask'][0, :]
-            landIcePressure = ds.variables['landIcePressure'][0, :]
-            lonCell = ds.variables['lonCell'][:]
-            latCell = ds.variables['latCell'][:]
-            xCell = ds.variables['xCell'][:]
-            yCell = ds.variables['yCell'][:]
-            maxLevelCell = ds.variables['maxLevelCell'][:]
-
-            with Dataset('output_ssh.nc', 'r') as ds_ssh:
-                nTime = len(ds_ssh.dimensions['Time'])
-                finalSSH = ds_ssh.variables['ssh'][nTime - 1, :]
-                topDensity = ds_ssh.variables['density'][nTime - 1, :, 0]
+        with Dataset('output_ssh.nc', 'r') as ds_ssh:
+            nTime = len(ds_ssh.dimensions['Time'])
+            finalSSH = ds_ssh.variables['ssh'][nTime - 1, :]
+            topDensity = ds_ssh.variables['density'][nTime - 1, :, 0]
 
-            mask = numpy.logical_and(maxLevelCell > 0,
-                                     modifyLandIcePressureMask == 1)
+        deltaSSH = mask * (finalSSH - initSSH)
 
-            deltaSSH = mask * (finalSSH - initSSH)
-
-            # then, modify the SSH or land-ice pressure
+        # then, modify the SSH or land-ice pressure, writing only the
+        # variables that change
+        with Dataset('adjusting_init.nc', 'r+') as ds:
             if variable == 'ssh':
-                ds.variables['ssh'][0, :] = finalSSH
+                ssh = finalSSH
+                ds.variables['ssh'][0, :] = ssh
                 # also update the landIceDraft variable, which will be used to
                 # compensate for the SSH due to land-ice pressure when
                 # computing sea-surface tilt
-                ds.variables['landIceDraft'][0, :] = finalSSH
+                ds.variables['landIceDraft'][0, :] = ssh
                 # we also need to stretch layerThickness to be compatible with
                 # the new SSH
                 stretch = (finalSSH + bottomDepth) / (initSSH + bottomDepth)
-                layerThickness = ds.variables['layerThickness']
-                for k in range(nVertLevels):
-                    layerThickness[0, :, k] *= stretch
+                layerThickness *= stretch[:, numpy.newaxis]
+                ds.variables['layerThickness'][0, :, :] = layerThickness
             else:
                 # Moving the SSH up or down by deltaSSH would change the
                 # land-ice pressure by density(SSH)*g*deltaSSH. If deltaSSH is
@@ -129,7 +156,6 @@ def adjust_ssh(variable, iteration_count, step):
                 # small and if deltaSSH is negative (moving down), it means
                 # land-ice pressure is too large, the sign of the second term
                 # makes sense.
-                gravity = constants['SHR_CONST_G']
                 deltaLandIcePressure = topDensity * gravity * deltaSSH
 
                 landIcePressure = numpy.maximum(
@@ -139,6 +165,10 @@ def adjust_ssh(variable, iteration_count, step):
 
                 finalSSH = initSSH
 
+        if keep_snapshots:
+            shutil.copy('adjusting_init.nc',
+                        'adjusting_init{}.nc'.format(iterIndex+1))
+
         # Write the largest change in SSH and its lon/lat to a file
         with open('maxDeltaSSH_{:03d}.log'.format(iterIndex), 'w') as log_file:
 
@@ -147,8 +177,8 @@ def adjust_ssh(variable, iteration_count, step):
             iCell = indices[index]
             if on_a_sphere:
                 coords = 'lon/lat: {:f} {:f}'.format(
-                    numpy.rad2deg(lonCell[iCell]),
-                    numpy.rad2deg(latCell[iCell]))
+                    numpy.rad2deg(xCell[iCell]),
+                    numpy.rad2deg(yCell[iCell]))
             else:
                 coords = 'x/y: {:f} {:f}'.format(1e-3 * xCell[iCell],
                                                  1e-3 * yCell[iCell])
@@ -161,6 +191,21 @@ def adjust_ssh(variable, iteration_count, step):
             logger.info('     {}'.format(string))
             log_file.write('{}\n'.format(string))
 
+        history.append({'iteration': iterIndex + 1,
+                        'delta_ssh_max': float(deltaSSH[iCell]),
+                        'cell': int(iCell),
+                        'ssh': float(finalSSH[iCell]),
+                        'land_ice_pressure': float(landIcePressure[iCell])})
+        with open('convergence.json', 'w') as f:
+            json.dump(history, f, indent=4)
+
         logger.info("   - Complete\n")
 
-    shutil.copy('adjusting_init.nc', 'adjusted_init.nc')
+        if tolerance is not None and abs(deltaSSH[iCell]) < tolerance:
+            logger.info(" * Converged: the largest change in SSH is below "
+                        "{:g}\n".format(tolerance))
+            break
+
+    os.replace('adjusting_init.nc', 'adjusted_init.nc')
+
+    return history
@@ -1,9 +1,15 @@
+import os
+import pickle
+import shutil
+
 import netCDF4
 import numpy as np
 from pyamg.classical import interpolate as amginterp
 from pyamg.classical import split
 from scipy import sparse, spatial
 
+from compass.model import read_partition
+
 
 VERTICAL_TREATMENTS = {"indexLevel": 1,
                        "fixedZLevel": 2,
@@ -20,7 +26,7 @@ def write(init_filename, graph_filename, particle_filename, types='all',
           n_vert_levels=10, vert_seed_type='linear', n_buoy_surf=11,
           pot_dens_min=1028.5, pot_dens_max=1030.0, spatial_filter=None,
           downsample=0, seed_center=True, seed_vertex=False,
-          add_noise=False, cfl_min=0.005):
+          add_noise=False, cfl_min=0.005, seed=None):
     """
     Write an initial condition for particles partitioned across cores
 
@@ -73,12 +79,16 @@ def write(init_filename, graph_filename, particle_filename, types='all',
     cfl_min : float, optional
         minimum assumed CFL, which is used in perturbing particles if
         ``seed_vertex=True`` or ``add_noise=True``
+
+    seed : int, optional
+        seed for the random number generator used if ``add_noise=True``, so
+        that the particles can be reproduced
     """
 
     buoy_surf = np.linspace(pot_dens_min, pot_dens_max, n_buoy_surf)
     cpts, xCell, yCell, zCell = _particle_coords(
         init_filename, downsample, seed_center, seed_vertex, add_noise,
-        cfl_min)
+        cfl_min, rng=np.random.default_rng(seed))
 
     # build particles
     particlelist = []
@@ -113,6 +123,10 @@ def remap_particles(init_filename, particle_filename, graph_filename):
     We assume that all particles will be within the domain such that a nearest
     neighbor search is sufficient to make the remap.
 
+    The spatial index of cell centers used to find the nearest cell is saved
+    to ``<init_filename>.cell_tree.pickle`` (if possible) and reused as long
+    as ``init_filename`` doesn't change.
+
     Parameters
     ----------
     init_filename : str
@@ -124,44 +138,128 @@ def remap_particles(init_filename, particle_filename, graph_filename):
     particle_filename : str
         path of input/output netCDF particle file
     """
-    # load the files
-    with netCDF4.Dataset(init_filename, "r") as f_in, \
-            netCDF4.Dataset(particle_filename, "r+") as f_part:
-
-        # get the particle data
-        xpart = f_part.variables["xParticle"]
-        ypart = f_part.variables["yParticle"]
-        zpart = f_part.variables["zParticle"]
-        currentBlock = f_part.variables["currentBlock"]
+    remap_particles_batch(init_filename, particle_filename,
+                          graph_filenames=[graph_filename],
+                          out_filenames=[particle_filename])
+
+
+def remap_particles_batch(init_filename, particle_filename, graph_filenames,
+                          out_filenames):
+    """
+    Remap particles onto several grid decompositions at once, finding the
+    nearest cell to each particle only once.  See
+    :py:func:`compass.ocean.particles.remap_particles()`
+
+    Parameters
+    ----------
+    init_filename : str
+        path of netCDF init/mesh file
+
+    particle_filename : str
+        path of input netCDF particle file
+
+    graph_filenames : list of str
+        paths of graph partition files of form */*.info.part
+
+    out_filenames : list of str
+        paths of output netCDF particle files, one for each graph partition
+        file, which are copies of ``particle_filename`` with the particles
+        remapped.  One of these may be ``particle_filename`` itself.
+    """
+    if len(graph_filenames) != len(out_filenames):
+        raise ValueError('There must be one output file for each graph '
+                         'partition file.')
+
+    # get the particle data (at the latest time step)
+    with netCDF4.Dataset(particle_filename, "r") as f_part:
+        xpart = f_part.variables["xParticle"][-1, :]
+        ypart = f_part.variables["yParticle"][-1, :]
+        zpart = f_part.variables["zParticle"][-1, :]
+
+    # get nearest cell for each particle
+    tree, maxdist = _get_cell_tree(init_filename)
+    _, cellIndices = tree.query(
+        np.vstack((xpart, ypart, zpart)).T, distance_upper_bound=maxdist,
+        k=1, workers=-1)
+
+    # copy the particle file for the other decompositions before it might
+    # be modified
+    for out_filename in out_filenames:
+        if not os.path.exists(out_filename) or \
+                not os.path.samefile(out_filename, particle_filename):
+            shutil.copyfile(particle_filename, out_filename)
+
+    for graph_filename, out_filename in zip(graph_filenames, out_filenames):
+        with netCDF4.Dataset(out_filename, "r+") as f_part:
+            currentBlock = f_part.variables["currentBlock"]
+            try:
+                currentCell = f_part.variables["currentCell"]
+                currentCellGlobalID = f_part.variables["currentCellGlobalID"]
+            except KeyError:
+                currentCell = f_part.createVariable("currentCell", "i",
+                                                    ("nParticles",))
+                currentCellGlobalID = f_part.createVariable(
+                    "currentCellGlobalID", "i", ("nParticles",))
+
+            # load the decomposition (apply to latest time step)
+            decomp = read_partition(graph_filename)
+            currentBlock[-1, :] = decomp[cellIndices]
+            currentCell[-1, :] = -1
+            currentCellGlobalID[-1, :] = cellIndices + 1
+
+
+def _get_cell_tree(init_filename):
+    """
+    Get a spatial index of the cell centers of a mesh and the maximum
+    distance from a particle to the nearest cell center, reading the index
+    from a file beside the mesh if it is up to date or building it and
+    trying to save it to that file otherwise
+    """
+    init_filename = os.path.abspath(init_filename)
+    stat = os.stat(init_filename)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if init_filename in _tree_cache and \
+            _tree_cache[init_filename][0] == version:
+        return _tree_cache[init_filename][1]
+
+    tree_filename = '{}.cell_tree.pickle'.format(init_filename)
+    cell_tree = None
+    if os.path.exists(tree_filename):
         try:
-            currentCell = f_part.variables["currentCell"]
-            currentCellGlobalID = f_part.variables["currentCellGlobalID"]
-        except KeyError:
-            currentCell = f_part.createVariable("currentCell", "i",
-                                                ("nParticles",))
-            currentCellGlobalID = f_part.createVariable(
-                "currentCellGlobalID", "i", ("nParticles",))
-
-        # get the cell positions
-        xcell = f_in.variables["xCell"]
-        ycell = f_in.variables["yCell"]
-        zcell = f_in.variables["zCell"]
+            with open(tree_filename, 'rb') as f:
+                saved_version, saved_tree = pickle.load(f)
+            if saved_version == version:
+                cell_tree = saved_tree
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+
+    if cell_tree is None:
+        with netCDF4.Dataset(init_filename, "r") as f_in:
+            # get the cell positions
+            xcell = f_in.variables["xCell"][:]
+            ycell = f_in.variables["yCell"][:]
+            zcell = f_in.variables["zCell"][:]
+            dvEdge = f_in.variables["dvEdge"][:]
 
         # build the spatial tree
         tree = spatial.cKDTree(np.vstack((xcell, ycell, zcell)).T)
+        maxdist = 2.0 * max(dvEdge)
+        cell_tree = (tree, maxdist)
 
-        # get nearest cell for each particle
-        dvEdge = f_in.variables["dvEdge"]
-        maxdist = 2.0 * max(dvEdge[:])
-        _, cellIndices = tree.query(
-            np.vstack((xpart, ypart, zpart)).T, distance_upper_bound=maxdist,
-            k=1)
+        try:
+            with open(tree_filename, 'wb') as f:
+                pickle.dump((version, cell_tree), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # the mesh may be in a directory we can't write to
+            pass
 
-        # load the decomposition (apply to latest time step)
-        decomp = np.genfromtxt(graph_filename)
-        currentBlock[-1, :] = decomp[cellIndices]
-        currentCell[-1, :] = -1
-        currentCellGlobalID[-1, :] = cellIndices + 1
+    _tree_cache[init_filename] = (version, cell_tree)
+    return cell_tree
+
+
+# spatial indices of cell centers with the mesh filename as key
+_tree_cache = dict()
 
 
 def _use_defaults(name, val):
@@ -318,6 +416,8 @@ class Particles:
 class ParticleList:
     def __init__(self, particlelist):
         self.particlelist = particlelist
+        # the variables of all particles, each concatenated only once
+        self.columns = dict()
 
     def aggregate(self):
         self.len()
@@ -336,16 +436,19 @@ class ParticleList:
 
     def __getattr__(self, name):
         # __getattr__ ensures self.x is concatenated properly
-        return self.concatenate(name)
+        if name.startswith("__") or name in ["particlelist", "columns"]:
+            raise AttributeError(name)
+        if name not in self.columns:
+            self.columns[name] = self.concatenate(name)
+        return self.columns[name]
 
     def concatenate(self, varname):
-        var = getattr(self.particlelist[0], varname)
-        for alist in self.particlelist[1:]:
-            var = np.append(var, getattr(alist, varname))
-        return var
+        return np.concatenate([np.ravel(getattr(alist, varname))
+                               for alist in self.particlelist])
 
     def append(self, particlelist):
         self.particlelist.append(particlelist[:])
+        self.columns = dict()
 
     def len(self):
         self.nparticles = 0
@@ -354,16 +457,21 @@ class ParticleList:
 
         return self.nparticles
 
-    # probably a cleaner way to have this "fall through" to the particle
-    # instances themselves, but didn't have time to sort this all out so this
-    # isn't general for now
     def compute_lat_lon(self):
-        for alist in self.particlelist:
-            alist.compute_lat_lon()
+        """
+        Compute the latitude and longitude of all particles at once
+        """
+        x = self.x
+        y = self.y
+        z = self.z
 
-    def write(self, f_name, f_decomp):
+        self.columns["latParticle"] = \
+            np.arcsin(z / np.sqrt(x ** 2 + y ** 2 + z ** 2))
+        self.columns["lonParticle"] = np.arctan2(y, x)
 
-        decomp = np.genfromtxt(f_decomp)
+    def write(self, f_name, f_decomp, chunk_size=1000000):
+
+        decomp = read_partition(f_decomp)
 
         self.aggregate()
         assert (
@@ -398,47 +506,70 @@ class ParticleList:
         f_out.createVariable("zParticleReset", "f8", ("nParticles",))
         f_out.createVariable("zLevelParticleReset", "f8", ("nParticles",))
 
-        f_out.variables["xParticle"][0, :] = self.x
-        f_out.variables["yParticle"][0, :] = self.y
-        f_out.variables["zParticle"][0, :] = self.z
-
-        self.compute_lat_lon()
-        f_out.variables["lonParticle"][0, :] = self.lonParticle
-        f_out.variables["latParticle"][0, :] = self.latParticle
-
-        f_out.variables["verticalTreatment"][0, :] = self.verticaltreatment
-
-        f_out.variables["zLevelParticle"][0, :] = self.zlevel
-
         if self.buoysurf is not None and len(self.buoysurf) > 0:
             f_out.createDimension("nBuoyancySurfaces", len(self.buoysurf))
             f_out.createVariable("buoyancySurfaceValues", "f8",
                                  ("nBuoyancySurfaces"))
-            f_out.variables["buoyancyParticle"][0, :] = self.buoypart
             f_out.variables["buoyancySurfaceValues"][:] = self.buoysurf
+            buoyancy = True
+        else:
+            buoyancy = False
 
-        f_out.variables["dtParticle"][0, :] = DEFAULTS["dt"]
-        # assume single-processor mode for now
-        f_out.variables["currentBlock"][:] = 0
-        # reset each day
-        f_out.variables["resetTime"][:] = DEFAULTS["resettime"]
-        f_out.variables["indexLevel"][:] = 1
-        f_out.variables["indexToParticleID"][:] = np.arange(self.nparticles)
-
-        # resets
-        f_out.variables["currentBlock"][0, :] = decomp[self.cellindices]
-        f_out.variables["currentBlockReset"][:] = decomp[self.cellindices]
-        f_out.variables["currentCell"][0, :] = -1
-        f_out.variables["currentCellGlobalID"][0, :] = self.cellGlobalID + 1
-        f_out.variables["currentCellReset"][:] = -1
-        f_out.variables["xParticleReset"][:] = \
-            f_out.variables["xParticle"][0, :]
-        f_out.variables["yParticleReset"][:] = \
-            f_out.variables["yParticle"][0, :]
-        f_out.variables["zParticleReset"][:] = \
-            f_out.variables["zParticle"][0, :]
-        f_out.variables["zLevelParticleReset"][:] = \
-            f_out.variables["zLevelParticle"][0, :]
+        # write the particles in chunks so we don't need to make full copies
+        # of the derived variables
+        x = self.x
+        y = self.y
+        z = self.z
+        zlevel = self.zlevel
+        verticaltreatment = self.verticaltreatment
+        cellindices = self.cellindices
+        cellGlobalID = self.cellGlobalID
+        if buoyancy:
+            buoypart = self.buoypart
+        for start in range(0, self.nparticles, chunk_size):
+            chunk = slice(start, min(start + chunk_size, self.nparticles))
+            xchunk = x[chunk]
+            ychunk = y[chunk]
+            zchunk = z[chunk]
+            zlevelchunk = zlevel[chunk]
+            block = decomp[cellindices[chunk]]
+
+            f_out.variables["xParticle"][0, chunk] = xchunk
+            f_out.variables["yParticle"][0, chunk] = ychunk
+            f_out.variables["zParticle"][0, chunk] = zchunk
+
+            f_out.variables["lonParticle"][0, chunk] = np.arctan2(ychunk,
+                                                                  xchunk)
+            f_out.variables["latParticle"][0, chunk] = np.arcsin(
+                zchunk / np.sqrt(xchunk ** 2 + ychunk ** 2 + zchunk ** 2))
+
+            f_out.variables["verticalTreatment"][0, chunk] = \
+                verticaltreatment[chunk]
+
+            f_out.variables["zLevelParticle"][0, chunk] = zlevelchunk
+
+            if buoyancy:
+                f_out.variables["buoyancyParticle"][0, chunk] = \
+                    buoypart[chunk]
+
+            f_out.variables["dtParticle"][0, chunk] = DEFAULTS["dt"]
+            # reset each day
+            f_out.variables["resetTime"][chunk] = DEFAULTS["resettime"]
+            f_out.variables["indexLevel"][0, chunk] = 1
+            f_out.variables["indexToParticleID"][chunk] = \
+                np.arange(chunk.start, chunk.stop)
+
+            # resets
+            f_out.variables["currentBlock"][0, chunk] = block
+            f_out.variables["currentBlockReset"][chunk] = block
+            f_out.variables["currentCell"][0, chunk] = -1
+            f_out.variables["currentCellGlobalID"][0, chunk] = \
+                cellGlobalID[chunk] + 1
+            f_out.variables["currentCellReset"][chunk] = -1
+            f_out.variables["xParticleReset"][chunk] = xchunk
+            f_out.variables["yParticleReset"][chunk] = ychunk
+            f_out.variables["zParticleReset"][chunk] = zchunk
+            f_out.variables["zLevelParticleReset"][chunk] = zlevelchunk
 
         f_out.close()
 
@@ -453,7 +584,7 @@ def _rescale_for_shell(f_init, x, y, z):
 
 
 def _get_particle_coords(f_init, seed_center=True, seed_vertex=False,
-                         add_noise=False, CFLmin=None):
+                         add_noise=False, CFLmin=None, rng=None):
     xCell = f_init.variables["xCell"][:]
     yCell = f_init.variables["yCell"][:]
     zCell = f_init.variables["zCell"][:]
@@ -475,31 +606,26 @@ def _get_particle_coords(f_init, seed_center=True, seed_vertex=False,
         ally = []
         allz = []
         allcpts = []
+        if rng is None:
+            rng = np.random.default_rng()
+
         # There are six potential cell neighbors to perturb the particles for.
         # This selects three random directions (without replacement) at every
-        # cell.
-        cellDirs = np.stack(
-            [
-                np.random.choice(np.arange(6), size=3, replace=False)
-                for _ in range(nCells)
-            ]
-        )
+        # cell, all at once, as the first three of a random permutation of
+        # the directions
+        cellDirs = np.argsort(rng.random((nCells, 6)), axis=1)[:, 0:3]
+        neighbors = cellsOnCell[np.arange(nCells)[:, np.newaxis],
+                                cellDirs] - 1
         for ci in np.arange(3):
-            epsilon = np.abs(np.random.normal(size=nCells))
+            epsilon = np.abs(rng.normal(size=nCells))
             epsilon /= epsilon.max()
             # Adds gaussian noise at each cell, creating range of
             # [CFLMin, 2*CFLMin]
             theta = perturbation * epsilon + perturbation
 
-            x = (1.0 - theta) * xCell + theta * xCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
-            y = (1.0 - theta) * yCell + theta * yCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
-            z = (1.0 - theta) * zCell + theta * zCell[
-                cellsOnCell[range(nCells), cellDirs[:, ci]] - 1
-            ]
+            x = (1.0 - theta) * xCell + theta * xCell[neighbors[:, ci]]
+            y = (1.0 - theta) * yCell + theta * yCell[neighbors[:, ci]]
+            z = (1.0 - theta) * zCell + theta * zCell[neighbors[:, ci]]
 
             x, y, z = _rescale_for_shell(f_init, x, y, z)
 
@@ -574,12 +700,12 @@ def _expand_nlevels(x, n):
 
 
 def _particle_coords(
-    f_init, downsample, seed_center, seed_vertex, add_noise, CFLmin
+    f_init, downsample, seed_center, seed_vertex, add_noise, CFLmin, rng=None
 ):
 
     f_init = netCDF4.Dataset(f_init, "r")
     cells, cpts = _get_particle_coords(
-        f_init, seed_center, seed_vertex, add_noise, CFLmin
+        f_init, seed_center, seed_vertex, add_noise, CFLmin, rng
     )
     xCell, yCell, zCell = cells
     if downsample:
@@ -630,7 +756,10 @@ def _build_passive_floats(cpts, xCell, yCell, zCell, f_init, nvertlevels,
             "Must designate `vertseedtype` as one of the following: "
             + f"{VERTSEEDTYPE}"
         )
-    zlevel = -np.kron(wgts, f_init.variables["bottomDepth"][cpts])
+    # read all of bottomDepth, since indexing the netCDF variable directly
+    # is very slow
+    bottomDepth = f_init.variables["bottomDepth"][:]
+    zlevel = -np.kron(wgts, bottomDepth[cpts])
     cellindices = np.tile(cpts, (nvertlevels))
     f_init.close()
 
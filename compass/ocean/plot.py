@@ -1,15 +1,25 @@
+import os
 import xarray
-import xarray.plot
 import numpy as np
 import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
 
+from mpas_tools.io import write_netcdf
+
 
 def plot_initial_state(input_file_name='initial_state.nc',
-                       output_file_name='initial_state.png'):
+                       output_file_name='initial_state.png',
+                       histogram_file_name=None, chunk_size=32768,
+                       threads=1):
     """
-    creates histogram plots of the initial condition
+    creates histogram plots of the initial condition.  The masks, min, max
+    and histograms of all variables are computed in a single pass over
+    chunks of cells and edges, and the histograms are saved to a file so
+    they can be plotted again with
+    :py:func:`compass.ocean.plot.plot_initial_state_histograms()`
 
     Parameters
     ----------
@@ -18,108 +28,85 @@ def plot_initial_state(input_file_name='initial_state.nc',
 
     output_file_name: str, optional
         The path to the output image file
-    """
 
-    # load mesh variables
-    chunks = {'nCells': 32768, 'nEdges': 32768}
-    ds = xarray.open_dataset(input_file_name, chunks=chunks)
-    nCells = ds.sizes['nCells']
-    nEdges = ds.sizes['nEdges']
-    nVertLevels = ds.sizes['nVertLevels']
+    histogram_file_name : str, optional
+        The path to a NetCDF file to write the histograms to, the same as
+        ``output_file_name`` with the extension replaced by
+        ``_histograms.nc`` by default
 
-    fig = plt.figure()
-    fig.set_size_inches(16.0, 12.0)
-    plt.clf()
+    chunk_size : int, optional
+        The number of cells or edges to read at a time
+
+    threads : int, optional
+        The number of threads for reading and reducing chunks
+    """
+
+    if histogram_file_name is None:
+        histogram_file_name = '{}_histograms.nc'.format(
+            os.path.splitext(output_file_name)[0])
 
     print('plotting histograms of the initial condition')
     print('see: init/initial_state/initial_state.png')
-    d = datetime.datetime.today()
-    txt = \
-        'MPAS-Ocean initial state\n' + \
-        'date: {}\n'.format(d.strftime('%m/%d/%Y')) + \
-        'number cells: {}\n'.format(nCells) + \
-        'number cells, millions: {:6.3f}\n'.format(nCells / 1.e6) + \
-        'number layers: {}\n\n'.format(nVertLevels) + \
-        '  min val   max val  variable name\n'
 
-    plt.subplot(3, 3, 2)
-    varName = 'maxLevelCell'
-    var = ds[varName]
-    maxLevelCell = var.values - 1
-    xarray.plot.hist(var, bins=nVertLevels - 4)
-    plt.ylabel('frequency')
-    plt.xlabel(varName)
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
-
-    plt.subplot(3, 3, 3)
-    varName = 'bottomDepth'
-    var = ds[varName]
-    xarray.plot.hist(var, bins=nVertLevels - 4)
-    plt.xlabel(varName)
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
-
-    cellsOnEdge = ds['cellsOnEdge'].values - 1
-    cellMask = np.zeros((nCells, nVertLevels), bool)
-    edgeMask = np.zeros((nEdges, nVertLevels), bool)
-    for k in range(nVertLevels):
-        cellMask[:, k] = k <= maxLevelCell
-        cell0 = cellsOnEdge[:, 0]
-        cell1 = cellsOnEdge[:, 1]
-        edgeMask[:, k] = np.logical_and(np.logical_and(cellMask[cell0, k],
-                                                       cellMask[cell1, k]),
-                                        np.logical_and(cell0 >= 0,
-                                                       cell1 >= 0))
-    cellMask = xarray.DataArray(data=cellMask, dims=('nCells', 'nVertLevels'))
-    edgeMask = xarray.DataArray(data=edgeMask, dims=('nEdges', 'nVertLevels'))
-
-    plt.subplot(3, 3, 4)
-    varName = 'temperature'
-    var = ds[varName].isel(Time=0).where(cellMask)
-    xarray.plot.hist(var, bins=100, log=True)
-    plt.ylabel('frequency')
-    plt.xlabel(varName)
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
-
-    plt.subplot(3, 3, 5)
-    varName = 'salinity'
-    var = ds[varName].isel(Time=0).where(cellMask)
-    xarray.plot.hist(var, bins=100, log=True)
-    plt.xlabel(varName)
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
-
-    plt.subplot(3, 3, 6)
-    varName = 'layerThickness'
-    var = ds[varName].isel(Time=0).where(cellMask)
-    xarray.plot.hist(var, bins=100, log=True)
-    plt.xlabel(varName)
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
-
-    plt.subplot(3, 3, 7)
-    varName = 'rx1Edge'
-    var = ds[varName].isel(Time=0).where(edgeMask)
-    maxRx1Edge = var.max().values
-    xarray.plot.hist(var, bins=100, log=True)
-    plt.ylabel('frequency')
-    plt.xlabel('Haney Number, max={:4.2f}'.format(maxRx1Edge))
-    txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, var.min().values,
-                                          var.max().values, varName)
+    dsHist = compute_initial_state_histograms(
+        input_file_name, histogram_file_name, chunk_size=chunk_size,
+        threads=threads)
 
-    font = FontProperties()
-    font.set_family('monospace')
-    font.set_size(12)
-    print(txt)
-    plt.subplot(3, 3, 1)
-    plt.text(0, 1, txt, verticalalignment='top', fontproperties=font)
-    plt.axis('off')
+    _plot_initial_state_histograms(dsHist, output_file_name)
 
-    plt.tight_layout(pad=4.0)
 
-    plt.savefig(output_file_name, bbox_inches='tight', pad_inches=0.1)
+def compute_initial_state_histograms(input_file_name, histogram_file_name,
+                                     chunk_size=32768, threads=1):
+    """
+    computes the histograms of the initial condition that
+    :py:func:`compass.ocean.plot.plot_initial_state()` plots and saves them
+    to a file, so they can be plotted separately (e.g. in a background
+    process) with
+    :py:func:`compass.ocean.plot.plot_initial_state_histograms()`
+
+    Parameters
+    ----------
+    input_file_name : str
+        The path to a NetCDF file with the initial state
+
+    histogram_file_name : str
+        The path to a NetCDF file to write the histograms to
+
+    chunk_size : int, optional
+        The number of cells or edges to read at a time
+
+    threads : int, optional
+        The number of threads for reading and reducing chunks
+
+    Returns
+    -------
+    dsHist : xarray.Dataset
+        The min, max and histogram of each variable
+    """
+    with xarray.open_dataset(input_file_name) as ds:
+        dsHist = _compute_initial_state_histograms(ds, chunk_size, threads)
+
+    write_netcdf(dsHist, histogram_file_name)
+    return dsHist
+
+
+def plot_initial_state_histograms(histogram_file_name,
+                                  output_file_name='initial_state.png'):
+    """
+    creates histogram plots of the initial condition from the histograms
+    saved by :py:func:`compass.ocean.plot.plot_initial_state()`, without
+    reading the initial condition again
+
+    Parameters
+    ----------
+    histogram_file_name : str
+        The path to a NetCDF file with the histograms
+
+    output_file_name: str, optional
+        The path to the output image file
+    """
+    with xarray.open_dataset(histogram_file_name) as dsHist:
+        _plot_initial_state_histograms(dsHist.load(), output_file_name)
 
 
 def plot_vertical_grid(grid_filename, config,
@@ -200,3 +187,234 @@ def plot_vertical_grid(grid_filename, config,
     plt.text(0, 0, txt, fontsize=12)
     plt.axis('off')
     plt.savefig(out_filename)
+
+
+# the variables in the histograms of the initial state: the name of the
+# variable, the dimension of the cell or edge mask (if any), the number of
+# bins (or ``None`` for ``nVertLevels - 4``), whether the counts are on a log
+# scale and the subplot to put it in
+_initial_state_variables = [
+    ('maxLevelCell', None, None, False, 2),
+    ('bottomDepth', None, None, False, 3),
+    ('temperature', 'nCells', 100, True, 4),
+    ('salinity', 'nCells', 100, True, 5),
+    ('layerThickness', 'nCells', 100, True, 6),
+    ('rx1Edge', 'nEdges', 100, True, 7)]
+
+
+def _compute_initial_state_histograms(ds, chunk_size, threads):
+    """
+    Compute the min, max and histogram of each variable in the initial state
+    in a single pass over chunks of cells and edges
+    """
+    nCells = ds.sizes['nCells']
+    nEdges = ds.sizes['nEdges']
+    nVertLevels = ds.sizes['nVertLevels']
+
+    # the (zero-based) index of the deepest valid level on each cell and on
+    # each edge, which has valid cells on both sides
+    maxLevelCell = ds.maxLevelCell.values
+    cellsOnEdge = ds.cellsOnEdge.values - 1
+    cell0 = cellsOnEdge[:, 0]
+    cell1 = cellsOnEdge[:, 1]
+    maxLevelEdge = np.where(np.logical_and(cell0 >= 0, cell1 >= 0),
+                            np.minimum(maxLevelCell[cell0],
+                                       maxLevelCell[cell1]), 0) - 1
+
+    histograms = dict()
+    for varName, _, bins, log, _ in _initial_state_variables:
+        if bins is None:
+            bins = nVertLevels - 4
+        histograms[varName] = _Histogram(bins, log)
+
+    levels = np.arange(nVertLevels)
+
+    def read_chunk(task):
+        dim, chunk = task
+        if dim == 'nCells':
+            mask = levels <= maxLevelCell[chunk, np.newaxis] - 1
+            values = {'maxLevelCell': maxLevelCell[chunk],
+                      'bottomDepth': ds.bottomDepth[chunk].values}
+        else:
+            mask = levels <= maxLevelEdge[chunk, np.newaxis]
+            values = dict()
+        for varName, mask_dim, _, _, _ in _initial_state_variables:
+            if mask_dim == dim:
+                var = ds[varName].isel(Time=0, **{dim: chunk})
+                values[varName] = var.transpose(dim, 'nVertLevels').values[
+                    mask]
+        for varName in values:
+            var = values[varName]
+            values[varName] = var[np.logical_not(np.isnan(var))]
+        return values
+
+    tasks = [('nCells', slice(start, start + chunk_size)) for start in
+             range(0, nCells, chunk_size)] + \
+        [('nEdges', slice(start, start + chunk_size)) for start in
+         range(0, nEdges, chunk_size)]
+
+    for values in _map_in_order(read_chunk, tasks, threads):
+        for varName in values:
+            histograms[varName].add(values[varName])
+
+    dsHist = xarray.Dataset()
+    for varName, _, _, _, _ in _initial_state_variables:
+        histogram = histograms[varName]
+        edges, counts = histogram.get_bins()
+        name = '{}{}'.format(varName[0].upper(), varName[1:])
+        counts = xarray.DataArray(counts, dims=('n{}Bins'.format(name),))
+        counts.attrs['min'] = histogram.min
+        counts.attrs['max'] = histogram.max
+        counts.attrs['log'] = int(histogram.log)
+        dsHist['{}Counts'.format(varName)] = counts
+        dsHist['{}BinEdges'.format(varName)] = \
+            ('n{}BinEdges'.format(name), edges)
+    dsHist.attrs['nCells'] = nCells
+    dsHist.attrs['nVertLevels'] = nVertLevels
+    return dsHist
+
+
+def _plot_initial_state_histograms(dsHist, output_file_name):
+    """ Plot the histograms of the initial state """
+    nCells = dsHist.attrs['nCells']
+    nVertLevels = dsHist.attrs['nVertLevels']
+
+    fig = plt.figure()
+    fig.set_size_inches(16.0, 12.0)
+    plt.clf()
+
+    d = datetime.datetime.today()
+    txt = \
+        'MPAS-Ocean initial state\n' + \
+        'date: {}\n'.format(d.strftime('%m/%d/%Y')) + \
+        'number cells: {}\n'.format(nCells) + \
+        'number cells, millions: {:6.3f}\n'.format(nCells / 1.e6) + \
+        'number layers: {}\n\n'.format(nVertLevels) + \
+        '  min val   max val  variable name\n'
+
+    for varName, _, _, _, index in _initial_state_variables:
+        counts = dsHist['{}Counts'.format(varName)]
+        edges = dsHist['{}BinEdges'.format(varName)].values
+        plt.subplot(3, 3, index)
+        plt.hist(edges[0:-1], bins=edges, weights=counts.values,
+                 log=bool(counts.attrs['log']))
+        if index in [2, 4, 7]:
+            plt.ylabel('frequency')
+        if varName == 'rx1Edge':
+            plt.xlabel('Haney Number, max={:4.2f}'.format(counts.attrs['max']))
+        else:
+            plt.xlabel(varName)
+        txt = '{}{:9.2e} {:9.2e} {}\n'.format(txt, counts.attrs['min'],
+                                              counts.attrs['max'], varName)
+
+    font = FontProperties()
+    font.set_family('monospace')
+    font.set_size(12)
+    print(txt)
+    plt.subplot(3, 3, 1)
+    plt.text(0, 1, txt, verticalalignment='top', fontproperties=font)
+    plt.axis('off')
+
+    plt.tight_layout(pad=4.0)
+
+    plt.savefig(output_file_name, bbox_inches='tight', pad_inches=0.1)
+
+
+def _map_in_order(function, tasks, threads):
+    """
+    Apply a function to each task on a pool of threads, yielding the results
+    in order.  Only a few tasks are run ahead of the results that have been
+    used, to limit memory usage.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = deque()
+        for task in tasks:
+            futures.append(executor.submit(function, task))
+            if len(futures) > 2 * threads:
+                yield futures.popleft().result()
+        while len(futures) > 0:
+            yield futures.popleft().result()
+
+
+class _Histogram:
+    """
+    A histogram that is accumulated one chunk of data at a time, along with
+    the exact min and max.  The counts are kept on a grid of fine bins of
+    equal width (16 times as many as will be plotted) that doubles in width
+    whenever a chunk falls outside of it.
+    """
+    def __init__(self, bins, log):
+        self.bins = bins
+        self.log = log
+        self.fine_bins = 16 * bins
+        self.min = np.nan
+        self.max = np.nan
+        # the fine bins are [index * width, (index + 1) * width) for indices
+        # from start to start + fine_bins - 1
+        self.counts = None
+        self.width = None
+        self.start = None
+
+    def add(self, values):
+        """ Add a chunk of values to the histogram """
+        if values.size == 0:
+            return
+        vmin = float(values.min())
+        vmax = float(values.max())
+        if self.counts is None:
+            self.min = vmin
+            self.max = vmax
+            if vmax > vmin:
+                self.width = (vmax - vmin) / (self.fine_bins - 2)
+            else:
+                self.width = max(abs(vmin), 1.) / self.fine_bins
+            self.start = int(np.floor(vmin / self.width))
+            self.counts = np.zeros(self.fine_bins, dtype=np.int64)
+        else:
+            self.min = min(self.min, vmin)
+            self.max = max(self.max, vmax)
+            low = min(self.start, int(np.floor(vmin / self.width)))
+            high = max(self.start + self.fine_bins - 1,
+                       int(np.floor(vmax / self.width)))
+            factor = 1
+            while high // factor - low // factor >= self.fine_bins:
+                factor *= 2
+            if factor > 1:
+                low = low // factor
+                high = high // factor
+                # center the data in the new grid to leave room on both sides
+                start = (low + high + 1 - self.fine_bins) // 2
+                start = min(max(start, high + 1 - self.fine_bins), low)
+                self._regrid(factor, start)
+
+        indices = np.floor(values / self.width).astype(np.int64) - self.start
+        # in case of round-off at the edges of the grid
+        np.clip(indices, 0, self.fine_bins - 1, out=indices)
+        self.counts += np.bincount(indices, minlength=self.fine_bins)
+
+    def get_bins(self):
+        """
+        Combine the fine bins spanning the data into about ``bins`` bins,
+        returning the bin edges and counts
+        """
+        if self.counts is None:
+            return np.array([0., 1.]), np.zeros(1, dtype=np.int64)
+        nonzero = np.nonzero(self.counts)[0]
+        first = nonzero[0]
+        count = nonzero[-1] + 1 - first
+        factor = int(np.ceil(count / self.bins))
+        bins = int(np.ceil(count / factor))
+        counts = np.zeros(bins * factor, dtype=np.int64)
+        counts[0:count] = self.counts[first:first + count]
+        counts = counts.reshape((bins, factor)).sum(axis=1)
+        edges = (self.start + first + factor * np.arange(bins + 1)) * \
+            self.width
+        return edges, counts
+
+    def _regrid(self, factor, start):
+        """ Merge the fine bins into bins that are factor times as wide """
+        indices = (self.start + np.arange(self.fine_bins)) // factor - start
+        self.counts = np.bincount(indices, weights=self.counts,
+                                  minlength=self.fine_bins).astype(np.int64)
+        self.width *= factor
+        self.start = start
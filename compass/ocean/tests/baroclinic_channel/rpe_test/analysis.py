@@ -53,12 +53,20 @@ class Analysis(Step):
         section = self.config['baroclinic_channel']
         nx = section.getint('nx')
         ny = section.getint('ny')
-        _plot(nx, ny, self.outputs[0], self.nus)
+        sections = _read_sections(nx, ny, len(self.nus))
+        self.add_plot(self.outputs[0], _plot, out_filename=self.outputs[0],
+                      sections=sections, nus=self.nus)
 
 
-def _plot(nx, ny, filename, nus):
+# the time indices and the days they correspond to for each row of the plot
+_iTime = [0]
+_time = ['20']
+
+
+def _read_sections(nx, ny, nCol):
     """
-    Plot section of the baroclinic channel at different viscosities
+    Read the temperature section of the baroclinic channel at each time and
+    viscosity
 
     Parameters
     ----------
@@ -68,28 +76,21 @@ def _plot(nx, ny, filename, nus):
     ny : int
         The number of cells in the y direction (before culling)
 
-    filename : str
-        The output file name
+    nCol : int
+        The number of viscosities
 
-    nus : list of float
-        The viscosity values
+    Returns
+    -------
+    sections : list of list of numpy.ndarray
+        The temperature at each time (row) and viscosity (column)
     """
-
-    plt.switch_backend('Agg')
-
-    nRow = 1
-    nCol = 5
-    iTime = [0]
-    time = ['20']
-
-    fig, axs = plt.subplots(nRow, nCol, figsize=(
-        2.1 * nCol, 5.0 * nRow), constrained_layout=True)
-
+    nRow = len(_iTime)
+    sections = [[None] * nCol for _ in range(nRow)]
     for iCol in range(nCol):
+        ncfile = Dataset('output_{}.nc'.format(iCol + 1), 'r')
         for iRow in range(nRow):
-            ncfile = Dataset('output_{}.nc'.format(iCol + 1), 'r')
             var = ncfile.variables['temperature']
-            var1 = np.reshape(var[iTime[iRow], :, 0], [ny, nx])
+            var1 = np.reshape(var[_iTime[iRow], :, 0], [ny, nx])
             # flip in y-dir
             var = np.flipud(var1)
 
@@ -100,17 +101,46 @@ def _plot(nx, ny, filename, nus):
                 for i in range(1, nx - 2):
                     var_avg[j, i] = (var[j, i + 1] + var[j, i]) / 2.0
 
+            sections[iRow][iCol] = var_avg
+        ncfile.close()
+    return sections
+
+
+def _plot(out_filename, sections, nus):
+    """
+    Plot section of the baroclinic channel at different viscosities
+
+    Parameters
+    ----------
+    out_filename : str
+        The output file name
+
+    sections : list of list of numpy.ndarray
+        The temperature at each time (row) and viscosity (column)
+
+    nus : list of float
+        The viscosity values
+    """
+
+    nRow = len(sections)
+    nCol = len(sections[0])
+
+    fig, axs = plt.subplots(nRow, nCol, figsize=(
+        2.1 * nCol, 5.0 * nRow), constrained_layout=True)
+
+    for iCol in range(nCol):
+        for iRow in range(nRow):
             if nRow == 1:
                 ax = axs[iCol]
             else:
                 ax = axs[iRow, iCol]
             dis = ax.imshow(
-                var_avg,
+                sections[iRow][iCol],
                 extent=[0, 160, 0, 500],
                 cmap='cmo.thermal',
                 vmin=11.8,
                 vmax=13.0)
-            ax.set_title("day {}, $\\nu_h=${}".format(time[iRow], nus[iCol]))
+            ax.set_title("day {}, $\\nu_h=${}".format(_time[iRow], nus[iCol]))
             ax.set_xticks(np.arange(0, 161, step=40))
             ax.set_yticks(np.arange(0, 501, step=50))
 
@@ -123,6 +153,5 @@ def _plot(nx, ny, filename, nus):
                     fig.colorbar(dis, ax=axs[nCol - 1], aspect=40)
                 else:
                     fig.colorbar(dis, ax=axs[iRow, nCol - 1], aspect=40)
-            ncfile.close()
 
-    plt.savefig(filename)
+    plt.savefig(out_filename)
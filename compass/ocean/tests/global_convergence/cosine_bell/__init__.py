@@ -97,6 +97,9 @@ class CosineBell(TestCase):
             step = self.steps['QU{}_forward'.format(resolution)]
             step.cores = cores
             step.min_cores = min_cores
+            # the number of cores is read from this config option at runtime
+            step.cores_option = ('cosine_bell',
+                                 'QU{}_cores'.format(resolution))
 
             config.set('cosine_bell', 'QU{}_cores'.format(resolution),
                        str(cores))
@@ -46,7 +46,6 @@ class Analysis(Step):
         """
         Run this step of the test case
         """
-        plt.switch_backend('Agg')
         resolutions = self.resolutions
         xdata = list()
         ydata = list()
@@ -62,13 +61,9 @@ class Analysis(Step):
 
         yfit = xdata**p[0] * 10**p[1]
 
-        plt.loglog(xdata, yfit, 'k')
-        plt.loglog(xdata, ydata, 'or')
-        plt.annotate('Order of Convergence = {}'.format(np.round(conv, 3)),
-                     xycoords='axes fraction', xy=(0.3, 0.95), fontsize=14)
-        plt.xlabel('Number of Grid Cells', fontsize=14)
-        plt.ylabel('L2 Norm', fontsize=14)
-        plt.savefig('convergence.png', bbox_inches='tight', pad_inches=0.1)
+        self.add_plot('convergence.png', _plot_convergence,
+                      out_filename='convergence.png', xdata=xdata, ydata=ydata,
+                      yfit=yfit, conv=conv)
 
     def rmse(self, resolution):
         """
@@ -137,3 +132,16 @@ class Analysis(Step):
         init.close()
         ds.close()
         return rmseValue, init.dims['nCells']
+
+
+def _plot_convergence(out_filename, xdata, ydata, yfit, conv):
+    """
+    Plot the RMSE and its fit against the number of cells
+    """
+    plt.loglog(xdata, yfit, 'k')
+    plt.loglog(xdata, ydata, 'or')
+    plt.annotate('Order of Convergence = {}'.format(np.round(conv, 3)),
+                 xycoords='axes fraction', xy=(0.3, 0.95), fontsize=14)
+    plt.xlabel('Number of Grid Cells', fontsize=14)
+    plt.ylabel('L2 Norm', fontsize=14)
+    plt.savefig(out_filename, bbox_inches='tight', pad_inches=0.1)
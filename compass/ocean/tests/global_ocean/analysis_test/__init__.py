@@ -124,7 +124,8 @@ class AnalysisTest(ForwardTestCase):
                   'compute_eddyProductVariables', 'write_eddyProductVariables',
                   'compute_oceanHeatContent', 'write_oceanHeatContent',
                   'compute_mixedLayerHeatBudget', 'write_mixedLayerHeatBudget']
-        compare_timers(timers, config, work_dir, rundir1='forward')
+        compare_timers(timers, config, work_dir, rundir1='forward',
+                       test_case=self)
 
         variables = ['temperature', 'salinity', 'layerThickness',
                      'normalVelocity']
@@ -140,4 +141,5 @@ class AnalysisTest(ForwardTestCase):
                           filename1='forward/output.nc')
 
         timers = ['time integration']
-        compare_timers(timers, self.config, self.work_dir, rundir1='forward')
+        compare_timers(timers, self.config, self.work_dir, rundir1='forward',
+                       test_case=self)
@@ -1,16 +1,23 @@
 import os
 import xarray
 import glob
+import tempfile
+from functools import partial
 
 from pyremap import get_lat_lon_descriptor, get_polar_descriptor, \
     MpasMeshDescriptor, Remapper
+import geometric_features
 from geometric_features import GeometricFeatures
 from geometric_features.aggregation import get_aggregator_by_name
+import mpas_tools
 from mpas_tools.logging import check_call
 from mpas_tools.ocean.moc import add_moc_southern_boundary_transects
 from mpas_tools.io import write_netcdf
 
+from compass.cache import get_file_cache_dir, get_cached_file, hash_file, \
+    hash_items, hash_mesh
 from compass.io import symlink
+from compass.parallel import run_concurrently
 from compass.step import Step
 
 
@@ -60,14 +67,18 @@ class DiagnosticsFiles(Step):
         with xarray.open_dataset('restart.nc') as ds:
             mesh_short_name = ds.attrs['MPAS_Mesh_Short_Name']
 
+        cache_dir = get_file_cache_dir(self, 'diagnostics_files')
         make_diagnostics_files(self.config, self.logger, mesh_short_name,
-                               self.with_ice_shelf_cavities, self.cores)
+                               self.with_ice_shelf_cavities, self.cores,
+                               cache_dir=cache_dir)
 
 
 def make_diagnostics_files(config, logger, mesh_short_name,
-                           with_ice_shelf_cavities, cores):
+                           with_ice_shelf_cavities, cores, cache_dir=None):
     """
-    Run this step of the testcase
+    Run this step of the testcase.  The masks and mapping files don't depend
+    on one another, so they are made concurrently, splitting the cores
+    between them.
 
     Parameters
     ----------
@@ -84,7 +95,12 @@ def make_diagnostics_files(config, logger, mesh_short_name,
         Whether the mesh has ice-shelf cavities
 
     cores : int
-        The number of cores to use to build mapping files
+        The number of cores to use to build masks and mapping files
+
+    cache_dir : str, optional
+        A directory for caching geojson and mask files, keyed by hashes of
+        the mesh and the feature collections, so they don't need to be made
+        again for the same mesh.  By default, nothing is cached.
     """
 
     for directory in [
@@ -96,9 +112,14 @@ def make_diagnostics_files(config, logger, mesh_short_name,
             os.makedirs(directory)
         except OSError:
             pass
-    _make_moc_masks(mesh_short_name, logger, cores)
 
-    gf = GeometricFeatures()
+    if cache_dir is None:
+        mesh_hash = None
+    else:
+        # the restart file has the mesh but also the model state, which
+        # changes with each run
+        mesh_hash = hash_mesh('restart.nc')
+
     region_groups = ['Antarctic Regions', 'Arctic Ocean Regions',
                      'Arctic Sea Ice Regions', 'Ocean Basins',
                      'Ocean Subbasins', 'ISMIP6 Regions']
@@ -106,27 +127,40 @@ def make_diagnostics_files(config, logger, mesh_short_name,
     if with_ice_shelf_cavities:
         region_groups.append('Ice Shelves')
 
-    for region_group in region_groups:
-        function, prefix, date = get_aggregator_by_name(region_group)
-        suffix = '{}{}'.format(prefix, date)
-        fcMask = function(gf)
-        _make_region_masks(mesh_short_name, suffix=suffix, fcMask=fcMask,
-                           logger=logger, cores=cores)
-
     transect_groups = ['Transport Transects']
-    for transect_group in transect_groups:
-        function, prefix, date = get_aggregator_by_name(transect_group)
-        suffix = '{}{}'.format(prefix, date)
-        fcMask = function(gf)
-        _make_transect_masks(mesh_short_name, suffix=suffix, fcMask=fcMask,
-                             logger=logger, cores=cores)
 
-    _make_analysis_lat_lon_map(config, mesh_short_name, cores, logger)
-    _make_analysis_polar_map(config, mesh_short_name,
-                             projection='antarctic', cores=cores,
-                             logger=logger)
-    _make_analysis_polar_map(config, mesh_short_name, projection='arctic',
-                             cores=cores, logger=logger)
+    # the geojson files share the geometric features cache, so they are made
+    # one at a time before the masks
+    gf = GeometricFeatures()
+    moc_suffix, date = _make_geojson(gf, 'MOC Basins', cache_dir)
+    region_suffixes = [_make_geojson(gf, group, cache_dir)[0] for group in
+                       region_groups]
+    transect_suffixes = [_make_geojson(gf, group, cache_dir)[0] for group in
+                         transect_groups]
+
+    # the mapping files come first because they benefit the most from extra
+    # cores
+    jobs = [partial(_make_analysis_lat_lon_map, config, mesh_short_name,
+                    logger=logger),
+            partial(_make_analysis_polar_map, config, mesh_short_name,
+                    projection='antarctic', logger=logger),
+            partial(_make_analysis_polar_map, config, mesh_short_name,
+                    projection='arctic', logger=logger),
+            partial(_make_moc_masks, mesh_short_name, suffix=moc_suffix,
+                    date=date, logger=logger, cache_dir=cache_dir,
+                    mesh_hash=mesh_hash)]
+
+    for suffix in region_suffixes:
+        jobs.append(partial(_make_region_masks, mesh_short_name,
+                            suffix=suffix, logger=logger,
+                            cache_dir=cache_dir, mesh_hash=mesh_hash))
+
+    for suffix in transect_suffixes:
+        jobs.append(partial(_make_transect_masks, mesh_short_name,
+                            suffix=suffix, logger=logger,
+                            cache_dir=cache_dir, mesh_hash=mesh_hash))
+
+    run_concurrently(jobs, cores)
 
     # make links in output directory
     files = glob.glob('map_*')
@@ -138,21 +172,39 @@ def make_diagnostics_files(config, logger, mesh_short_name,
                 '{}/{}'.format(output_dir, filename))
 
 
-def _make_region_masks(mesh_name, suffix, fcMask, logger, cores):
+def _make_geojson(gf, group, cache_dir):
+    """
+    Make the geojson file for a group of features, returning the suffix of
+    the file and the date of the features
+    """
+    function, prefix, date = get_aggregator_by_name(group)
+    suffix = '{}{}'.format(prefix, date)
+    geojson_filename = '{}.geojson'.format(suffix)
+
+    def make():
+        fcMask = function(gf)
+        fcMask.to_geojson(geojson_filename)
+
+    key = hash_items(['geojson', group, geometric_features.__version__])
+    get_cached_file(geojson_filename, key, cache_dir, make)
+
+    return suffix, date
+
+
+def _make_region_masks(mesh_name, suffix, logger, cores, cache_dir,
+                       mesh_hash):
     mesh_filename = 'restart.nc'
 
     geojson_filename = '{}.geojson'.format(suffix)
     mask_filename = '{}_{}.nc'.format(mesh_name, suffix)
 
-    fcMask.to_geojson(geojson_filename)
-
     args = ['compute_mpas_region_masks',
             '-m', mesh_filename,
             '-g', geojson_filename,
             '-o', mask_filename,
-            '-t', 'cell',
-            '--process_count', '{}'.format(cores)]
-    check_call(args, logger=logger)
+            '-t', 'cell']
+    _compute_mask(args, geojson_filename, mask_filename, logger, cores,
+                  cache_dir, mesh_hash)
 
     # make links in output directory
     output_dir = '../assembled_files/diagnostics/mpas_analysis/' \
@@ -161,24 +213,22 @@ def _make_region_masks(mesh_name, suffix, fcMask, logger, cores):
             '{}/{}'.format(output_dir, mask_filename))
 
 
-def _make_transect_masks(mesh_name, suffix, fcMask, logger, cores,
-                         subdivision_threshold=10e3):
+def _make_transect_masks(mesh_name, suffix, logger, cores, cache_dir,
+                         mesh_hash, subdivision_threshold=10e3):
     mesh_filename = 'restart.nc'
 
     geojson_filename = '{}.geojson'.format(suffix)
     mask_filename = '{}_{}.nc'.format(mesh_name, suffix)
 
-    fcMask.to_geojson(geojson_filename)
-
     args = ['compute_mpas_transect_masks',
             '-m', mesh_filename,
             '-g', geojson_filename,
             '-o', mask_filename,
             '-t', 'edge',
             '-s', '{}'.format(subdivision_threshold),
-            '--process_count', '{}'.format(cores),
             '--add_edge_sign']
-    check_call(args, logger=logger)
+    _compute_mask(args, geojson_filename, mask_filename, logger, cores,
+                  cache_dir, mesh_hash)
 
     # make links in output directory
     output_dir = '../assembled_files/diagnostics/mpas_analysis/' \
@@ -241,45 +291,45 @@ def _make_mapping_file(mesh_name, outGridName, inDescriptor, outDescriptor,
 
     remapper = Remapper(inDescriptor, outDescriptor, mappingFileName)
 
-    remapper.build_mapping_file(method='bilinear', mpiTasks=cores, tempdir='.',
-                                logger=logger,
-                                esmf_parallel_exec=parallel_executable)
+    # each mapping file needs its own directory for the SCRIP files because
+    # they are made at the same time
+    with tempfile.TemporaryDirectory(dir='.') as temp_dir:
+        remapper.build_mapping_file(method='bilinear', mpiTasks=cores,
+                                    tempdir=temp_dir, logger=logger,
+                                    esmf_parallel_exec=parallel_executable)
 
 
-def _make_moc_masks(mesh_short_name, logger, cores):
-    gf = GeometricFeatures()
-
+def _make_moc_masks(mesh_short_name, suffix, date, logger, cores, cache_dir,
+                    mesh_hash):
     mesh_filename = 'restart.nc'
 
-    function, prefix, date = get_aggregator_by_name('MOC Basins')
-    fcMask = function(gf)
-
-    suffix = '{}{}'.format(prefix, date)
-
     geojson_filename = '{}.geojson'.format(suffix)
     mask_filename = '{}_{}.nc'.format(mesh_short_name, suffix)
 
-    fcMask.to_geojson(geojson_filename)
-
     args = ['compute_mpas_region_masks',
             '-m', mesh_filename,
             '-g', geojson_filename,
             '-o', mask_filename,
-            '-t', 'cell',
-            '--process_count', '{}'.format(cores)]
-    check_call(args, logger=logger)
+            '-t', 'cell']
+    mask_key = _compute_mask(args, geojson_filename, mask_filename, logger,
+                             cores, cache_dir, mesh_hash)
 
     mask_and_transect_filename = '{}_mocBasinsAndTransects{}.nc'.format(
         mesh_short_name, date)
 
-    dsMesh = xarray.open_dataset(mesh_filename)
-    dsMask = xarray.open_dataset(mask_filename)
+    def make():
+        dsMesh = xarray.open_dataset(mesh_filename)
+        dsMask = xarray.open_dataset(mask_filename)
 
-    dsMasksAndTransects = add_moc_southern_boundary_transects(
-        dsMask, dsMesh, logger=logger)
+        dsMasksAndTransects = add_moc_southern_boundary_transects(
+            dsMask, dsMesh, logger=logger)
 
-    write_netcdf(dsMasksAndTransects, mask_and_transect_filename,
-                 char_dim_name='StrLen')
+        write_netcdf(dsMasksAndTransects, mask_and_transect_filename,
+                     char_dim_name='StrLen')
+
+    key = hash_items(['moc_transects', mpas_tools.__version__, mesh_hash,
+                      mask_key])
+    get_cached_file(mask_and_transect_filename, key, cache_dir, make)
 
     # make links in output directories (both inputdata and diagnostics)
     output_dir = '../assembled_files/inputdata/ocn/mpas-o/{}'.format(
@@ -295,3 +345,20 @@ def _make_moc_masks(mesh_short_name, logger, cores):
         '../../../../diagnostics_files/{}'.format(
             mask_and_transect_filename),
         '{}/{}'.format(output_dir, mask_and_transect_filename))
+
+
+def _compute_mask(args, geojson_filename, mask_filename, logger, cores,
+                  cache_dir, mesh_hash):
+    """
+    Compute a mask with one of the tools from ``mpas_tools`` or restore it
+    from the cache if it was made before from the same mesh and features.
+    Returns the key for the mask in the cache.
+    """
+    def make():
+        check_call(args + ['--process_count', '{}'.format(cores)],
+                   logger=logger)
+
+    key = hash_items(['mask', mpas_tools.__version__, mesh_hash,
+                      hash_file(geojson_filename)] + args)
+    get_cached_file(mask_filename, key, cache_dir, make)
+    return key
@@ -1,18 +1,23 @@
 import os
+import json
 import xarray
 import numpy as np
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 
 from mpas_tools.logging import check_call
 
+from compass.cache import hash_file
 from compass.io import symlink
+from compass.model import read_partition
 from compass.step import Step
 
 
 class OceanGraphPartition(Step):
     """
-    A step for creating an E3SM ocean initial condition from the results of
-    a dynamic-adjustment process to dissipate fast waves
+    A step for creating graph partitions of the mesh for a range of numbers
+    of cores in E3SM.  ``gpmetis`` is run for several numbers of partitions
+    at once, one on each of the step's cores.
     """
     def __init__(self, test_case, mesh, restart_filename):
         """
@@ -31,8 +36,8 @@ class OceanGraphPartition(Step):
             use as the basis for an E3SM initial condition
         """
 
-        super().__init__(test_case, name='ocean_graph_partition', cores=1,
-                         min_cores=1, threads=1)
+        super().__init__(test_case, name='ocean_graph_partition', cores=None,
+                         min_cores=None, threads=1)
 
         self.add_input_file(filename='README', target='../README')
         self.add_input_file(filename='restart.nc',
@@ -47,6 +52,16 @@ class OceanGraphPartition(Step):
         # short name, which is not known at setup time.  Currently, this is
         # safe because no other steps depend on the outputs of this one.
 
+    def setup(self):
+        """
+        Set the number of cores from config options
+        """
+        section = self.config['files_for_e3sm']
+        if self.cores is None:
+            self.cores = section.getint('graph_partition_cores')
+        if self.min_cores is None:
+            self.min_cores = section.getint('graph_partition_min_cores')
+
     def run(self):
         """
         Run this step of the testcase
@@ -65,9 +80,12 @@ class OceanGraphPartition(Step):
         except OSError:
             pass
 
-        symlink('graph.info', 'mpas-o.graph.info.{}'.format(creation_date))
+        graph_filename = 'mpas-o.graph.info.{}'.format(creation_date)
+        symlink('graph.info', graph_filename)
 
-        nCells = sum(1 for _ in open('graph.info'))
+        # the number of cells is the first entry in the graph file
+        with open('graph.info') as f:
+            nCells = int(f.readline().split()[0])
         min_graph_size = int(nCells / 6000)
         max_graph_size = int(nCells / 100)
         logger.info('Creating graph files between {} and {}'.format(
@@ -79,11 +97,45 @@ class OceanGraphPartition(Step):
         for power10 in range(3):
             n = np.concatenate([n, 10**power10 * n_multiples12])
 
+        partition_counts = list()
         for index in range(len(n)):
             if min_graph_size <= n[index] <= max_graph_size:
-                args = ['gpmetis', 'mpas-o.graph.info.{}'.format(creation_date),
-                        '{}'.format(n[index])]
-                check_call(args, logger)
+                partition_counts.append(int(n[index]))
+
+        # skip partitions that were already made from the same graph file
+        cache_filename = 'graph_partitions.json'
+        graph_hash = hash_file('graph.info')
+        done = list()
+        if os.path.exists(cache_filename):
+            with open(cache_filename) as f:
+                cache = json.load(f)
+            if cache['graph_hash'] == graph_hash:
+                done = [count for count in partition_counts if
+                        count in cache['partitions'] and
+                        os.path.exists(_part_filename(graph_filename, count))]
+        todo = [count for count in partition_counts if count not in done]
+        if len(done) > 0:
+            logger.info('Skipping partitions that already exist: {}'.format(
+                ', '.join(['{}'.format(count) for count in done])))
+
+        def make_partition(count):
+            args = ['gpmetis', graph_filename, '{}'.format(count)]
+            check_call(args, logger)
+
+        if len(todo) > 0:
+            with ThreadPoolExecutor(max_workers=self.cores) as executor:
+                # raise the first error (if any) after all partitions finish
+                futures = [executor.submit(make_partition, count) for count
+                           in todo]
+                for future in futures:
+                    future.result()
+
+        with open(cache_filename, 'w') as f:
+            json.dump({'graph_hash': graph_hash,
+                       'partitions': sorted(set(done + todo))}, f, indent=4)
+
+        _write_imbalance(graph_filename, partition_counts,
+                         'partition_imbalance.csv', logger)
 
         # create link in assembled files directory
         files = glob('mpas-o.graph.info.*')
@@ -92,3 +144,27 @@ class OceanGraphPartition(Step):
         for file in files:
             symlink('../../../../../ocean_graph_partition/{}'.format(file),
                     '{}/{}'.format(dest_path, file))
+
+
+def _part_filename(graph_filename, count):
+    """ The name of the partition file gpmetis writes """
+    return '{}.part.{}'.format(graph_filename, count)
+
+
+def _write_imbalance(graph_filename, partition_counts, out_filename, logger):
+    """
+    Write the number of cells in the smallest and largest partitions and the
+    load imbalance (the largest number of cells over the mean) for each
+    number of partitions
+    """
+    logger.info('Load imbalance (max/mean cells per partition):')
+    with open(out_filename, 'w') as f:
+        f.write('partitions,min_cells,max_cells,mean_cells,imbalance\n')
+        for count in partition_counts:
+            partition = read_partition(_part_filename(graph_filename, count))
+            cells = np.bincount(partition, minlength=count)
+            mean = len(partition) / count
+            imbalance = cells.max() / mean
+            f.write('{},{},{},{:.1f},{:.4f}\n'.format(
+                count, cells.min(), cells.max(), mean, imbalance))
+            logger.info('  {:7d} partitions: {:.4f}'.format(count, imbalance))
@@ -193,6 +193,9 @@ class ForwardTestCase(TestCase):
         Modify the configuration options for this test case
         """
         configure_global_ocean(test_case=self, mesh=self.mesh, init=self.init)
+        # the number of cores is read from this config option at runtime
+        for step in self.steps.values():
+            step.cores_option = ('global_ocean', 'forward_cores')
 
     def run(self):
         """
@@ -72,6 +72,12 @@ class Init(TestCase):
         Modify the configuration options for this test case
         """
         configure_global_ocean(test_case=self, mesh=self.mesh, init=self)
+        # the number of cores is read from these config options at runtime
+        self.steps['initial_state'].cores_option = ('global_ocean',
+                                                    'init_cores')
+        if 'ssh_adjustment' in self.steps:
+            self.steps['ssh_adjustment'].cores_option = ('global_ocean',
+                                                         'forward_cores')
 
     def run(self):
         """
@@ -2,7 +2,8 @@ from compass.ocean.tests.global_ocean.metadata import \
     add_mesh_and_init_metadata
 from compass.model import run_model
 from compass.ocean.vertical import generate_grid, write_grid
-from compass.ocean.plot import plot_vertical_grid, plot_initial_state
+from compass.ocean.plot import plot_vertical_grid, \
+    compute_initial_state_histograms, plot_initial_state_histograms
 from compass.step import Step
 
 
@@ -155,13 +156,20 @@ class InitialState(Step):
         interfaces = generate_grid(config=config)
 
         write_grid(interfaces=interfaces, out_filename='vertical_grid.nc')
-        plot_vertical_grid(grid_filename='vertical_grid.nc', config=config,
-                           out_filename='vertical_grid.png')
+        self.add_plot('vertical_grid.png', plot_vertical_grid,
+                      grid_filename='vertical_grid.nc', config=config,
+                      out_filename='vertical_grid.png')
 
         run_model(self)
 
         add_mesh_and_init_metadata(self.outputs, config,
                                    init_filename='initial_state.nc')
 
-        plot_initial_state(input_file_name='initial_state.nc',
-                           output_file_name='initial_state.png')
+        # only the histograms are computed here, then they are plotted in
+        # the background
+        compute_initial_state_histograms(
+            input_file_name='initial_state.nc',
+            histogram_file_name='initial_state_histograms.nc')
+        self.add_plot('initial_state.png', plot_initial_state_histograms,
+                      histogram_file_name='initial_state_histograms.nc',
+                      output_file_name='initial_state.png')
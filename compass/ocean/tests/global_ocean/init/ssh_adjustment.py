@@ -80,7 +80,8 @@ class SshAdjustment(Step):
         """
         Run this step of the testcase
         """
-        config = self.config
-        iteration_count = config.getint('ssh_adjustment', 'iterations')
-        adjust_ssh(variable='landIcePressure', iteration_count=iteration_count,
-                   step=self)
+        section = self.config['ssh_adjustment']
+        adjust_ssh(variable='landIcePressure',
+                   iteration_count=section.getint('iterations'),
+                   step=self, tolerance=section.getfloat('tolerance'),
+                   keep_snapshots=section.getboolean('keep_snapshots'))
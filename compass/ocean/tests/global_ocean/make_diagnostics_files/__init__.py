@@ -1,5 +1,6 @@
 import os
 
+from compass.cache import get_file_cache_dir
 from compass.config import add_config
 from compass.io import symlink
 from compass.testcase import TestCase
@@ -33,6 +34,9 @@ class MakeDiagnosticsFiles(TestCase):
         add_config(self.config,
                    'compass.ocean.tests.global_ocean.make_diagnostics_files',
                    'make_diagnostics_files.cfg', exception=True)
+        # the number of cores is read from this config option at runtime
+        self.steps['diagnostics_files'].cores_option = (
+            'make_diagnostics_files', 'cores')
 
     def run(self):
         """
@@ -74,5 +78,7 @@ class DiagnosticsFiles(Step):
         with_ice_shelf_cavities = section.getboolean('with_ice_shelf_cavities')
 
         symlink(os.path.join('..', mesh_filename), 'restart.nc')
+        cache_dir = get_file_cache_dir(self, 'diagnostics_files')
         make_diagnostics_files(self.config, self.logger, mesh_name,
-                               with_ice_shelf_cavities, cores)
+                               with_ice_shelf_cavities, cores,
+                               cache_dir=cache_dir)
@@ -65,6 +65,8 @@ class Mesh(TestCase):
         Modify the configuration options for this test case
         """
         configure_global_ocean(test_case=self, mesh=self)
+        # the number of cores is read from this config option at runtime
+        self.mesh_step.cores_option = ('global_ocean', 'mesh_cores')
 
     def run(self):
         """
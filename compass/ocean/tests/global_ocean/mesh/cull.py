@@ -1,7 +1,11 @@
+import multiprocessing
 import xarray
+from functools import partial
 
+import geometric_features
 from geometric_features import GeometricFeatures, FeatureCollection, \
     read_feature_collection
+import mpas_tools
 from mpas_tools.mesh.conversion import cull
 from mpas_tools.mesh.mask import compute_mpas_flood_fill_mask
 from mpas_tools.io import write_netcdf
@@ -10,11 +14,14 @@ from mpas_tools.ocean.coastline_alteration import widen_transect_edge_masks, \
 from mpas_tools.viz.paraview_extractor import extract_vtk
 from mpas_tools.logging import LoggingContext, check_call
 
+from compass.cache import get_cached_file, hash_file, hash_items, hash_mesh
+from compass.parallel import run_concurrently
+
 
 def cull_mesh(with_cavities=False, with_critical_passages=False,
               custom_critical_passages=None, custom_land_blockages=None,
               preserve_floodplain=False, logger=None, use_progress_bar=True,
-              process_count=1):
+              process_count=1, cache_dir=None, extract_vtk_files=True):
     """
     First step of initializing the global ocean:
 
@@ -74,19 +81,65 @@ def cull_mesh(with_cavities=False, with_critical_passages=False,
 
     process_count : int, optional
         The number of cores to use to create masks (``None`` to use all
-        available cores)
+        available cores).  Masks that don't depend on each other are created
+        at the same time, splitting the cores between them.
+
+    cache_dir : str, optional
+        A directory for caching the land coverage, the masks and the land
+        mask with land-locked cells, keyed by hashes of the mesh, the
+        contents of the feature collections and the options used to make
+        them, so they can be reused by other meshes with the same base mesh
+        or when only the culling options change.  By default, nothing is
+        cached.
+
+    extract_vtk_files : bool, optional
+        Whether to extract VTK files for visualizing the culled mesh(es) with
+        :py:func:`compass.ocean.tests.global_ocean.mesh.cull.extract_culled_mesh_vtk()`.
+        Steps can set this to ``False`` and make the VTK files later as a
+        deferred artifact instead.
     """
     with LoggingContext(name=__name__, logger=logger) as logger:
         _cull_mesh_with_logging(
             logger, with_cavities, with_critical_passages,
             custom_critical_passages, custom_land_blockages,
-            preserve_floodplain, use_progress_bar, process_count)
+            preserve_floodplain, use_progress_bar, process_count, cache_dir)
+
+    if extract_vtk_files:
+        extract_culled_mesh_vtk(with_cavities=with_cavities,
+                                use_progress_bar=use_progress_bar)
+
+
+def extract_culled_mesh_vtk(with_cavities=False, use_progress_bar=True):
+    """
+    Extract VTK files for visualizing ``culled_mesh.nc`` and (with cavities)
+    ``no_ISC_culled_mesh.nc`` in ParaView
+
+    Parameters
+    ----------
+    with_cavities : bool, optional
+        Whether the mesh includes ice-shelf cavities
+
+    use_progress_bar : bool, optional
+        Whether to display progress bars (problematic in logging to a file)
+    """
+    extract_vtk(ignore_time=True, dimension_list=['maxEdges='],
+                variable_list=['allOnCells'],
+                filename_pattern='culled_mesh.nc',
+                out_dir='culled_mesh_vtk',
+                use_progress_bar=use_progress_bar)
+
+    if with_cavities:
+        extract_vtk(ignore_time=True, dimension_list=['maxEdges='],
+                    variable_list=['allOnCells'],
+                    filename_pattern='no_ISC_culled_mesh.nc',
+                    out_dir='no_ISC_culled_mesh_vtk',
+                    use_progress_bar=use_progress_bar)
 
 
 def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
                             custom_critical_passages, custom_land_blockages,
                             preserve_floodplain, use_progress_bar,
-                            process_count):
+                            process_count, cache_dir):
     """ Cull the mesh once the logger is defined for sure """
 
     # required for compatibility with MPAS
@@ -98,50 +151,52 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
     land_blockages = with_critical_passages or \
         (custom_land_blockages is not None)
 
-    gf = GeometricFeatures()
-
-    # start with the land coverage from Natural Earth
-    fcLandCoverage = gf.read(componentName='natural_earth',
-                             objectType='region',
-                             featureNames=['Land Coverage'])
+    if process_count is None:
+        process_count = multiprocessing.cpu_count()
 
-    # remove the region south of 60S so we can replace it based on ice-sheet
-    # topography
-    fcSouthMask = gf.read(componentName='ocean', objectType='region',
-                          featureNames=['Global Ocean 90S to 60S'])
+    if cache_dir is None:
+        base_mesh_hash = None
+    else:
+        # the base mesh is made again each time the mesh step runs, so the
+        # masks are keyed on the mesh itself rather than the file
+        base_mesh_hash = hash_mesh('base_mesh.nc')
 
-    fcLandCoverage = fcLandCoverage.difference(fcSouthMask)
+    gf = GeometricFeatures()
 
-    # Add "land" coverage from either the full ice sheet or just the grounded
-    # part
     if with_cavities:
-        fcAntarcticLand = gf.read(
-            componentName='bedmachine', objectType='region',
-            featureNames=['AntarcticGroundedIceCoverage'])
+        antarctic_land = 'AntarcticGroundedIceCoverage'
     else:
+        antarctic_land = 'AntarcticIceCoverage'
+
+    def make_land_coverage():
+        # start with the land coverage from Natural Earth
+        fcLandCoverage = gf.read(componentName='natural_earth',
+                                 objectType='region',
+                                 featureNames=['Land Coverage'])
+
+        # remove the region south of 60S so we can replace it based on
+        # ice-sheet topography
+        fcSouthMask = gf.read(componentName='ocean', objectType='region',
+                              featureNames=['Global Ocean 90S to 60S'])
+
+        fcLandCoverage = fcLandCoverage.difference(fcSouthMask)
+
+        # Add "land" coverage from either the full ice sheet or just the
+        # grounded part
         fcAntarcticLand = gf.read(
             componentName='bedmachine', objectType='region',
-            featureNames=['AntarcticIceCoverage'])
+            featureNames=[antarctic_land])
 
-    fcLandCoverage.merge(fcAntarcticLand)
+        fcLandCoverage.merge(fcAntarcticLand)
 
-    # save the feature collection to a geojson file
-    fcLandCoverage.to_geojson('land_coverage.geojson')
+        # save the feature collection to a geojson file
+        fcLandCoverage.to_geojson('land_coverage.geojson')
 
-    # Create the land mask based on the land coverage, i.e. coastline data
-    args = ['compute_mpas_region_masks',
-            '-m', 'base_mesh.nc',
-            '-g', 'land_coverage.geojson',
-            '-o', 'land_mask.nc',
-            '-t', 'cell',
-            '--process_count', '{}'.format(process_count)]
-    check_call(args, logger=logger)
-
-    dsBaseMesh = xarray.open_dataset('base_mesh.nc')
-    dsLandMask = xarray.open_dataset('land_mask.nc')
-    dsLandMask = add_land_locked_cells_to_mask(dsLandMask, dsBaseMesh,
-                                               latitude_threshold=43.0,
-                                               nSweeps=20)
+    # the land coverage is slow to make, so it is also cached
+    key = hash_items(['land_coverage', geometric_features.__version__,
+                      antarctic_land])
+    get_cached_file('land_coverage.geojson', key, cache_dir,
+                    make_land_coverage)
 
     # create seed points for a flood fill of the ocean
     # use all points in the ocean directory, on the assumption that they are,
@@ -149,6 +204,12 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
     fcSeed = gf.read(componentName='ocean', objectType='point',
                      tags=['seed_point'])
 
+    # the land mask (with land-locked cells added) and the masks from the
+    # critical land blockages and passages on the base mesh don't depend on
+    # each other
+    jobs = [partial(_make_land_mask, base_mesh_hash=base_mesh_hash,
+                    cache_dir=cache_dir, logger=logger)]
+
     if land_blockages:
         if with_critical_passages:
             # merge transects for critical land blockages into
@@ -170,12 +231,9 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
                 '-g', 'critical_blockages.geojson',
                 '-o', 'critical_blockages.nc',
                 '-t', 'cell',
-                '-s', '10e3',
-                '--process_count', '{}'.format(process_count)]
-        check_call(args, logger=logger)
-        dsCritBlockMask = xarray.open_dataset('critical_blockages.nc')
-
-        dsLandMask = add_critical_land_blockages(dsLandMask, dsCritBlockMask)
+                '-s', '10e3']
+        jobs.append(partial(_compute_mask, args, base_mesh_hash,
+                            cache_dir=cache_dir, logger=logger))
 
     fcCritPassages = FeatureCollection()
     dsPreserve = []
@@ -198,9 +256,21 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
                 '-g', 'critical_passages.geojson',
                 '-o', 'critical_passages.nc',
                 '-t', 'cell', 'edge',
-                '-s', '10e3',
-                '--process_count', '{}'.format(process_count)]
-        check_call(args, logger=logger)
+                '-s', '10e3']
+        jobs.append(partial(_compute_mask, args, base_mesh_hash,
+                            cache_dir=cache_dir, logger=logger))
+
+    run_concurrently(jobs, process_count)
+
+    dsBaseMesh = xarray.open_dataset('base_mesh.nc')
+    dsLandMask = xarray.open_dataset('land_mask_with_land_locked_cells.nc')
+
+    if land_blockages:
+        dsCritBlockMask = xarray.open_dataset('critical_blockages.nc')
+
+        dsLandMask = add_critical_land_blockages(dsLandMask, dsCritBlockMask)
+
+    if critical_passages:
         dsCritPassMask = xarray.open_dataset('critical_passages.nc')
 
         # Alter critical passages to be at least two cells wide, to avoid sea
@@ -227,17 +297,24 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
                         graphInfoFileName='culled_graph.info', logger=logger)
     write_netcdf(dsCulledMesh, 'culled_mesh.nc', format=netcdf_format)
 
+    if cache_dir is None:
+        culled_mesh_hash = None
+    else:
+        culled_mesh_hash = hash_mesh('culled_mesh.nc')
+
+    # the masks on the culled mesh don't depend on each other either
+    jobs = list()
+
     if critical_passages:
         # make a new version of the critical passages mask on the culled mesh
-        fcCritPassages.to_geojson('critical_passages.geojson')
         args = ['compute_mpas_transect_masks',
                 '-m', 'culled_mesh.nc',
                 '-g', 'critical_passages.geojson',
                 '-o', 'critical_passages_mask_final.nc',
                 '-t', 'cell',
-                '-s', '10e3',
-                '--process_count', '{}'.format(process_count)]
-        check_call(args, logger=logger)
+                '-s', '10e3']
+        jobs.append(partial(_compute_mask, args, culled_mesh_hash,
+                            cache_dir=cache_dir, logger=logger))
 
     if with_cavities:
         fcAntarcticIce = gf.read(
@@ -249,9 +326,13 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
                 '-m', 'culled_mesh.nc',
                 '-g', 'ice_coverage.geojson',
                 '-o', 'ice_coverage.nc',
-                '-t', 'cell',
-                '--process_count', '{}'.format(process_count)]
-        check_call(args, logger=logger)
+                '-t', 'cell']
+        jobs.append(partial(_compute_mask, args, culled_mesh_hash,
+                            cache_dir=cache_dir, logger=logger))
+
+    run_concurrently(jobs, process_count)
+
+    if with_cavities:
         dsMask = xarray.open_dataset('ice_coverage.nc')
 
         landIceMask = dsMask.regionCellMasks.isel(nRegions=0)
@@ -264,15 +345,47 @@ def _cull_mesh_with_logging(logger, with_cavities, with_critical_passages,
         write_netcdf(dsLandIceCulledMesh, 'no_ISC_culled_mesh.nc',
                      format=netcdf_format)
 
-    extract_vtk(ignore_time=True, dimension_list=['maxEdges='],
-                variable_list=['allOnCells'],
-                filename_pattern='culled_mesh.nc',
-                out_dir='culled_mesh_vtk',
-                use_progress_bar=use_progress_bar)
 
-    if with_cavities:
-        extract_vtk(ignore_time=True, dimension_list=['maxEdges='],
-                    variable_list=['allOnCells'],
-                    filename_pattern='no_ISC_culled_mesh.nc',
-                    out_dir='no_ISC_culled_mesh_vtk',
-                    use_progress_bar=use_progress_bar)
+def _make_land_mask(base_mesh_hash, cache_dir, logger, cores):
+    """
+    Create the land mask from the land coverage, then add land-locked cells
+    """
+    # Create the land mask based on the land coverage, i.e. coastline data
+    args = ['compute_mpas_region_masks',
+            '-m', 'base_mesh.nc',
+            '-g', 'land_coverage.geojson',
+            '-o', 'land_mask.nc',
+            '-t', 'cell']
+    land_mask_key = _compute_mask(args, base_mesh_hash, cache_dir, logger,
+                                  cores)
+
+    def make():
+        dsBaseMesh = xarray.open_dataset('base_mesh.nc')
+        dsLandMask = xarray.open_dataset('land_mask.nc')
+        dsLandMask = add_land_locked_cells_to_mask(dsLandMask, dsBaseMesh,
+                                                   latitude_threshold=43.0,
+                                                   nSweeps=20)
+        write_netcdf(dsLandMask, 'land_mask_with_land_locked_cells.nc')
+
+    key = hash_items(['land_locked_cells', mpas_tools.__version__,
+                      land_mask_key, 43.0, 20])
+    get_cached_file('land_mask_with_land_locked_cells.nc', key, cache_dir,
+                    make)
+
+
+def _compute_mask(args, mesh_hash, cache_dir, logger, cores):
+    """
+    Compute a mask with one of the tools from ``mpas_tools`` or restore it
+    from the cache if it was made before from the same mesh, features and
+    options.  Returns the key for the mask in the cache.
+    """
+    def make():
+        check_call(args + ['--process_count', '{}'.format(cores)],
+                   logger=logger)
+
+    geojson_filename = args[args.index('-g') + 1]
+    mask_filename = args[args.index('-o') + 1]
+    key = hash_items(['mask', mpas_tools.__version__, mesh_hash,
+                      hash_file(geojson_filename)] + args)
+    get_cached_file(mask_filename, key, cache_dir, make)
+    return key
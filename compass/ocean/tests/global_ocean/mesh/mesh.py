@@ -1,6 +1,8 @@
 from mpas_tools.ocean import build_spherical_mesh
 
-from compass.ocean.tests.global_ocean.mesh.cull import cull_mesh
+from compass.cache import get_file_cache_dir
+from compass.ocean.tests.global_ocean.mesh.cull import cull_mesh, \
+    extract_culled_mesh_vtk
 from compass.step import Step
 
 
@@ -88,7 +90,15 @@ class MeshStep(Step):
 
         cull_mesh(with_critical_passages=True, logger=logger,
                   use_progress_bar=use_progress_bar,
-                  with_cavities=with_ice_shelf_cavities)
+                  with_cavities=with_ice_shelf_cavities,
+                  process_count=self.cores,
+                  cache_dir=get_file_cache_dir(self, 'cull_mesh'),
+                  extract_vtk_files=False)
+
+        # nothing depends on the VTK files, so they can be made later
+        self.add_deferred_artifact('culled_mesh_vtk', extract_culled_mesh_vtk,
+                                   with_cavities=with_ice_shelf_cavities,
+                                   use_progress_bar=False)
 
     def build_cell_width_lat_lon(self):
         """
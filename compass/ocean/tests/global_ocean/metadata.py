@@ -2,8 +2,8 @@ import subprocess
 from datetime import datetime
 import numpy
 import xarray
+import netCDF4
 import os
-import shutil
 
 
 def get_e3sm_mesh_names(config, levels):
@@ -52,7 +52,9 @@ def get_e3sm_mesh_names(config, levels):
 def add_mesh_and_init_metadata(output_filenames, config, init_filename):
     """
     Add MPAS mesh and initial condition metadata to NetCDF outputs of the given
-    step
+    step.  The metadata are global attributes, which are added in place if
+    there is room for them in the header of each file.  Otherwise, a copy with
+    a larger header is made with ``ncks`` and moved back into place.
 
     Parameters
     ----------
@@ -73,14 +75,7 @@ def add_mesh_and_init_metadata(output_filenames, config, init_filename):
 
         for filename in output_filenames:
             if filename.endswith('.nc'):
-                args = ['ncra']
-                for key, value in metadata.items():
-                    args.extend(['--glb_att_add', '{}={}'.format(key, value)])
-                name, ext = os.path.splitext(filename)
-                new_filename = '{}_with_metadata{}'.format(name, ext)
-                args.extend([filename, new_filename])
-                subprocess.check_call(args)
-                shutil.move(new_filename, filename)
+                _add_global_attributes(filename, metadata)
 
 
 def _get_metadata(dsInit, config):
@@ -88,14 +83,12 @@ def _get_metadata(dsInit, config):
 
     author = config.get('global_ocean', 'author')
     if author == 'autodetect':
-        author = subprocess.check_output(
-            ['git', 'config', 'user.name']).decode("utf-8").strip()
+        author = _get_git_config('user.name')
         config.set('global_ocean', 'author', author)
 
     email = config.get('global_ocean', 'email')
     if email == 'autodetect':
-        email = subprocess.check_output(
-            ['git', 'config', 'user.email']).decode("utf-8").strip()
+        email = _get_git_config('user.email')
         config.set('global_ocean', 'email', email)
 
     creation_date = config.get('global_ocean', 'creation_date')
@@ -169,12 +162,140 @@ def _get_metadata(dsInit, config):
     return metadata
 
 
+# package versions and git config values, which are the same for every call
+# in this process
+_cache = dict()
+
+# the sizes in bytes of each NetCDF data type in the classic formats
+_nc_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8, 7: 1, 8: 2, 9: 4,
+                  10: 8, 11: 8}
+
+# the extra room in bytes to leave in a header that needs to grow, so that
+# metadata can be modified in place later
+_header_pad = 16384
+
+
 def _get_conda_package_version(package):
-    conda = subprocess.check_output(['conda', 'list', package]).decode("utf-8")
-    lines = conda.split('\n')
-    for line in lines:
-        parts = line.split()
-        if len(parts) > 0 and parts[0] == package:
-            return parts[1]
-
-    return 'not found'
+    if 'conda' not in _cache:
+        conda = subprocess.check_output(['conda', 'list']).decode("utf-8")
+        versions = dict()
+        for line in conda.split('\n'):
+            parts = line.split()
+            if len(parts) > 1 and not parts[0].startswith('#'):
+                versions[parts[0]] = parts[1]
+        _cache['conda'] = versions
+
+    return _cache['conda'].get(package, 'not found')
+
+
+def _get_git_config(option):
+    key = 'git {}'.format(option)
+    if key not in _cache:
+        _cache[key] = subprocess.check_output(
+            ['git', 'config', option]).decode("utf-8").strip()
+    return _cache[key]
+
+
+def _add_global_attributes(filename, attributes):
+    """
+    Add (or replace) global attributes of a NetCDF file in place if there is
+    room in the header, and otherwise in a copy of the file with a larger
+    header
+    """
+    if _header_needs_to_grow(filename, attributes):
+        # NetCDF would move all the data in place, so a file would be
+        # corrupted if this were interrupted
+        args = ['ncks', '-O', '--hdr_pad={}'.format(_header_pad)]
+        for key, value in attributes.items():
+            args.extend(['--glb_att_add', '{}={}'.format(key, value)])
+        name, ext = os.path.splitext(filename)
+        new_filename = '{}_with_metadata{}'.format(name, ext)
+        args.extend([filename, new_filename])
+        subprocess.check_call(args)
+        os.replace(new_filename, filename)
+    else:
+        with netCDF4.Dataset(filename, 'r+') as ds:
+            ds.setncatts(attributes)
+
+
+def _header_needs_to_grow(filename, attributes):
+    """
+    Find out if the header of a NetCDF file in one of the classic formats
+    is too small to hold the given (text) global attributes without moving
+    the data that follow it.  The header is parsed following the NetCDF
+    classic format specification.  NetCDF4 (HDF5) files never need to move
+    data to add attributes.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(4)
+        if magic[0:3] != b'CDF':
+            return False
+
+        version = magic[3]
+        # CDF-5 files have 64-bit counts and sizes, and CDF-2 and CDF-5 have
+        # 64-bit offsets to the data
+        if version == 5:
+            count_bytes = 8
+        else:
+            count_bytes = 4
+        if version == 1:
+            offset_bytes = 4
+        else:
+            offset_bytes = 8
+
+        def read_int(byte_count):
+            return int.from_bytes(f.read(byte_count), 'big')
+
+        def read_name():
+            length = read_int(count_bytes)
+            name = f.read(length)
+            f.seek(-length % 4, 1)
+            return name.decode('utf-8')
+
+        def read_attributes():
+            sizes = dict()
+            # the tag, then the number of attributes
+            read_int(4)
+            for _ in range(read_int(count_bytes)):
+                start = f.tell()
+                name = read_name()
+                nc_type = read_int(4)
+                length = read_int(count_bytes) * _nc_type_sizes[nc_type]
+                f.seek(length + (-length % 4), 1)
+                sizes[name] = f.tell() - start
+            return sizes
+
+        # the number of records
+        read_int(count_bytes)
+
+        # the dimensions
+        read_int(4)
+        for _ in range(read_int(count_bytes)):
+            read_name()
+            read_int(count_bytes)
+
+        global_sizes = read_attributes()
+
+        # the variables
+        data_start = os.fstat(f.fileno()).st_size
+        read_int(4)
+        for _ in range(read_int(count_bytes)):
+            read_name()
+            f.seek(read_int(count_bytes) * count_bytes, 1)
+            read_attributes()
+            # the type and size, then the offset to the data
+            read_int(4)
+            read_int(count_bytes)
+            data_start = min(data_start, read_int(offset_bytes))
+
+        header_end = f.tell()
+
+    growth = 0
+    for name, value in attributes.items():
+        name_length = len(name.encode('utf-8'))
+        value_length = len('{}'.format(value).encode('utf-8'))
+        size = 2 * count_bytes + 4 + name_length + (-name_length % 4) + \
+            value_length + (-value_length % 4)
+        growth += size - global_sizes.get(name, 0)
+
+    return header_end + growth > data_start
@@ -1,4 +1,4 @@
-from compass.validate import compare_variables, compare_timers
+from compass.validate import compare_variable_sets, compare_timers
 from compass.ocean.tests.global_ocean.forward import ForwardTestCase, \
     ForwardStep
 
@@ -58,8 +58,8 @@ class PerformanceTest(ForwardTestCase):
                  'diatFe', 'diatSi', 'diazChl', 'diazC', 'diazFe', 'phaeoChl',
                  'phaeoC', 'phaeoFe'])
 
-        compare_variables(test_case=self, variables=variables,
-                          filename1='forward/output.nc')
+        comparisons = [dict(variables=variables,
+                            filename1='forward/output.nc')]
 
         if self.mesh.with_ice_shelf_cavities:
             variables = [
@@ -72,8 +72,11 @@ class PerformanceTest(ForwardTestCase):
                 'landIceInterfaceSalinity', 'accumulatedLandIceMass',
                 'accumulatedLandIceHeat']
 
-            compare_variables(test_case=self, variables=variables,
-                              filename1='forward/land_ice_fluxes.nc')
+            comparisons.append(dict(variables=variables,
+                                    filename1='forward/land_ice_fluxes.nc'))
+
+        compare_variable_sets(test_case=self, comparisons=comparisons)
 
         timers = ['time integration']
-        compare_timers(timers, self.config, self.work_dir, rundir1='forward')
+        compare_timers(timers, self.config, self.work_dir, rundir1='forward',
+                       test_case=self)
@@ -1,8 +1,9 @@
+import numpy
 import xarray
 
 
 def compute_layer_thickness_and_zmid(cellMask, refBottomDepth, bottomDepth,
-                                     maxLevelCell, ssh=None):
+                                     maxLevelCell, ssh=None, chunk_size=None):
     """
     Initialize the vertical coordinate to a z-star coordinate
 
@@ -25,6 +26,12 @@ def compute_layer_thickness_and_zmid(cellMask, refBottomDepth, bottomDepth,
         The sea surface height for each cell in the mesh, assumed to be all
         zeros if not supplied
 
+    chunk_size : int, optional
+        If supplied, the number of cells in each chunk of the inputs and
+        results, which are then dask arrays that are computed lazily (e.g. as
+        they are written to a file), so that large meshes don't need to fit
+        in memory.  This requires ``dask``.
+
     Returns
     -------
     restingThickness : xarray.DataArray
@@ -41,36 +48,72 @@ def compute_layer_thickness_and_zmid(cellMask, refBottomDepth, bottomDepth,
         levels in the mesh
     """
 
-    nVertLevels = cellMask.sizes['nVertLevels']
+    if chunk_size is not None:
+        chunks = {'nCells': chunk_size}
+        cellMask = cellMask.chunk(chunks)
+        bottomDepth = bottomDepth.chunk(chunks)
+        maxLevelCell = maxLevelCell.chunk(chunks)
+        if ssh is not None:
+            ssh = ssh.chunk(chunks)
 
-    refLayerThickness = refBottomDepth.isel(nVertLevels=0)
+    if ssh is None:
+        ssh = xarray.zeros_like(bottomDepth)
+        stretch = False
+    else:
+        stretch = True
+
+    dtype = numpy.result_type(cellMask.dtype, refBottomDepth.dtype,
+                              bottomDepth.dtype)
+    restingThickness, layerThickness, zMid = xarray.apply_ufunc(
+        _compute_columns, cellMask, maxLevelCell, bottomDepth, ssh,
+        kwargs={'refBottomDepth': refBottomDepth.values, 'stretch': stretch},
+        input_core_dims=[['nVertLevels'], [], [], []],
+        output_core_dims=[['nVertLevels'], ['nVertLevels'], ['nVertLevels']],
+        dask='parallelized', output_dtypes=[dtype, dtype, dtype])
+
+    if not stretch:
+        layerThickness = restingThickness
 
-    restingThicknesses = [cellMask.isel(nVertLevels=0) * refLayerThickness]
-    for levelIndex in range(1, nVertLevels):
-        refLayerThickness = (refBottomDepth.isel(nVertLevels=levelIndex) -
-                             refBottomDepth.isel(nVertLevels=levelIndex-1))
-        sliceThickness = \
-            cellMask.isel(nVertLevels=levelIndex)*refLayerThickness
-        mask = levelIndex == maxLevelCell
-        partialThickness = (bottomDepth -
-                            refBottomDepth.isel(nVertLevels=levelIndex-1))
-        sliceThickness = xarray.where(mask, partialThickness, sliceThickness)
-        sliceThickness = sliceThickness.where(
-            cellMask.isel(nVertLevels=levelIndex))
-        restingThicknesses.append(sliceThickness)
+    return restingThickness, layerThickness, zMid
 
-    restingThickness = xarray.concat(restingThicknesses, dim='nVertLevels')
-    restingThickness = restingThickness.transpose('nCells', 'nVertLevels')
 
-    if ssh is not None:
+def _compute_columns(cellMask, maxLevelCell, bottomDepth, ssh,
+                     refBottomDepth, stretch):
+    """
+    Compute the resting and layer thicknesses and ``zMid`` for numpy arrays
+    of cells with ``nVertLevels`` as the last dimension, modifying the arrays
+    in place where possible rather than making temporary arrays for each
+    level
+    """
+    refLayerThickness = numpy.zeros_like(refBottomDepth)
+    refLayerThickness[0] = refBottomDepth[0]
+    refLayerThickness[1:] = refBottomDepth[1:] - refBottomDepth[0:-1]
+
+    nVertLevels = refBottomDepth.shape[0]
+    restingThickness = cellMask * refLayerThickness
+
+    # partial cells at the bottom (except in the first level)
+    bottom = numpy.logical_and(maxLevelCell > 0, maxLevelCell < nVertLevels)
+    cells = numpy.nonzero(bottom)
+    levels = maxLevelCell[cells]
+    partialThickness = bottomDepth[cells] - refBottomDepth[levels - 1]
+    restingThickness[cells + (levels,)] = partialThickness
+
+    # invalid cells are NaN (again, except in the first level)
+    restingThickness[..., 1:][numpy.logical_not(cellMask[..., 1:])] = numpy.nan
+
+    if stretch:
         layerStretch = (ssh + bottomDepth) / bottomDepth
-        layerThickness = restingThickness * layerStretch
+        layerThickness = restingThickness * layerStretch[..., numpy.newaxis]
     else:
-        ssh = xarray.zeros_like(bottomDepth)
         layerThickness = restingThickness
 
-    zBot = ssh - layerThickness.cumsum(dim='nVertLevels')
-
-    zMid = zBot + 0.5*layerThickness
+    # a cumulative sum that skips NaNs, as in xarray
+    zMid = layerThickness.copy()
+    zMid[numpy.isnan(zMid)] = 0.
+    numpy.cumsum(zMid, axis=-1, out=zMid)
+    # zBot, then zMid
+    numpy.subtract(ssh[..., numpy.newaxis], zMid, out=zMid)
+    zMid += 0.5*layerThickness
 
     return restingThickness, layerThickness, zMid
@@ -1,6 +1,7 @@
 import os
 import multiprocessing
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 
 def get_available_cores_and_nodes(config):
@@ -43,3 +44,104 @@ def _get_subprocess_int(args):
     value = subprocess.check_output(args)
     value = int(value.decode('utf-8').strip('\n'))
     return value
+
+
+def get_test_case_dependencies(test_cases):
+    """
+    Determine which test cases depend on the outputs of other test cases,
+    based on the inputs and outputs of their steps (including inputs added
+    with ``work_dir_target``)
+
+    Parameters
+    ----------
+    test_cases : dict of compass.TestCase
+        A dictionary of test cases that have been set up, with the relative
+        path in the work directory as keys
+
+    Returns
+    -------
+    dependencies : dict of set
+        A dictionary with the same keys as ``test_cases`` and, for each, the
+        set of keys of other test cases it depends on
+    """
+    producers = dict()
+    for path, test_case in test_cases.items():
+        for step in test_case.steps.values():
+            for output_file in step.outputs:
+                producers[output_file] = path
+
+    dependencies = dict()
+    for path, test_case in test_cases.items():
+        dependencies[path] = set()
+        for step in test_case.steps.values():
+            for input_file in step.inputs:
+                if input_file in producers and producers[input_file] != path:
+                    dependencies[path].add(producers[input_file])
+
+    return dependencies
+
+
+def get_test_case_cores(test_case, available_cores, config=None):
+    """
+    Get the number of cores a test case will occupy while it runs, the
+    largest number of cores used by any of the steps it will run
+
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        A test case that has been set up
+
+    available_cores : int
+        The number of cores available for running steps
+
+    config : configparser.ConfigParser, optional
+        The config options of the test case.  If provided, the cores of
+        steps with a ``cores_option`` are read from the config options, as
+        the test case will do when it runs, rather than taken from setup
+
+    Returns
+    -------
+    cores : int
+        The number of cores to reserve for the test case
+    """
+    cores = 1
+    for step_name in test_case.steps_to_run:
+        step = test_case.steps[step_name]
+        step_cores = step.cores
+        if config is not None and step.cores_option is not None:
+            section, option = step.cores_option
+            step_cores = config.getint(section, option)
+        if step_cores is not None:
+            cores = max(cores, step_cores)
+
+    return min(cores, available_cores)
+
+
+def run_concurrently(jobs, cores):
+    """
+    Run independent jobs (e.g. tools that make masks or mapping files) at the
+    same time in a pool of threads, splitting the cores between them as
+    evenly as possible, with any extra cores going to the first jobs
+
+    Parameters
+    ----------
+    jobs : list of function
+        The jobs to run, each a function that takes the number of cores it
+        can use as the ``cores`` keyword argument
+
+    cores : int
+        The number of cores to split between the jobs
+    """
+    if len(jobs) == 0:
+        return
+    worker_count = min(len(jobs), cores)
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = list()
+        for index, job in enumerate(jobs):
+            job_cores = cores // worker_count
+            if index < cores % worker_count:
+                job_cores += 1
+            futures.append(executor.submit(job, cores=job_cores))
+        # raise the first error (if any) once all jobs have finished
+        for future in futures:
+            future.result()
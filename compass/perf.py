@@ -0,0 +1,325 @@
+import argparse
+import sys
+import os
+import sqlite3
+import datetime
+
+import numpy
+
+import compass
+from compass import provenance
+
+
+def record_timers(test_case, timers, rundir):
+    """
+    Record MPAS timers from a run of the model in the timer database, along
+    with the test case, machine, number of cores and MPAS git version
+
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        The test case that ran the model
+
+    timers : dict
+        The values of MPAS timers (in seconds) with the timer names as keys
+
+    rundir : str
+        The relative path to the directory within the test case's work
+        directory where the model was run
+    """
+    config = test_case.config
+    run_dir = os.path.abspath(os.path.join(test_case.work_dir, rundir))
+    cores = None
+    threads = None
+    for step in test_case.steps.values():
+        if os.path.abspath(step.work_dir) == run_dir:
+            cores = step.cores
+            threads = step.threads
+            break
+
+    mpas_git_version = provenance.read_mpas_git_version(
+        test_case.base_work_dir)
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    rows = [(now, test_case.path, rundir, _get_machine(config), cores,
+             threads, mpas_git_version, compass.__version__, timer, value)
+            for timer, value in timers.items()]
+
+    with _connect(get_database(config, test_case.base_work_dir)) as db:
+        db.executemany(
+            'INSERT INTO timers (time, test_case, rundir, machine, cores, '
+            'threads, mpas_git_version, compass_version, timer, value) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    db.close()
+
+
+def find_regressions(database, baseline_runs=10, min_runs=3, alpha=0.01,
+                     min_slowdown=0.05, test_cases=None, timers=None,
+                     machine=None):
+    """
+    Compare the most recent value of each timer with a rolling baseline of
+    the values from previous runs of the same test case on the same machine
+    with the same number of cores, to find slowdowns that are statistically
+    significant
+
+    Parameters
+    ----------
+    database : str
+        The timer database
+
+    baseline_runs : int, optional
+        The maximum number of previous runs in the rolling baseline
+
+    min_runs : int, optional
+        The minimum number of previous runs needed to test for a regression
+
+    alpha : float, optional
+        The significance level: a timer is slower than the baseline if a
+        value this high would have less than this probability under a
+        t-distribution fit to the baseline
+
+    min_slowdown : float, optional
+        The minimum fractional slowdown compared with the mean of the
+        baseline that counts as a regression, so that tiny changes in very
+        consistent timers are not flagged
+
+    test_cases : list of str, optional
+        The paths of the test cases to check, all by default
+
+    timers : list of str, optional
+        The timers to check, all by default
+
+    machine : str, optional
+        The machine to check, all by default
+
+    Returns
+    -------
+    results : list of dict
+        The ``test_case``, ``rundir``, ``machine``, ``cores``, ``timer``,
+        most recent ``value`` and ``mpas_git_version``, the number of runs
+        ``n``, ``mean`` and ``std`` of the baseline, the fractional
+        ``slowdown``, the probability ``p`` and whether the timer has a
+        ``regression`` for each timer with at least ``min_runs`` previous
+        runs
+    """
+    with _connect(database) as db:
+        groups = db.execute(
+            'SELECT DISTINCT test_case, rundir, machine, cores, timer FROM '
+            'timers ORDER BY test_case, rundir, cores, timer').fetchall()
+
+        results = list()
+        for test_case, rundir, machine_name, cores, timer in groups:
+            if test_cases is not None and test_case not in test_cases:
+                continue
+            if timers is not None and timer not in timers:
+                continue
+            if machine is not None and machine_name != machine:
+                continue
+
+            rows = db.execute(
+                'SELECT value, mpas_git_version FROM timers WHERE '
+                'test_case = ? AND rundir = ? AND machine = ? AND cores IS ? '
+                'AND timer = ? ORDER BY id DESC LIMIT ?',
+                (test_case, rundir, machine_name, cores, timer,
+                 baseline_runs + 1)).fetchall()
+            if len(rows) < min_runs + 1:
+                continue
+
+            value, mpas_git_version = rows[0]
+            result = _test_regression(value, [row[0] for row in rows[1:]],
+                                      alpha, min_slowdown)
+            result.update({'test_case': test_case,
+                           'rundir': rundir,
+                           'machine': machine_name,
+                           'cores': cores,
+                           'timer': timer,
+                           'value': value,
+                           'mpas_git_version': mpas_git_version})
+            results.append(result)
+    db.close()
+
+    return results
+
+
+def check_timers(test_case, timers, rundir):
+    """
+    Check whether the most recent values of MPAS timers recorded for a run of
+    the model in a test case are significantly slower than previous runs,
+    using the options in the ``perf`` config section
+
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        The test case that ran the model
+
+    timers : list of str
+        The names of the timers to check
+
+    rundir : str
+        The relative path to the directory within the test case's work
+        directory where the model was run
+
+    Returns
+    -------
+    regressions : list of dict
+        The results from :py:func:`compass.perf.find_regressions()` for
+        timers that have a regression
+    """
+    config = test_case.config
+    section = config['perf']
+    results = find_regressions(
+        get_database(config, test_case.base_work_dir),
+        baseline_runs=section.getint('baseline_runs'),
+        min_runs=section.getint('min_runs'),
+        alpha=section.getfloat('alpha'),
+        min_slowdown=section.getfloat('min_slowdown'),
+        test_cases=[test_case.path], timers=timers,
+        machine=_get_machine(config))
+    return [result for result in results if result['rundir'] == rundir and
+            result['regression']]
+
+
+def get_database(config, base_work_dir):
+    """
+    Get the path to the timer database from the ``database`` option in the
+    ``perf`` config section or ``timers.db`` in the base work directory by
+    default
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Configuration options for a test case
+
+    base_work_dir : str
+        The base work directory
+
+    Returns
+    -------
+    database : str
+        The absolute path to the timer database
+    """
+    database = config.get('perf', 'database')
+    if database == '':
+        database = os.path.join(base_work_dir, 'timers.db')
+    return os.path.abspath(database)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report MPAS timers that have slowed down compared with '
+                    'previous runs',
+        prog='compass perf')
+    parser.add_argument("-d", "--database", dest="database",
+                        default='timers.db', metavar="FILE",
+                        help="The timer database")
+    parser.add_argument("-t", "--test_cases", dest="test_cases", nargs='+',
+                        default=None, help="The paths of test cases to check")
+    parser.add_argument("--timers", dest="timers", nargs='+', default=None,
+                        help="The names of timers to check")
+    parser.add_argument("-m", "--machine", dest="machine", default=None,
+                        help="The machine to check")
+    parser.add_argument("-n", "--baseline_runs", dest="baseline_runs",
+                        type=int, default=10,
+                        help="The number of previous runs in the baseline")
+    parser.add_argument("--min_runs", dest="min_runs", type=int, default=3,
+                        help="The minimum number of previous runs needed to "
+                             "check for a regression")
+    parser.add_argument("--alpha", dest="alpha", type=float, default=0.01,
+                        help="The significance level for regressions")
+    parser.add_argument("--min_slowdown", dest="min_slowdown", type=float,
+                        default=0.05,
+                        help="The minimum fractional slowdown that counts "
+                             "as a regression")
+    parser.add_argument("-a", "--all", dest="all", action="store_true",
+                        help="List all timers, not just regressions")
+    args = parser.parse_args(sys.argv[2:])
+
+    if not os.path.exists(args.database):
+        raise OSError('Timer database {} not found'.format(args.database))
+
+    results = find_regressions(
+        args.database, baseline_runs=args.baseline_runs,
+        min_runs=args.min_runs, alpha=args.alpha,
+        min_slowdown=args.min_slowdown, test_cases=args.test_cases,
+        timers=args.timers, machine=args.machine)
+
+    regressions = 0
+    for result in results:
+        if result['regression']:
+            regressions += 1
+        elif not args.all:
+            continue
+        print('{}'.format(_format_result(result)))
+
+    print('{} of {} timers slowed down significantly'.format(regressions,
+                                                             len(results)))
+    if regressions > 0:
+        sys.exit(1)
+
+
+def _connect(database):
+    """ Connect to the timer database, creating the table if needed """
+    directory = os.path.dirname(os.path.abspath(database))
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+    # test cases running concurrently may need to wait for each other
+    db = sqlite3.connect(database, timeout=60.)
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS timers (id INTEGER PRIMARY KEY, '
+        'time TEXT, test_case TEXT, rundir TEXT, machine TEXT, '
+        'cores INTEGER, threads INTEGER, mpas_git_version TEXT, '
+        'compass_version TEXT, timer TEXT, value REAL)')
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS timers_run ON timers '
+        '(test_case, rundir, machine, cores, timer)')
+    return db
+
+
+def _get_machine(config):
+    """ Get the machine a test case was set up for """
+    if config.has_option('test_case', 'machine'):
+        return config.get('test_case', 'machine')
+    return 'default'
+
+
+def _test_regression(value, baseline, alpha, min_slowdown):
+    """
+    Test whether a timer value is significantly slower than the values in a
+    baseline, using a one-sided prediction interval for a new value from a
+    t-distribution fit to the baseline
+    """
+    n = len(baseline)
+    mean = float(numpy.mean(baseline))
+    std = float(numpy.std(baseline, ddof=1))
+    if mean > 0.:
+        slowdown = (value - mean) / mean
+    else:
+        slowdown = 0.
+    if std > 0.:
+        # scipy.stats is slow to import, so only import it when it's needed
+        from scipy import stats
+        t = (value - mean) / (std * numpy.sqrt(1. + 1. / n))
+        p = float(stats.t.sf(t, n - 1))
+    elif value > mean:
+        p = 0.
+    else:
+        p = 1.
+    regression = p < alpha and slowdown > min_slowdown
+    return {'n': n, 'mean': mean, 'std': std, 'slowdown': slowdown,
+            'p': p, 'regression': regression}
+
+
+def _format_result(result):
+    """ Format the result of checking a timer for printing """
+    if result['regression']:
+        flag = 'SLOWER'
+    else:
+        flag = 'ok'
+    return '{:6s} {}/{} ({} cores, {}) "{}": {:.3f} s vs. {:.3f} +/- ' \
+           '{:.3f} s over {} runs ({:+.1f}%, p={:.2g}, MPAS {})'.format(
+               flag, result['test_case'], result['rundir'], result['cores'],
+               result['machine'], result['timer'], result['value'],
+               result['mean'], result['std'], result['n'],
+               100. * result['slowdown'], result['p'],
+               result['mpas_git_version'])
@@ -0,0 +1,287 @@
+import os
+import csv
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+
+class StepProfile:
+    """
+    The time spent in each phase of running a step, along with the peak
+    memory and the I/O of the step
+
+    Attributes
+    ----------
+    path : str
+        the path within the base work directory of the step
+
+    status : str
+        ``'success'``, ``'failed'`` or ``'cached'`` (if the outputs were
+        restored from the step cache), or ``None`` while the step is running
+
+    times : dict
+        The time in seconds spent in each phase: ``setup`` (during
+        ``compass setup``, not including downloads), ``inputs`` (checking
+        input files), ``cache`` (hashing, restoring and storing outputs in the
+        step cache), ``pre_processing`` (python code in ``run()`` before the
+        model is launched, or all of ``run()`` if there is no model run),
+        ``model`` (running the model in :py:func:`compass.model.run_model()`),
+        ``post_processing`` (python code in ``run()`` after the model has
+        run), ``outputs`` (checking output files) and ``total`` (all phases
+        but ``setup``)
+
+    peak_rss : float
+        The peak resident set size in MB of the python process while running
+        the step or of the largest subprocess it launched (e.g. the MPI
+        launcher, not the model's tasks on other nodes), or ``None`` if it is
+        not available
+
+    bytes_read : int
+        The bytes read by the python process and subprocesses it waited for,
+        or ``None`` if this is not available on this platform
+
+    bytes_written : int
+        The bytes written by the python process and subprocesses it waited
+        for, or ``None`` if this is not available on this platform
+    """
+
+    # the phases of running a step in the order they happen
+    phases = ['setup', 'inputs', 'cache', 'pre_processing', 'model',
+              'post_processing', 'outputs', 'total']
+
+    def __init__(self, step):
+        """
+        Create a profile for a step that is about to run
+
+        Parameters
+        ----------
+        step : compass.Step
+            The step to profile
+        """
+        self.path = step.path
+        self.status = None
+        self.times = {phase: 0. for phase in self.phases}
+        self.times['setup'] = step.setup_time
+        self.peak_rss = None
+        self.bytes_read = None
+        self.bytes_written = None
+
+        self._start = None
+        self._model_start = None
+        self._io_start = None
+        self._child_rss_start = None
+
+    def start(self):
+        """
+        Start profiling the step
+        """
+        self._start = time.time()
+        self._io_start = _read_io_counters()
+        self._child_rss_start = _get_max_rss(resource.RUSAGE_CHILDREN)
+        _reset_peak_rss()
+
+    def stop(self, status):
+        """
+        Stop profiling the step
+
+        Parameters
+        ----------
+        status : str
+            ``'success'``, ``'failed'`` or ``'cached'``
+        """
+        self.status = status
+        self.times['total'] = time.time() - self._start
+
+        io_end = _read_io_counters()
+        if self._io_start is not None and io_end is not None:
+            self.bytes_read = io_end[0] - self._io_start[0]
+            self.bytes_written = io_end[1] - self._io_start[1]
+
+        self.peak_rss = _get_peak_rss()
+        child_rss = _get_max_rss(resource.RUSAGE_CHILDREN)
+        # the subprocess high-water mark covers the whole python process, so
+        # it only tells us about this step if it went up
+        if child_rss > self._child_rss_start:
+            if self.peak_rss is None or child_rss > self.peak_rss:
+                self.peak_rss = child_rss
+
+    @contextmanager
+    def phase(self, name):
+        """
+        A context manager for timing one phase of the step
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase: ``inputs``, ``cache``, ``run`` (the step's
+            ``run()`` method, split into pre-processing, model and
+            post-processing), ``model`` or ``outputs``
+        """
+        start = time.time()
+        if name == 'model' and self._model_start is None:
+            self._model_start = start
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            if name == 'run':
+                model_time = self.times['model']
+                if self._model_start is None:
+                    pre_time = elapsed
+                else:
+                    pre_time = self._model_start - start
+                self.times['pre_processing'] += pre_time
+                self.times['post_processing'] += \
+                    elapsed - pre_time - model_time
+            else:
+                self.times[name] += elapsed
+
+    def to_dict(self):
+        """
+        Get the profile as a dictionary, e.g. for writing to a JSON file
+
+        Returns
+        -------
+        profile : dict
+            The path, status, times, peak RSS and I/O of the step
+        """
+        return {'path': self.path,
+                'status': self.status,
+                'times': dict(self.times),
+                'peak_rss': self.peak_rss,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written}
+
+
+@contextmanager
+def profile_phase(step, name):
+    """
+    A context manager for timing a phase of a step if it is being profiled
+    (i.e. it is being run by the framework), and doing nothing otherwise
+
+    Parameters
+    ----------
+    step : compass.Step
+        The step
+
+    name : str
+        The name of the phase, see :py:meth:`compass.profile.StepProfile.phase`
+    """
+    profile = getattr(step, 'profile', None)
+    if profile is None:
+        yield
+    else:
+        with profile.phase(name):
+            yield
+
+
+def write_suite_profile(work_dir, suite_name, results):
+    """
+    Write the profiles of all steps in a test suite to JSON and CSV files in
+    the ``case_outputs`` directory
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory of the suite
+
+    suite_name : str
+        The name of the test suite
+
+    results : dict
+        The results of the test cases from
+        :py:func:`compass.run.read_test_case_result()`, with the paths of the
+        test cases as keys.  Test cases without results should be ``None``.
+    """
+    test_cases = list()
+    for path, result in results.items():
+        if result is None:
+            continue
+        steps = result.get('steps')
+        if steps is None:
+            steps = list()
+        test_cases.append({'path': path,
+                           'pass': result['pass'],
+                           'time': result['time'],
+                           'steps': steps})
+
+    base_filename = os.path.join(work_dir, 'case_outputs',
+                                 '{}_profile'.format(suite_name))
+    with open('{}.json'.format(base_filename), 'w') as f:
+        json.dump({'suite': suite_name, 'test_cases': test_cases}, f,
+                  indent=4)
+
+    columns = ['test_case', 'step', 'status'] + \
+        ['{}_time'.format(phase) for phase in StepProfile.phases] + \
+        ['peak_rss', 'bytes_read', 'bytes_written']
+    with open('{}.csv'.format(base_filename), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for test_case in test_cases:
+            for step in test_case['steps']:
+                row = [test_case['path'], os.path.basename(step['path']),
+                       step['status']]
+                row.extend([_format(step['times'][phase]) for phase in
+                            StepProfile.phases])
+                row.extend([_format(step['peak_rss']), step['bytes_read'],
+                            step['bytes_written']])
+                writer.writerow(row)
+
+
+def _format(value):
+    """ Format a time or memory usage for the CSV file """
+    if value is None:
+        return ''
+    return '{:.3f}'.format(value)
+
+
+def _read_io_counters():
+    """
+    Read the bytes read and written by this process and subprocesses it has
+    waited for (Linux only)
+    """
+    try:
+        with open('/proc/self/io') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    counters = dict()
+    for line in lines:
+        key, value = line.split(':')
+        counters[key] = int(value)
+    return counters['rchar'], counters['wchar']
+
+
+def _reset_peak_rss():
+    """ Reset the peak RSS of this process (Linux only) """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _get_peak_rss():
+    """
+    Get the peak RSS in MB of this process since it was last reset, falling
+    back on the peak over the life of the process
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return _get_max_rss(resource.RUSAGE_SELF)
+
+
+def _get_max_rss(who):
+    """ Get the maximum RSS in MB from ``getrusage()`` """
+    max_rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes rather than kB on macOS
+        return max_rss / 1024.**2
+    return max_rss / 1024.
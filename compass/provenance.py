@@ -111,6 +111,33 @@ def write(work_dir, test_cases, mpas_core=None, config_filename=None,
     provenance_file.close()
 
 
+def read_mpas_git_version(work_dir):
+    """
+    Read the MPAS git version from the provenance file in the work directory,
+    as written by the most recent call to :py:func:`compass.provenance.write()`
+
+    Parameters
+    ----------
+    work_dir : str
+        The path to the base work directory
+
+    Returns
+    -------
+    mpas_git_version : str
+        The MPAS git version or ``None`` if it is not known
+    """
+    mpas_git_version = None
+    provenance_path = '{}/provenance'.format(work_dir)
+    if not os.path.exists(provenance_path):
+        return None
+    prefix = 'MPAS git version: '
+    with open(provenance_path) as provenance_file:
+        for line in provenance_file:
+            if line.startswith(prefix):
+                mpas_git_version = line[len(prefix):].strip()
+    return mpas_git_version
+
+
 def _get_mpas_git_version(mpas_core, config_filename, mpas_model_path):
 
     if mpas_model_path is None:
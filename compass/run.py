@@ -1,16 +1,32 @@
 import argparse
 import sys
 import os
-import pickle
 import configparser
 import time
+import json
 import numpy
 import glob
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 from mpas_tools.logging import LoggingContext
 
+from compass.parallel import get_available_cores_and_nodes, \
+    get_test_case_dependencies, get_test_case_cores
+from compass.manifest import read_suite_manifest, load_test_case, load_step
+from compass.profile import write_suite_profile
+from compass.testcase import make_deferred_artifact, check_deferred_artifacts
 
-def run_suite(suite_name):
+# ANSI fail text: https://stackoverflow.com/a/287944/7728169
+start_fail = '\033[91m'
+start_pass = '\033[92m'
+end = '\033[0m'
+pass_str = '{}PASS{}'.format(start_pass, end)
+success_str = '{}SUCCESS{}'.format(start_pass, end)
+fail_str = '{}FAIL{}'.format(start_fail, end)
+error_str = '{}ERROR{}'.format(start_fail, end)
+
+
+def run_suite(suite_name, parallel=False, test_case_paths=None):
     """
     Run the given test suite
 
@@ -18,21 +34,30 @@ def run_suite(suite_name):
     ----------
     suite_name : str
         The name of the test suite
+
+    parallel : bool, optional
+        Whether to run test cases concurrently as their dependencies on other
+        test cases are satisfied and enough cores are available, rather than
+        one after another in the order they appear in the suite
+
+    test_case_paths : list of str, optional
+        The paths of a subset of the test cases in the suite to run, e.g. the
+        test cases in one batch job.  By default, all test cases are run.
     """
-    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
-    start_fail = '\033[91m'
-    start_pass = '\033[92m'
-    end = '\033[0m'
-    pass_str = '{}PASS{}'.format(start_pass, end)
-    success_str = '{}SUCCESS{}'.format(start_pass, end)
-    fail_str = '{}FAIL{}'.format(start_fail, end)
-    error_str = '{}ERROR{}'.format(start_fail, end)
-
-    if not os.path.exists('{}.pickle'.format(suite_name)):
+    manifest_file = '{}.json'.format(suite_name)
+    if not os.path.exists(manifest_file):
         raise ValueError('The suite "{}" doesn\'t appear to have been set up '
                          'here.'.format(suite_name))
-    with open('{}.pickle'.format(suite_name), 'rb') as handle:
-        test_suite = pickle.load(handle)
+    # test cases are only loaded in full when they are about to run
+    test_suite = read_suite_manifest(manifest_file)
+    test_cases = test_suite['test_cases']
+    if test_case_paths is not None:
+        for path in test_case_paths:
+            if path not in test_cases:
+                raise ValueError('Test case {} is not in the suite "{}"'
+                                 ''.format(path, suite_name))
+        test_cases = {path: test_cases[path] for path in test_cases if
+                      path in test_case_paths}
 
     # start logging to stdout/stderr
     with LoggingContext(suite_name) as logger:
@@ -44,120 +69,202 @@ def run_suite(suite_name):
         except OSError:
             pass
 
-        failures = 0
         cwd = os.getcwd()
         suite_start = time.time()
-        test_times = dict()
-        success = dict()
-        for test_name in test_suite['test_cases']:
-            test_case = test_suite['test_cases'][test_name]
-
-            logger.info('{}'.format(test_name))
-
-            test_name = test_case.path.replace('/', '_')
-            log_filename = '{}/case_outputs/{}.log'.format(cwd, test_name)
-            with LoggingContext(test_name, log_filename=log_filename) as \
-                    test_logger:
-                test_case.logger = test_logger
-                test_case.log_filename = log_filename
-                test_case.new_step_log_file = False
-
-                os.chdir(test_case.work_dir)
-
-                config = configparser.ConfigParser(
-                    interpolation=configparser.ExtendedInterpolation())
-                config.read(test_case.config_filename)
-                test_case.config = config
-
-                test_case.steps_to_run = config.get(
-                    'test_case', 'steps_to_run').replace(',', ' ').split()
-
-                test_start = time.time()
-                try:
-                    test_case.run()
-                    run_status = success_str
-                    test_pass = True
-                except BaseException:
-                    run_status = error_str
-                    test_pass = False
-                    test_logger.exception('Exception raised in run()')
-
-                if test_pass:
-                    try:
-                        test_case.validate()
-                    except BaseException:
-                        run_status = error_str
-                        test_pass = False
-                        test_logger.exception('Exception raised in validate()')
-
-                baseline_status = None
-                internal_status = None
-                if test_case.validation is not None:
-                    internal_pass = test_case.validation['internal_pass']
-                    baseline_pass = test_case.validation['baseline_pass']
-
-                    if internal_pass is not None:
-                        if internal_pass:
-                            internal_status = pass_str
-                        else:
-                            internal_status = fail_str
-                            test_logger.exception(
-                                'Internal test case validation failed')
-                            test_pass = False
-
-                    if baseline_pass is not None:
-                        if baseline_pass:
-                            baseline_status = pass_str
-                        else:
-                            baseline_status = fail_str
-                            test_logger.exception('Baseline validation failed')
-                            test_pass = False
-
-                status = '  test execution:      {}'.format(run_status)
-                if internal_status is not None:
-                    status = '{}\n  test validation:     {}'.format(
-                        status, internal_status)
-                if baseline_status is not None:
-                    status = '{}\n  baseline comparison: {}'.format(
-                        status, baseline_status)
-
-                if test_pass:
-                    logger.info(status)
-                    success[test_name] = pass_str
-                else:
-                    logger.error(status)
-                    logger.error('  see: case_outputs/{}.log'.format(
-                        test_name))
-                    success[test_name] = fail_str
-                    failures += 1
 
-                test_times[test_name] = time.time() - test_start
+        # deferred artifacts and diagnostic plots are made in the background
+        # while later test cases run, and are only waited for at the end of
+        # the suite
+        artifacts = {test_name: list() for test_name in test_cases}
+        processes = _get_artifact_processes(test_cases)
+        with ProcessPoolExecutor(max_workers=processes) as artifact_executor:
+            if parallel:
+                results = _run_test_cases_in_parallel(
+                    test_cases, cwd, logger, artifact_executor, artifacts)
+            else:
+                results = dict()
+                for test_name in test_cases:
+                    test_case = test_cases[test_name]
+                    logger.info('{}'.format(test_name))
+                    result = _run_test_case_in_suite(test_case, cwd)
+                    results[test_name] = result[0:4]
+                    _start_deferred_jobs(artifact_executor, result[4],
+                                         artifacts[test_name])
+                    _log_test_case_status(logger, test_case,
+                                          *results[test_name][0:2])
+
+            count = sum([len(artifacts[test_name]) for test_name in
+                         artifacts])
+            if count > 0:
+                logger.info('Waiting for {} deferred artifact(s) and '
+                            'plot(s)'.format(count))
+
+        _check_suite_artifacts(test_cases, artifacts, results, logger)
 
         suite_time = time.time() - suite_start
 
         os.chdir(cwd)
 
-        logger.info('Test Runtimes:')
-        for test_name, test_time in test_times.items():
-            mins = int(numpy.floor(test_time / 60.0))
-            secs = int(numpy.ceil(test_time - mins * 60))
-            logger.info('{:02d}:{:02d} {} {}'.format(
-                mins, secs, success[test_name], test_name))
-        mins = int(numpy.floor(suite_time / 60.0))
-        secs = int(numpy.ceil(suite_time - mins * 60))
-        logger.info('Total runtime {:02d}:{:02d}'.format(mins, secs))
-
-        if failures == 0:
-            logger.info('PASS: All passed successfully!')
-        else:
-            if failures == 1:
-                message = '1 test'
-            else:
-                message = '{} tests'.format(failures)
-            logger.error('FAIL: {} failed, see above.'.format(message))
+        # summarize the results in the order of the test cases in the suite
+        results = {test_name: results[test_name] for test_name in test_cases}
+        for test_name in test_cases:
+            write_test_case_result(cwd, test_name, *results[test_name])
+
+        if test_case_paths is None:
+            # batch jobs running part of the suite leave this to
+            # compass.job.collect_results()
+            write_suite_profile(cwd, suite_name, {
+                test_name: read_test_case_result(cwd, test_name) for
+                test_name in test_cases})
+
+        failures = log_suite_summary(logger, results, suite_time)
+        if failures > 0:
             sys.exit(1)
 
 
+def write_test_case_result(work_dir, path, test_pass, status, test_time,
+                           steps=None):
+    """
+    Write the result of running a test case as part of a suite to a JSON file
+    in the ``case_outputs`` directory, so that results of test cases run in
+    separate batch jobs can be collected and runtimes can be used to plan
+    future jobs
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory of the suite
+
+    path : str
+        The relative path of the test case
+
+    test_pass : bool
+        Whether the test case ran and passed validation
+
+    status : str
+        A summary of the execution, validation and baseline comparison
+
+    test_time : float
+        The time in seconds it took to run the test case
+
+    steps : list of dict, optional
+        The profile of each step that was run from
+        :py:meth:`compass.profile.StepProfile.to_dict()`
+    """
+    filename = _get_result_filename(work_dir, path)
+    result = {'path': path,
+              'pass': test_pass,
+              'status': status,
+              'time': test_time,
+              'steps': steps}
+    with open(filename, 'w') as f:
+        json.dump(result, f, indent=4)
+
+
+def read_test_case_result(work_dir, path):
+    """
+    Read the result of running a test case as part of a suite
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory of the suite
+
+    path : str
+        The relative path of the test case
+
+    Returns
+    -------
+    result : dict
+        The result with keys ``path``, ``pass``, ``status``, ``time`` and
+        ``steps``, or ``None`` if the test case has not been run as part of
+        the suite
+    """
+    filename = _get_result_filename(work_dir, path)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        result = json.load(f)
+    return result
+
+
+def remove_test_case_result(work_dir, path):
+    """
+    Remove the result of running a test case as part of a suite, if any, so
+    it isn't mistaken for the result of a new run that doesn't finish
+
+    Parameters
+    ----------
+    work_dir : str
+        The base work directory of the suite
+
+    path : str
+        The relative path of the test case
+    """
+    filename = _get_result_filename(work_dir, path)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def log_suite_summary(logger, results, suite_time):
+    """
+    Log the runtime and status of each test case in a suite and of the suite
+    as a whole
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger for the suite
+
+    results : dict
+        The pass/fail status, summary and runtime of each test case, with the
+        paths of the test cases as keys
+
+    suite_time : float
+        The time in seconds it took to run the suite
+
+    Returns
+    -------
+    failures : int
+        The number of test cases that failed
+    """
+    failures = 0
+    test_times = dict()
+    success = dict()
+    for path, result in results.items():
+        test_pass = result[0]
+        test_time = result[2]
+        test_name = path.replace('/', '_')
+        if test_pass:
+            success[test_name] = pass_str
+        else:
+            success[test_name] = fail_str
+            failures += 1
+
+        test_times[test_name] = test_time
+
+    logger.info('Test Runtimes:')
+    for test_name, test_time in test_times.items():
+        mins = int(numpy.floor(test_time / 60.0))
+        secs = int(numpy.ceil(test_time - mins * 60))
+        logger.info('{:02d}:{:02d} {} {}'.format(
+            mins, secs, success[test_name], test_name))
+    mins = int(numpy.floor(suite_time / 60.0))
+    secs = int(numpy.ceil(suite_time - mins * 60))
+    logger.info('Total runtime {:02d}:{:02d}'.format(mins, secs))
+
+    if failures == 0:
+        logger.info('PASS: All passed successfully!')
+    else:
+        if failures == 1:
+            message = '1 test'
+        else:
+            message = '{} tests'.format(failures)
+        logger.error('FAIL: {} failed, see above.'.format(message))
+
+    return failures
+
+
 def run_test_case(steps_to_run=None, steps_not_to_run=None):
     """
     Used by the framework to run a test case when ``compass run`` gets called
@@ -173,8 +280,7 @@ def run_test_case(steps_to_run=None, steps_not_to_run=None):
         A list of steps not to run.  Typically, these are steps to remove from
         the defaults
     """
-    with open('test_case.pickle', 'rb') as handle:
-        test_case = pickle.load(handle)
+    test_case = load_test_case(os.getcwd())
 
     config = configparser.ConfigParser(
         interpolation=configparser.ExtendedInterpolation())
@@ -219,8 +325,7 @@ def run_step():
     Used by the framework to run a step when ``compass run`` gets called in the
     step's work directory
     """
-    with open('step.pickle', 'rb') as handle:
-        test_case, step = pickle.load(handle)
+    test_case, step = load_step(os.getcwd())
     test_case.steps_to_run = [step.name]
     test_case.new_step_log_file = False
 
@@ -248,21 +353,330 @@ def main():
     parser.add_argument("--no-steps", dest="no_steps", nargs='+', default=None,
                         help="The steps of a test case not to run, see "
                              "steps_to_run in the config file for defaults.")
+    parser.add_argument("--parallel", dest="parallel", action="store_true",
+                        help="Run the test cases in a suite concurrently as "
+                             "their dependencies are satisfied and cores "
+                             "become available")
+    parser.add_argument("--test_cases", dest="test_cases", nargs='+',
+                        default=None,
+                        help="The paths of a subset of the test cases in the "
+                             "suite to run")
     args = parser.parse_args(sys.argv[2:])
     if args.suite is not None:
-        run_suite(args.suite)
+        run_suite(args.suite, parallel=args.parallel,
+                  test_case_paths=args.test_cases)
     elif os.path.exists('test_case.pickle'):
         run_test_case(args.steps, args.no_steps)
-    elif os.path.exists('step.pickle'):
+    elif os.path.exists('step.json'):
         run_step()
     else:
-        pickles = glob.glob('*.pickle')
-        if len(pickles) == 1:
-            suite = os.path.splitext(os.path.basename(pickles[0]))[0]
-            run_suite(suite)
-        elif len(pickles) == 0:
-            raise OSError('No pickle files were found. Are you sure this is '
-                          'a compass suite, test-case or step work directory?')
+        manifests = glob.glob('*.json')
+        if len(manifests) == 1:
+            suite = os.path.splitext(os.path.basename(manifests[0]))[0]
+            run_suite(suite, parallel=args.parallel)
+        elif len(manifests) == 0:
+            raise OSError('No suite manifests were found. Are you sure this '
+                          'is a compass suite, test-case or step work '
+                          'directory?')
         else:
             raise ValueError('More than one suite was found. Please specify '
                              'which to run: compass run <suite>')
+
+
+def _run_test_case_in_suite(test_case_manifest, cwd):
+    """
+    Run a test case as part of a suite, logging to a file in ``case_outputs``
+    and leaving its deferred artifacts and diagnostic plots to the suite
+
+    Parameters
+    ----------
+    test_case_manifest : compass.manifest.TestCaseManifest
+        The manifest of the test case to run
+
+    cwd : str
+        The work directory of the suite
+
+    Returns
+    -------
+    test_pass : bool
+        Whether the test case ran and passed validation
+
+    status : str
+        A summary of the execution, validation and baseline comparison
+
+    test_time : float
+        The time in seconds it took to run the test case
+
+    steps : list of dict
+        The profile of each step that was run
+
+    deferred_jobs : list of dict
+        The deferred artifacts and diagnostic plots for the suite to make
+        with :py:func:`compass.testcase.make_deferred_artifact()`
+    """
+    test_case = test_case_manifest.load()
+    test_name = test_case.path.replace('/', '_')
+    log_filename = '{}/case_outputs/{}.log'.format(cwd, test_name)
+    with LoggingContext(test_name, log_filename=log_filename) as \
+            test_logger:
+        test_case.logger = test_logger
+        test_case.log_filename = log_filename
+        test_case.new_step_log_file = False
+
+        os.chdir(test_case.work_dir)
+
+        config = configparser.ConfigParser(
+            interpolation=configparser.ExtendedInterpolation())
+        config.read(test_case.config_filename)
+        test_case.config = config
+
+        test_case.steps_to_run = config.get(
+            'test_case', 'steps_to_run').replace(',', ' ').split()
+        test_case.deferred_jobs = list()
+
+        test_start = time.time()
+        try:
+            test_case.run()
+            run_status = success_str
+            test_pass = True
+        except BaseException:
+            run_status = error_str
+            test_pass = False
+            test_logger.exception('Exception raised in run()')
+
+        if test_pass:
+            try:
+                test_case.validate()
+            except BaseException:
+                run_status = error_str
+                test_pass = False
+                test_logger.exception('Exception raised in validate()')
+
+        baseline_status = None
+        internal_status = None
+        perf_status = None
+        if test_case.validation is not None:
+            internal_pass = test_case.validation['internal_pass']
+            baseline_pass = test_case.validation['baseline_pass']
+
+            if internal_pass is not None:
+                if internal_pass:
+                    internal_status = pass_str
+                else:
+                    internal_status = fail_str
+                    test_logger.exception(
+                        'Internal test case validation failed')
+                    test_pass = False
+
+            if baseline_pass is not None:
+                if baseline_pass:
+                    baseline_status = pass_str
+                else:
+                    baseline_status = fail_str
+                    test_logger.exception('Baseline validation failed')
+                    test_pass = False
+
+            perf_pass = test_case.validation.get('perf_pass')
+            if perf_pass is not None:
+                if perf_pass:
+                    perf_status = pass_str
+                else:
+                    perf_status = fail_str
+                    test_logger.error('Timers are slower than in previous '
+                                      'runs')
+                    if config.getboolean('perf', 'fail_on_regression'):
+                        test_pass = False
+
+            if 'comparisons' in test_case.validation:
+                for comparison in test_case.validation['comparisons']:
+                    if not comparison['pass']:
+                        test_logger.error(
+                            '  {} differs between {} and {}'.format(
+                                comparison['variable'],
+                                comparison['filename1'],
+                                comparison['filename2']))
+
+        status = '  test execution:      {}'.format(run_status)
+        if internal_status is not None:
+            status = '{}\n  test validation:     {}'.format(
+                status, internal_status)
+        if baseline_status is not None:
+            status = '{}\n  baseline comparison: {}'.format(
+                status, baseline_status)
+        if perf_status is not None:
+            status = '{}\n  performance:         {}'.format(
+                status, perf_status)
+
+        test_time = time.time() - test_start
+
+        steps = [profile.to_dict() for profile in test_case.step_profiles]
+
+    os.chdir(cwd)
+
+    return test_pass, status, test_time, steps, test_case.deferred_jobs
+
+
+def _log_test_case_status(logger, test_case, test_pass, status):
+    """ Log the status of a test case that has finished running """
+    if test_pass:
+        logger.info(status)
+    else:
+        test_name = test_case.path.replace('/', '_')
+        logger.error(status)
+        logger.error('  see: case_outputs/{}.log'.format(test_name))
+
+
+def _run_test_cases_in_parallel(test_cases, cwd, logger, artifact_executor,
+                                artifacts):
+    """
+    Run test cases concurrently, launching each as soon as the test cases it
+    depends on have finished and enough cores are available for its largest
+    step
+
+    Parameters
+    ----------
+    test_cases : dict of compass.manifest.TestCaseManifest
+        The manifests of the test cases in the suite
+
+    cwd : str
+        The work directory of the suite
+
+    logger : logging.Logger
+        The logger for the suite
+
+    artifact_executor : concurrent.futures.ProcessPoolExecutor
+        The suite's background processes for deferred artifacts and plots
+
+    artifacts : dict of list
+        The deferred artifacts and plots started for each test case
+
+    Returns
+    -------
+    results : dict
+        The results of :py:func:`compass.run._run_test_case_in_suite()` for
+        each test case, without the deferred jobs
+    """
+    available_cores = None
+    test_cores = dict()
+    for test_name, test_case in test_cases.items():
+        config = configparser.ConfigParser(
+            interpolation=configparser.ExtendedInterpolation())
+        config.read(os.path.join(test_case.work_dir,
+                                 test_case.config_filename))
+        if available_cores is None:
+            available_cores, _ = get_available_cores_and_nodes(config)
+        test_case.steps_to_run = config.get(
+            'test_case', 'steps_to_run').replace(',', ' ').split()
+        test_cores[test_name] = get_test_case_cores(test_case,
+                                                    available_cores, config)
+
+    dependencies = get_test_case_dependencies(test_cases)
+
+    # launch test cases with the most test cases downstream of them first so
+    # the critical path through the suite starts as early as possible
+    downstream = {test_name: 0 for test_name in test_cases}
+    for test_name in test_cases:
+        for other in _get_upstream(test_name, dependencies):
+            downstream[other] += 1
+    pending = sorted(test_cases, key=lambda name: -downstream[name])
+
+    logger.info('Running test cases on {} cores'.format(available_cores))
+
+    free_cores = available_cores
+    finished = set()
+    running = dict()
+    results = dict()
+    max_workers = max(1, min(len(test_cases), available_cores))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for test_name in list(pending):
+                if not dependencies[test_name].issubset(finished):
+                    continue
+                cores = test_cores[test_name]
+                if cores > free_cores and len(running) > 0:
+                    continue
+                logger.info('{} (starting on {} cores)'.format(test_name,
+                                                               cores))
+                future = executor.submit(_run_test_case_in_suite,
+                                         test_cases[test_name], cwd)
+                running[future] = test_name
+                free_cores -= cores
+                pending.remove(test_name)
+
+            if len(running) == 0:
+                raise ValueError('Circular dependencies between test cases: '
+                                 '{}'.format(', '.join(pending)))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                test_name = running.pop(future)
+                free_cores += test_cores[test_name]
+                finished.add(test_name)
+                result = future.result()
+                results[test_name] = result[0:4]
+                _start_deferred_jobs(artifact_executor, result[4],
+                                     artifacts[test_name])
+                logger.info('{}'.format(test_name))
+                _log_test_case_status(logger, test_cases[test_name],
+                                      *results[test_name][0:2])
+
+    return results
+
+
+def _get_artifact_processes(test_cases):
+    """
+    Get the number of background processes for deferred artifacts and plots
+    from the config file of the first test case in the suite
+    """
+    for test_case in test_cases.values():
+        config = configparser.ConfigParser(
+            interpolation=configparser.ExtendedInterpolation())
+        config.read(os.path.join(test_case.work_dir,
+                                 test_case.config_filename))
+        return config.getint('deferred_artifacts', 'processes', fallback=1)
+    return 1
+
+
+def _start_deferred_jobs(executor, jobs, artifacts):
+    """
+    Start making the deferred artifacts and diagnostic plots of a test case
+    that has finished in the suite's background processes
+    """
+    for job in jobs:
+        artifacts.append((job, executor.submit(make_deferred_artifact, job)))
+
+
+def _check_suite_artifacts(test_cases, artifacts, results, logger):
+    """
+    Mark test cases with deferred artifacts or plots that failed as failed
+    """
+    for test_name in test_cases:
+        if len(artifacts[test_name]) == 0:
+            continue
+        try:
+            check_deferred_artifacts(artifacts[test_name], logger)
+        except ValueError:
+            test_pass, status, test_time, steps = results[test_name]
+            status = '{}\n  deferred artifacts:  {}'.format(status, fail_str)
+            results[test_name] = (False, status, test_time, steps)
+            logger.error('{}'.format(test_name))
+            _log_test_case_status(logger, test_cases[test_name], False,
+                                  status)
+
+
+def _get_upstream(test_name, dependencies):
+    """ Get all test cases that the given test case depends on, recursively """
+    upstream = set()
+    stack = list(dependencies[test_name])
+    while len(stack) > 0:
+        other = stack.pop()
+        if other not in upstream:
+            upstream.add(other)
+            stack.extend(dependencies[other])
+    return upstream
+
+
+def _get_result_filename(work_dir, path):
+    """ Get the JSON file with the result of a test case in a suite """
+    test_name = path.replace('/', '_')
+    return os.path.join(work_dir, 'case_outputs', '{}.json'.format(test_name))
@@ -2,11 +2,12 @@ import argparse
 import sys
 import configparser
 import os
-import pickle
+import time
 
-from compass.mpas_cores import get_mpas_cores
+from compass.mpas_cores import get_test_case_paths, get_test_cases
 from compass.config import add_config, ensure_absolute_paths
-from compass.io import symlink
+from compass.io import symlink, download_files
+from compass.manifest import write_test_case
 from compass import provenance
 
 
@@ -59,30 +60,22 @@ def setup_cases(tests=None, numbers=None, config_file=None, machine=None,
     if work_dir is None:
         work_dir = os.getcwd()
 
-    mpas_cores = get_mpas_cores()
-
-    all_test_cases = dict()
-    for mpas_core in mpas_cores:
-        for test_group in mpas_core.test_groups.values():
-            for test_case in test_group.test_cases.values():
-                all_test_cases[test_case.path] = test_case
-
-    test_cases = dict()
+    # only the test groups with the requested test cases are constructed
+    paths = list()
     if numbers is not None:
-        keys = list(all_test_cases)
+        keys = get_test_case_paths()
         for number in numbers:
             if number >= len(keys):
                 raise ValueError('test number {} is out of range.  There are '
                                  'only {} tests.'.format(number, len(keys)))
-            path = keys[number]
-            test_cases[path] = all_test_cases[path]
+            paths.append(keys[number])
 
     if tests is not None:
         for path in tests:
-            if path not in all_test_cases:
-                raise ValueError('Test case with path {} is not in '
-                                 'test_cases'.format(path))
-            test_cases[path] = all_test_cases[path]
+            if path not in paths:
+                paths.append(path)
+
+    test_cases = get_test_cases(paths)
 
     # get the MPAS core of the first test case.  We'll assume all tests are
     # for this core
@@ -93,15 +86,19 @@ def setup_cases(tests=None, numbers=None, config_file=None, machine=None,
                      mpas_model_path=mpas_model_path)
 
     print('Setting up test cases:')
+    downloads = list()
     for path, test_case in test_cases.items():
         setup_case(path, test_case, config_file, machine, work_dir,
-                   baseline_dir, mpas_model_path)
+                   baseline_dir, mpas_model_path, downloads=downloads)
+
+    # download the remote inputs of all steps together
+    download_files(downloads, test_cases[first_path].config)
 
     return test_cases
 
 
 def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
-               mpas_model_path):
+               mpas_model_path, downloads=None):
     """
     Set up one or more test cases
 
@@ -130,10 +127,21 @@ def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
     mpas_model_path : str
         The relative or absolute path to the root of a branch where the MPAS
         model has been built
+
+    downloads : list of tuple, optional
+        A list to which the URL and destination path of each remote input file
+        of the test case's steps are appended, so they can be downloaded
+        together with those of other test cases.  By default, the files are
+        downloaded at the end of setting up this test case.
     """
 
     print('  {}'.format(path))
 
+    if downloads is None:
+        case_downloads = list()
+    else:
+        case_downloads = downloads
+
     config = configparser.ConfigParser(
         interpolation=configparser.ExtendedInterpolation())
 
@@ -190,6 +198,7 @@ def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
         config.set('paths', 'mpas_model', mpas_model_path)
 
     config.set('test_case', 'steps_to_run', ' '.join(test_case.steps_to_run))
+    config.set('test_case', 'machine', machine)
 
     # make sure all paths in the paths, namelists and streams sections are
     # absolute paths
@@ -218,22 +227,19 @@ def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
         step.config_filename = test_case_config
         step.config = config
 
+        setup_start = time.time()
+
         # set up the step
         step.setup()
 
         # process input, output, namelist and streams files
-        step.process_inputs_and_outputs()
+        step.process_inputs_and_outputs(downloads=case_downloads)
 
-        # pickle the test case and step for use at runtime
-        pickle_filename = os.path.join(step.work_dir, 'step.pickle')
-        with open(pickle_filename, 'wb') as handle:
-            pickle.dump((test_case, step), handle,
-                        protocol=pickle.HIGHEST_PROTOCOL)
+        step.setup_time = time.time() - setup_start
 
-    # pickle the test case and step for use at runtime
-    pickle_filename = os.path.join(test_case.work_dir, 'test_case.pickle')
-    with open(pickle_filename, 'wb') as handle:
-        pickle.dump(test_case, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    # pickle the test case (once) and write manifests for the steps for use
+    # at runtime
+    write_test_case(test_case)
 
     if 'LOAD_COMPASS_ENV' in os.environ:
         script_filename = os.environ['LOAD_COMPASS_ENV']
@@ -241,6 +247,9 @@ def setup_case(path, test_case, config_file, machine, work_dir, baseline_dir,
         symlink(script_filename, os.path.join(test_case_dir,
                                               'load_compass_env.sh'))
 
+    if downloads is None:
+        download_files(case_downloads, config)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -1,5 +1,4 @@
 import os
-from lxml import etree
 import configparser
 from importlib.resources import path
 
@@ -54,6 +53,13 @@ class Step:
     threads : int
         the number of threads the step will use
 
+    cores_option : tuple of str
+        The config section and option that the test case reads ``cores``
+        from at runtime (e.g. ``('global_ocean', 'forward_cores')``) so the
+        config file can be edited after setup, or ``None`` if ``cores`` is
+        fixed at setup.  When test cases run in parallel, this is used to
+        decide how many cores to reserve for the step.
+
     max_memory : int
         the amount of memory that the step is allowed to use in MB.
         This is currently just a placeholder for later use with task
@@ -78,6 +84,15 @@ class Step:
         available as inputs to other test cases and steps.  These files must
         exist after the test has run or an exception will be raised
 
+    deferred_artifacts : list of dict
+        a list of dict used to define expensive products of the step that
+        nothing else depends on, such as VTK files and plots for
+        visualization, added with :py:meth:`compass.Step.add_deferred_artifact`
+
+    plots : list of dict
+        a list of dict used to define plots to render in background processes,
+        added with :py:meth:`compass.Step.add_plot`
+
     namelist_data : dict
         a dictionary used internally to keep track of updates to the default
         namelist options from calls to
@@ -109,6 +124,20 @@ class Step:
     log_filename : str
         At run time, the name of a log file where output/errors from the step
         are being logged, or ``None`` if output is to stdout/stderr
+
+    setup_time : float
+        The time in seconds it took to set up the step (not including
+        downloads), or ``None`` before the step has been set up
+
+    profile : compass.profile.StepProfile
+        At run time, the timing and resource usage of the step
+
+    use_cache : bool
+        Whether the outputs of this step may be restored from the step cache
+        (if it is enabled in the ``step_cache`` config section) instead of
+        running the step when nothing the step consumes has changed.  Steps
+        with results that are not fully captured by their ``outputs`` should
+        set this to ``False``
     """
 
     def __init__(self, test_case, name, subdir=None, cores=1, min_cores=1,
@@ -161,6 +190,7 @@ class Step:
         self.cores = cores
         self.min_cores = min_cores
         self.threads = threads
+        self.cores_option = None
         self.max_memory = max_memory
         self.max_disk = max_disk
 
@@ -171,18 +201,23 @@ class Step:
         self.input_data = list()
         self.inputs = list()
         self.outputs = list()
+        self.deferred_artifacts = list()
+        self.plots = list()
         self.namelist_data = dict()
         self.streams_data = dict()
+        self.use_cache = True
 
         # these will be set later during setup
         self.config = None
         self.config_filename = None
         self.work_dir = None
         self.base_work_dir = None
+        self.setup_time = None
 
         # these will be set before running the step
         self.logger = None
         self.log_filename = None
+        self.profile = None
 
     def setup(self):
         """
@@ -268,6 +303,69 @@ class Step:
         """
         self.outputs.append(filename)
 
+    def add_deferred_artifact(self, name, function, **kwargs):
+        """
+        Add an expensive product of the step that nothing else depends on,
+        such as VTK files or plots for visualization.  This is typically
+        called from ``run()``.  Once the step has finished and its outputs
+        exist, ``function`` is called with ``kwargs`` in the step's work
+        directory in a background process, while the test case goes on to its
+        next steps.  A test case run on its own waits for its deferred
+        artifacts before it finishes, while a suite only waits for them once
+        all of its test cases have run.  If the ``enabled`` option in the
+        ``deferred_artifacts`` config section is ``False``, deferred
+        artifacts are not made at all.
+
+        Parameters
+        ----------
+        name : str
+            The name of the artifact, also used for the log file
+            ``<name>.log`` in the step's work directory
+
+        function : function
+            The function that makes the artifact, which must be defined at
+            the top level of a module so it can be sent to another process
+
+        **kwargs
+            Keyword arguments to ``function``, which must also be picklable
+        """
+        self.deferred_artifacts.append(dict(name=name, function=function,
+                                            kwargs=kwargs))
+
+    def add_plot(self, filename, function, **kwargs):
+        """
+        Add a plot to render in a background process with the ``Agg``
+        backend.  This is typically called from ``run()`` once the data for
+        the plot is ready, so the plot function doesn't need to read it
+        again.  The plots of a step are rendered at the same time once
+        ``run()`` returns.  If ``filename`` is one of the step's outputs, the
+        step waits for the plot before its outputs are checked.  Otherwise,
+        the plot is a diagnostic plot, which is made like a deferred artifact
+        (see :py:meth:`compass.Step.add_deferred_artifact`) and is not made at
+        all if the ``plots`` option in the ``deferred_artifacts`` config
+        section is ``False``.
+
+        Parameters
+        ----------
+        filename : str
+            The image file that ``function`` writes, which also gives the name
+            of the log file in the step's work directory (e.g. ``plot.log``
+            for ``plot.png``)
+
+        function : function
+            The function that draws and saves the plot, which must be defined
+            at the top level of a module so it can be sent to another process
+
+        **kwargs
+            Keyword arguments to ``function``, typically including the data
+            to plot and the path to save it to, which must be picklable.
+            Because ``filename`` and ``function`` are arguments of this
+            method, ``function`` should not take arguments with these names
+            (e.g. use ``out_filename`` for the image file).
+        """
+        self.plots.append(dict(filename=filename, function=function,
+                               kwargs=kwargs))
+
     def add_model_as_input(self):
         """
         make a link to the model executable and add it to the inputs
@@ -370,7 +468,7 @@ class Step:
             dict(package=package, streams=streams,
                  replacements=template_replacements, mode=mode))
 
-    def process_inputs_and_outputs(self):
+    def process_inputs_and_outputs(self, downloads=None):
         """
         Process the inputs to and outputs from a step added with
         :py:meth:`compass.Step.add_input_file` and
@@ -379,7 +477,15 @@ class Step:
         paths.
 
         Also generates namelist and streams files
-       """
+
+        Parameters
+        ----------
+        downloads : list of tuple, optional
+            If provided, the URL and destination path of each file that needs
+            to be downloaded are appended to this list so the files can all be
+            downloaded together with :py:func:`compass.io.download_files()`,
+            rather than being downloaded one at a time here
+        """
         mpas_core = self.mpas_core.name
         step_dir = self.work_dir
         config = self.config
@@ -432,7 +538,11 @@ class Step:
                 download_path = download_target
 
             if url is not None:
-                download_target = download(url, download_path, config)
+                if downloads is None:
+                    download_target = download(url, download_path, config)
+                else:
+                    downloads.append((url, download_path))
+                    download_target = os.path.abspath(download_path)
                 if target is not None:
                     # this is the absolute path that we presumably want
                     target = download_target
@@ -484,7 +594,7 @@ class Step:
             defaults_filename = config.get('namelists', mode)
             out_filename = '{}/{}'.format(step_work_dir, out_name)
 
-            namelist = compass.namelist.ingest(defaults_filename)
+            namelist = compass.namelist.ingest(defaults_filename, cache=True)
 
             namelist = compass.namelist.replace(namelist, replacements)
 
@@ -520,22 +630,7 @@ class Step:
             defaults_filename = config.get('streams', mode)
             out_filename = '{}/{}'.format(step_work_dir, out_name)
 
-            defaults_tree = etree.parse(defaults_filename)
-
-            defaults = next(defaults_tree.iter('streams'))
-            streams = next(tree.iter('streams'))
-
-            for stream in streams:
-                compass.streams.update_defaults(stream, defaults)
-
-            # remove any streams that aren't requested
-            for default in defaults:
-                found = False
-                for stream in streams:
-                    if stream.attrib['name'] == default.attrib['name']:
-                        found = True
-                        break
-                if not found:
-                    defaults.remove(default)
+            defaults_tree = compass.streams.merge_defaults(
+                tree, defaults_filename)
 
             compass.streams.write(defaults_tree, out_filename)
@@ -1,8 +1,12 @@
+import os
+import importlib
 from lxml import etree
 from copy import deepcopy
 from importlib import resources
 from jinja2 import Template
 
+from compass.cache import read_cached
+
 
 def read(package, streams_filename, tree=None, replacements=None):
     """
@@ -29,19 +33,59 @@ def read(package, streams_filename, tree=None, replacements=None):
         A tree of XML data describing MPAS i/o streams with the content from
         the given streams file
     """
+    # parsed streams files and templates are cached, so each file is only
+    # read once no matter how many steps use it
     if replacements is None:
-        text = resources.read_text(package, streams_filename)
+        new_tree = deepcopy(_read_package_file(package, streams_filename,
+                                               etree.fromstring))
     else:
-        template = Template(resources.read_text(package, streams_filename))
-        text = template.render(**replacements)
-
-    new_tree = etree.fromstring(text)
+        template = _read_package_file(package, streams_filename, Template)
+        new_tree = etree.fromstring(template.render(**replacements))
 
     tree = _update_tree(tree, new_tree)
 
     return tree
 
 
+def merge_defaults(tree, defaults_filename):
+    """
+    Update the default streams for an MPAS core with the streams (and their
+    attributes and contents) requested in ``tree``, leaving out any default
+    streams that were not requested.  The defaults file is parsed once and
+    cached for the rest of this process (until the file is modified), so
+    that it isn't parsed again for every step that uses it.
+
+    Parameters
+    ----------
+    tree : lxml.etree
+        The requested streams, e.g. from :py:func:`compass.streams.read()`
+
+    defaults_filename : str
+        The file with the default streams
+
+    Returns
+    -------
+    defaults_tree : lxml.etree
+        The default streams updated with the requested streams
+    """
+    streams = next(tree.iter('streams'))
+    requested = set(stream.attrib['name'] for stream in streams)
+
+    # copy only the default streams that were requested
+    cached_defaults = next(read_cached(defaults_filename,
+                                       etree.parse).iter('streams'))
+    defaults = etree.Element(cached_defaults.tag, cached_defaults.attrib)
+    for default in cached_defaults:
+        if default.attrib.get('name') in requested:
+            defaults.append(deepcopy(default))
+
+    index = _index_children(defaults)
+    for stream in streams:
+        _update_defaults(stream, defaults, index)
+
+    return etree.ElementTree(defaults)
+
+
 def write(streams, out_filename):
     """ write the streams XML data to the file """
 
@@ -104,14 +148,20 @@ def update_defaults(new_child, defaults):
     Update a stream or its children (sub-stream, var, etc.) starting from the
     defaults or add it if it's new.
     """
+    _update_defaults(new_child, defaults, _index_children(defaults))
+
+
+def _update_defaults(new_child, defaults, index):
+    """
+    Update a stream or its children in the defaults, using an index of the
+    children of ``defaults`` by name from ``_index_children()``
+    """
     if 'name' not in new_child.attrib:
         return
 
     name = new_child.attrib['name']
-    found = False
-    for child in defaults:
-        if child.attrib['name'] == name:
-            found = True
+    if name in index:
+        for child in index[name]:
             if child.tag != new_child.tag:
                 raise ValueError('Trying to update stream "{}" with '
                                  'inconsistent tags {} vs. {}.'.format(
@@ -123,16 +173,18 @@ def update_defaults(new_child, defaults):
 
             if len(new_child) > 0:
                 # we don't want default grandchildren
-                for grandchild in child:
+                for grandchild in list(child):
                     child.remove(grandchild)
 
             # copy or add the grandchildren's contents
+            child_index = _index_children(child)
             for new_grandchild in new_child:
-                update_defaults(new_grandchild, child)
-
-    if not found:
+                _update_defaults(new_grandchild, child, child_index)
+    else:
         # add a deep copy of the element
-        defaults.append(deepcopy(new_child))
+        element = deepcopy(new_child)
+        defaults.append(element)
+        index[name] = [element]
 
 
 def _update_tree(tree, new_tree):
@@ -143,24 +195,25 @@ def _update_tree(tree, new_tree):
         streams = next(tree.iter('streams'))
         new_streams = next(new_tree.iter('streams'))
 
+        index = _index_children(streams)
         for new_stream in new_streams:
-            _update_element(new_stream, streams)
+            _update_element(new_stream, streams, index)
 
     return tree
 
 
-def _update_element(new_child, elements):
+def _update_element(new_child, elements, index):
     """
-    add the new child/grandchildren or add/update attributes if they exist
+    add the new child/grandchildren or add/update attributes if they exist,
+    using an index of the children of ``elements`` by name from
+    ``_index_children()``
     """
     if 'name' not in new_child.attrib:
         return
 
     name = new_child.attrib['name']
-    found = False
-    for child in elements:
-        if child.attrib['name'] == name:
-            found = True
+    if name in index:
+        for child in index[name]:
             if child.tag != new_child.tag:
                 raise ValueError('Trying to update stream "{}" with '
                                  'inconsistent tags {} vs. {}.'.format(
@@ -171,9 +224,45 @@ def _update_element(new_child, elements):
                 child.attrib[attr] = value
 
             # copy or add the grandchildren's contents
+            child_index = _index_children(child)
             for new_grandchild in new_child:
-                _update_element(new_grandchild, child)
-
-    if not found:
+                _update_element(new_grandchild, child, child_index)
+    else:
         # add a deep copy of the element
-        elements.append(deepcopy(new_child))
+        element = deepcopy(new_child)
+        elements.append(element)
+        index[name] = [element]
+
+
+def _index_children(element):
+    """ Index the children of an element by name """
+    index = dict()
+    for child in element:
+        if 'name' in child.attrib:
+            name = child.attrib['name']
+            if name not in index:
+                index[name] = list()
+            index[name].append(child)
+    return index
+
+
+def _read_package_file(package, filename, parse):
+    """
+    Parse the text of a file in a package with the given function, caching
+    the result if the package is a directory on disk
+    """
+    if isinstance(package, str):
+        package = importlib.import_module(package)
+    package_file = getattr(package, '__file__', None)
+    if package_file is not None:
+        path = os.path.join(os.path.dirname(package_file), filename)
+        if os.path.exists(path):
+            return read_cached(path, _parse_text, parse)
+    return parse(resources.read_text(package, filename))
+
+
+def _parse_text(filename, parse):
+    """ Read a text file and parse its contents """
+    with open(filename) as f:
+        text = f.read()
+    return parse(text)
@@ -2,11 +2,12 @@ import argparse
 import sys
 import os
 from importlib import resources
-import pickle
 
 from compass.setup import setup_cases
 from compass.io import symlink
 from compass.clean import clean_cases
+from compass.manifest import write_suite_manifest
+from compass.job import submit_suite
 
 
 def setup_suite(mpas_core, suite_name, config_file=None, machine=None,
@@ -65,15 +66,9 @@ def setup_suite(mpas_core, suite_name, config_file=None, machine=None,
                              work_dir=work_dir, baseline_dir=baseline_dir,
                              mpas_model_path=mpas_model_path)
 
-    test_suite = {'name': suite_name,
-                  'test_cases': test_cases,
-                  'work_dir': work_dir}
-
-    # pickle the test or step dictionary for use at runtime
-    pickle_file = os.path.join(test_suite['work_dir'],
-                               '{}.pickle'.format(suite_name))
-    with open(pickle_file, 'wb') as handle:
-        pickle.dump(test_suite, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    # write a manifest of the test cases for use at runtime
+    manifest_file = os.path.join(work_dir, '{}.json'.format(suite_name))
+    write_suite_manifest(manifest_file, suite_name, work_dir, test_cases)
 
     if 'LOAD_COMPASS_ENV' in os.environ:
         script_filename = os.environ['LOAD_COMPASS_ENV']
@@ -116,11 +111,11 @@ def clean_suite(mpas_core, suite_name, work_dir=None):
 
     clean_cases(tests=tests, work_dir=work_dir)
 
-    # delete the pickle file
-    pickle_file = os.path.join(work_dir, '{}.pickle'.format(suite_name))
+    # delete the manifest file
+    manifest_file = os.path.join(work_dir, '{}.json'.format(suite_name))
 
     try:
-        os.remove(pickle_file)
+        os.remove(manifest_file)
     except OSError:
         pass
 
@@ -157,11 +152,23 @@ def main():
                         help="The path to the build of the MPAS model for the "
                              "core.",
                         metavar="PATH")
+    parser.add_argument("--submit", dest="submit",
+                        help="Option to submit the suite as Slurm batch "
+                             "jobs after it has been set up, one for each "
+                             "independent chain of test cases",
+                        action="store_true")
+    parser.add_argument("--packed", dest="packed",
+                        help="With --submit, pack all test cases into a "
+                             "single multi-node job", action="store_true")
+    parser.add_argument("--no_wait", dest="no_wait",
+                        help="With --submit, don't wait for the jobs to "
+                             "finish and summarize the results",
+                        action="store_true")
     args = parser.parse_args(sys.argv[2:])
 
-    if not args.clean and not args.setup:
-        raise ValueError('At least one of -s/--setup or --clean must be '
-                         'specified')
+    if not args.clean and not args.setup and not args.submit:
+        raise ValueError('At least one of -s/--setup, --clean or --submit '
+                         'must be specified')
 
     if args.clean:
         clean_suite(mpas_core=args.core, suite_name=args.test_suite,
@@ -173,6 +180,12 @@ def main():
                     work_dir=args.work_dir, baseline_dir=args.baseline_dir,
                     mpas_model_path=args.mpas_model)
 
+    if args.submit:
+        if args.work_dir is not None:
+            os.chdir(args.work_dir)
+        submit_suite(suite_name=args.test_suite, packed=args.packed,
+                     wait=not args.no_wait)
+
 
 def _get_required_cores(test_cases):
     """ Get the maximum number of target cores and the max of min cores """
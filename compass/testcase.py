@@ -1,8 +1,13 @@
 import os
 import configparser
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
 
 from mpas_tools.logging import LoggingContext
 from compass.parallel import get_available_cores_and_nodes
+from compass.cache import compute_step_hash, restore_step_outputs, \
+    store_step_outputs, clear_stale_outputs
+from compass.profile import StepProfile
 
 
 class TestCase:
@@ -71,7 +76,19 @@ class TestCase:
     validation : dict
         A dictionary with the status of internal and baseline comparisons, used
         by the ``compass`` framework to determine whether the test case passed
-        or failed internal and baseline validation.
+        or failed internal and baseline validation.  The ``comparisons`` entry
+        is a list with the result of each comparison of a variable from
+        :py:func:`compass.validate.compare_variable_sets()`
+
+    step_profiles : list of compass.profile.StepProfile
+        The timing and resource usage of each step that has been run
+
+    deferred_jobs : list of dict
+        When running as part of a test suite, the deferred artifacts and
+        diagnostic plots of the steps, which the suite makes in the
+        background after the test case has finished (see
+        :py:func:`compass.testcase.make_deferred_artifact()`), or ``None`` if
+        the test case makes them itself before ``run()`` returns
     """
 
     def __init__(self, test_group, name, subdir=None):
@@ -117,6 +134,10 @@ class TestCase:
         self.logger = None
         self.log_filename = None
         self.validation = None
+        self.step_profiles = list()
+        self.deferred_jobs = None
+        self._executor = None
+        self._artifacts = list()
 
     def configure(self):
         """
@@ -140,36 +161,72 @@ class TestCase:
         run.  The developer will need to decide where in the overridden method
         to make the call to ``super().run()``, after any updates to steps
         based on config options, typically at the end of the new method.
+
+        Deferred artifacts of each step (see
+        :py:meth:`compass.Step.add_deferred_artifact`) and plots that are not
+        outputs of the step (see :py:meth:`compass.Step.add_plot`) are made
+        in the background while later steps run, and this method waits for
+        them before returning.  If ``deferred_jobs`` is a list (as when the
+        test case runs as part of a suite), they are added to it instead, and
+        the suite makes them without waiting.
         """
         logger = self.logger
+        config = self.config
         cwd = os.getcwd()
-        for step_name in self.steps_to_run:
-            step = self.steps[step_name]
-            step.config = self.config
-            new_log_file = self.new_step_log_file
-            if self.log_filename is not None:
-                step.log_filename = self.log_filename
-                do_local_logging = True
-            else:
-                # We only want to do local log output if the step output is
-                # being redirected to a file.  Otherwise, we assume we're
-                # probably just running one step and the local logging is
-                # redundant and unnecessary
-                do_local_logging = new_log_file
-
-            if do_local_logging:
-                logger.info(' * Running {}'.format(step_name))
-            try:
-                self._run_step(step, new_log_file)
-            except BaseException:
-                if do_local_logging:
-                    logger.info('     Failed')
-                raise
 
-            if do_local_logging:
-                logger.info('     Complete')
+        make_artifacts = config.getboolean('deferred_artifacts', 'enabled',
+                                           fallback=True)
+        # these are created as they are needed while the steps run
+        self._executor = None
+        self._artifacts = list()
+
+        try:
+            for step_name in self.steps_to_run:
+                step = self.steps[step_name]
+                step.config = config
+                new_log_file = self.new_step_log_file
+                if self.log_filename is not None:
+                    step.log_filename = self.log_filename
+                    do_local_logging = True
+                else:
+                    # We only want to do local log output if the step output
+                    # is being redirected to a file.  Otherwise, we assume
+                    # we're probably just running one step and the local
+                    # logging is redundant and unnecessary
+                    do_local_logging = new_log_file
 
-            os.chdir(cwd)
+                if do_local_logging:
+                    logger.info(' * Running {}'.format(step_name))
+                try:
+                    self._run_step(step, new_log_file)
+                except BaseException:
+                    if do_local_logging:
+                        logger.info('     Failed')
+                    raise
+
+                if do_local_logging:
+                    logger.info('     Complete')
+
+                if make_artifacts and len(step.deferred_artifacts) > 0:
+                    if do_local_logging:
+                        names = [artifact['name'] for artifact in
+                                 step.deferred_artifacts]
+                        logger.info('     Making deferred artifacts: '
+                                    '{}'.format(', '.join(names)))
+                    for artifact in step.deferred_artifacts:
+                        self._defer_job(step, artifact['name'],
+                                        artifact['function'],
+                                        artifact['kwargs'])
+
+                os.chdir(cwd)
+        finally:
+            if self._executor is not None:
+                # even if a step failed, wait so no artifacts are still being
+                # written once the test case is done
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+        check_deferred_artifacts(self._artifacts, logger)
 
     def validate(self):
         """
@@ -233,9 +290,7 @@ class TestCase:
         new_log_file : bool
             Whether to log to a new log file
         """
-        logger = self.logger
         config = self.config
-        cwd = os.getcwd()
         available_cores, _ = get_available_cores_and_nodes(config)
         step.cores = min(step.cores, available_cores)
         if step.min_cores is not None:
@@ -244,10 +299,50 @@ class TestCase:
                     'Available cores for {} is below the minimum of {}'
                     ''.format(step.cores, step.min_cores))
 
-        missing_files = list()
-        for input_file in step.inputs:
-            if not os.path.exists(input_file):
-                missing_files.append(input_file)
+        profile = StepProfile(step)
+        step.profile = profile
+        self.step_profiles.append(profile)
+        profile.start()
+        try:
+            cached = self._run_step_phases(step, new_log_file, profile)
+        except BaseException:
+            profile.stop('failed')
+            raise
+        if cached:
+            profile.stop('cached')
+        else:
+            profile.stop('success')
+
+    def _run_step_phases(self, step, new_log_file, profile):
+        """
+        Check the inputs, run the step (or restore its outputs from the
+        cache) and check the outputs, timing each phase
+
+        Parameters
+        ----------
+        step : compass.Step
+            The step to run
+
+        new_log_file : bool
+            Whether to log to a new log file
+
+        profile : compass.profile.StepProfile
+            The profile of the step
+
+        Returns
+        -------
+        cached : bool
+            Whether the outputs were restored from the step cache
+        """
+        logger = self.logger
+        config = self.config
+        cwd = os.getcwd()
+
+        with profile.phase('inputs'):
+            missing_files = list()
+            for input_file in step.inputs:
+                if not os.path.exists(input_file):
+                    missing_files.append(input_file)
 
         if len(missing_files) > 0:
             raise OSError(
@@ -255,6 +350,19 @@ class TestCase:
                     step.name, step.mpas_core.name, step.test_group.name,
                     step.test_case.subdir, missing_files))
 
+        step_hash = None
+        if step.use_cache and len(step.outputs) > 0 and \
+                config.has_option('step_cache', 'enabled') and \
+                config.getboolean('step_cache', 'enabled'):
+            with profile.phase('cache'):
+                step_hash = compute_step_hash(step)
+                restored = restore_step_outputs(step, step_hash)
+                if not restored:
+                    clear_stale_outputs(step)
+            if restored:
+                logger.info('     Restored outputs from the step cache')
+                return True
+
         test_name = step.path.replace('/', '_')
         if new_log_file:
             log_filename = '{}/{}.log'.format(cwd, step.name)
@@ -267,15 +375,190 @@ class TestCase:
                             log_filename=log_filename) as step_logger:
             step.logger = step_logger
             os.chdir(step.work_dir)
-            step.run()
+            with profile.phase('run'):
+                step.run()
+                self._render_plots(step)
 
-        missing_files = list()
-        for output_file in step.outputs:
-            if not os.path.exists(output_file):
-                missing_files.append(output_file)
+        with profile.phase('outputs'):
+            missing_files = list()
+            for output_file in step.outputs:
+                if not os.path.exists(output_file):
+                    missing_files.append(output_file)
 
         if len(missing_files) > 0:
             raise OSError(
                 'output file(s) missing in step {} of {}/{}/{}: {}'.format(
                     step.name, step.mpas_core.name, step.test_group.name,
                     step.test_case.subdir, missing_files))
+
+        if step_hash is not None:
+            with profile.phase('cache'):
+                store_step_outputs(step, step_hash)
+
+        return False
+
+    def _render_plots(self, step):
+        """
+        Start rendering the plots of a step in the background (or defer the
+        diagnostic plots to the suite), then wait for the plots that are
+        outputs of the step
+
+        Parameters
+        ----------
+        step : compass.Step
+            The step that has just run
+        """
+        config = self.config
+        make_diagnostic_plots = \
+            config.getboolean('deferred_artifacts', 'enabled',
+                              fallback=True) and \
+            config.getboolean('deferred_artifacts', 'plots', fallback=True)
+
+        futures = list()
+        for plot in step.plots:
+            filename = plot['filename']
+            is_output = os.path.abspath(os.path.join(
+                step.work_dir, filename)) in step.outputs
+            if not is_output and not make_diagnostic_plots:
+                continue
+            name = os.path.splitext(os.path.basename(filename))[0]
+            kwargs = dict(function=plot['function'], kwargs=plot['kwargs'])
+            if is_output:
+                futures.append(self._start_job(_get_job(
+                    step, name, _render_plot, kwargs)))
+            else:
+                self._defer_job(step, name, _render_plot, kwargs)
+
+        # raise the first error (if any) once all the outputs are done
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
+
+    def _defer_job(self, step, name, function, kwargs):
+        """
+        Start a deferred artifact or diagnostic plot of a step in a
+        background process, or add it to ``deferred_jobs`` for the suite
+
+        Parameters
+        ----------
+        step : compass.Step
+            The step the job belongs to
+
+        name : str
+            The name of the job, also used for its log file
+
+        function : function
+            The function to call in the step's work directory
+
+        kwargs : dict
+            Keyword arguments to the function
+        """
+        job = _get_job(step, name, function, kwargs)
+        if self.deferred_jobs is not None:
+            self.deferred_jobs.append(job)
+        else:
+            self._artifacts.append((job, self._start_job(job)))
+
+    def _start_job(self, job):
+        """
+        Start a deferred artifact or plot of a step in a background process
+
+        Parameters
+        ----------
+        job : dict
+            The job to start
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            The future for the result of the job
+        """
+        if self._executor is None and \
+                not multiprocessing.current_process().daemon:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.config.getint('deferred_artifacts',
+                                               'processes', fallback=1))
+
+        if self._executor is None:
+            # daemon processes (e.g. test cases running in parallel in
+            # python 3.8) can't start processes of their own, so the job is
+            # done right away
+            future = Future()
+            try:
+                future.set_result(make_deferred_artifact(job))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._executor.submit(make_deferred_artifact, job)
+        return future
+
+
+def make_deferred_artifact(job):
+    """
+    Make a deferred artifact or plot in its step's work directory, logging
+    output to ``<name>.log``
+
+    Parameters
+    ----------
+    job : dict
+        The job, with the ``step`` name and ``work_dir`` of the step it
+        belongs to, its ``name`` and the ``function`` to call with
+        ``kwargs``
+    """
+    work_dir = job['work_dir']
+    name = job['name']
+    os.chdir(work_dir)
+    log_filename = os.path.join(work_dir, '{}.log'.format(name))
+    with LoggingContext(name, log_filename=log_filename):
+        job['function'](**job['kwargs'])
+
+
+def check_deferred_artifacts(artifacts, logger):
+    """
+    Wait for deferred artifacts and plots and raise an exception if any
+    failed
+
+    Parameters
+    ----------
+    artifacts : list of tuple
+        Each job (see :py:func:`compass.testcase.make_deferred_artifact()`)
+        and the ``concurrent.futures.Future`` for its result
+
+    logger : logging.Logger
+        The logger for errors
+    """
+    failed = list()
+    for job, future in artifacts:
+        exception = future.exception()
+        if exception is not None:
+            logger.error('Making deferred artifact {} of step {} failed, see '
+                         '{}'.format(job['name'], job['step'],
+                                     os.path.join(job['work_dir'],
+                                                  '{}.log'.format(
+                                                      job['name']))),
+                         exc_info=exception)
+            failed.append('{}/{}'.format(job['step'], job['name']))
+
+    if len(failed) > 0:
+        raise ValueError('Deferred artifact(s) failed: {}'.format(
+            ', '.join(failed)))
+
+
+def _get_job(step, name, function, kwargs):
+    """ Describe a deferred artifact or plot of a step """
+    return dict(step=step.name, work_dir=step.work_dir, name=name,
+                function=function, kwargs=kwargs)
+
+
+def _render_plot(function, kwargs):
+    """
+    Render a plot with the ``Agg`` backend, closing its figures afterwards
+    """
+    # matplotlib is slow to import, so only import it when it's needed
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    try:
+        function(**kwargs)
+    finally:
+        plt.close('all')
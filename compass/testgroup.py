@@ -45,3 +45,12 @@ class TestGroup:
             The test case to add
         """
         self.test_cases[test_case.subdir] = test_case
+
+    def __getstate__(self):
+        """
+        Leave out the other test cases in the test group when a test case is
+        pickled, since only the test case itself is needed at runtime
+        """
+        state = self.__dict__.copy()
+        state['test_cases'] = dict()
+        return state
@@ -0,0 +1,383 @@
+import os
+import fnmatch
+
+import numpy
+
+
+class Timer:
+    """
+    A timer from the output of an MPAS run
+
+    Attributes
+    ----------
+    name : str
+        The name of the timer
+
+    level : int
+        The level of the timer in the tree, with 1 for top-level timers
+
+    parent : compass.timers.Timer
+        The parent timer, or ``None`` for top-level timers
+
+    children : list of compass.timers.Timer
+        The timers nested inside this one
+
+    total : float
+        The total time in seconds spent in the timer: the maximum across
+        ranks of the accumulated time
+
+    calls : int
+        The number of times the timer was started and stopped
+
+    min : float
+        For MPAS timers, the minimum time spent in a single call; for GPTL
+        timers, the minimum total time across ranks
+
+    max : float
+        For MPAS timers, the maximum time spent in a single call; for GPTL
+        timers, the maximum total time across ranks
+
+    avg : float
+        For MPAS timers, the average time spent in a single call; for GPTL
+        timers, the average total time across ranks
+    """
+
+    def __init__(self, name, level, parent, total, calls, min_time,
+                 max_time, avg_time):
+        """
+        Create a timer
+
+        Parameters
+        ----------
+        name : str
+            The name of the timer
+
+        level : int
+            The level of the timer in the tree
+
+        parent : compass.timers.Timer
+            The parent timer, or ``None`` for top-level timers
+
+        total : float
+            The total time in seconds spent in the timer
+
+        calls : int
+            The number of times the timer was started and stopped
+
+        min_time : float
+            The minimum time (see above)
+
+        max_time : float
+            The maximum time (see above)
+
+        avg_time : float
+            The average time (see above)
+        """
+        self.name = name
+        self.level = level
+        self.parent = parent
+        self.children = list()
+        self.total = total
+        self.calls = calls
+        self.min = min_time
+        self.max = max_time
+        self.avg = avg_time
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def path(self):
+        """
+        The names of this timer and all its parents, separated by ``/``
+        """
+        names = list()
+        timer = self
+        while timer is not None:
+            names.append(timer.name)
+            timer = timer.parent
+        return '/'.join(reversed(names))
+
+
+class TimerTree:
+    """
+    The hierarchy of timers from the output of an MPAS run
+
+    Attributes
+    ----------
+    timers : list of compass.timers.Timer
+        All timers in the order they appear in the output, with parents before
+        their children
+
+    roots : list of compass.timers.Timer
+        The top-level timers
+    """
+
+    def __init__(self, timers):
+        """
+        Create a timer tree
+
+        Parameters
+        ----------
+        timers : list of compass.timers.Timer
+            All timers in the order they appear in the output
+        """
+        self.timers = timers
+        self.roots = [timer for timer in timers if timer.parent is None]
+        self._by_name = dict()
+        for timer in timers:
+            if timer.name not in self._by_name:
+                self._by_name[timer.name] = list()
+            self._by_name[timer.name].append(timer)
+
+    def find(self, name):
+        """
+        Find the timer with the given name, matching the name exactly.  If
+        the same timer appears under more than one parent, the one closest to
+        the top of the tree is returned.
+
+        Parameters
+        ----------
+        name : str
+            The name of the timer, or the names of the timer and its parents
+            separated by ``/`` (e.g. ``total time/time integration``)
+
+        Returns
+        -------
+        timer : compass.timers.Timer
+            The timer, or ``None`` if there is no timer with this name
+        """
+        timers = self.find_all(name)
+        if len(timers) == 0:
+            return None
+        return min(timers, key=lambda timer: timer.level)
+
+    def find_all(self, name):
+        """
+        Find all timers with the given name, matching the name exactly
+
+        Parameters
+        ----------
+        name : str
+            The name of the timer, or the names of the timer and its parents
+            separated by ``/``
+
+        Returns
+        -------
+        timers : list of compass.timers.Timer
+            The timers with this name in the order they appear in the output
+        """
+        if '/' in name:
+            timer_name = name.split('/')[-1]
+            return [timer for timer in self._by_name.get(timer_name, list())
+                    if '/{}'.format(timer.path).endswith('/' + name)]
+        return list(self._by_name.get(name, list()))
+
+
+def read_timers(directory):
+    """
+    Read the timers from the output of an MPAS run.  The built-in MPAS timers
+    are read from the first ``log.*.out`` file (in sorted order) that
+    contains them.  Otherwise, GPTL timers are read from the ``timing.<rank>``
+    files and combined across ranks.  Each file is read only once and the
+    tree is cached until the files change.
+
+    Parameters
+    ----------
+    directory : str
+        The directory where MPAS was run
+
+    Returns
+    -------
+    tree : compass.timers.TimerTree
+        The timers, which will be empty if there are no timers in the
+        directory
+    """
+    directory = os.path.abspath(directory)
+    filenames = sorted(os.listdir(directory))
+    log_files = [os.path.join(directory, filename) for filename in filenames
+                 if fnmatch.fnmatch(filename, 'log.*.out')]
+    gptl_files = [os.path.join(directory, filename) for filename in filenames
+                  if fnmatch.fnmatch(filename, 'timing.*') and
+                  filename.split('.', 1)[1].isdigit()]
+
+    key = list()
+    for filename in log_files + gptl_files:
+        stat = os.stat(filename)
+        key.append((filename, stat.st_mtime_ns, stat.st_size))
+    key = tuple(key)
+    if directory in _cache and _cache[directory][0] == key:
+        return _cache[directory][1]
+
+    tree = None
+    for filename in log_files:
+        timers = _read_mpas_timers(filename)
+        if len(timers) > 0:
+            tree = TimerTree(timers)
+            break
+
+    if tree is None:
+        tree = _read_gptl_timers(gptl_files)
+
+    _cache[directory] = (key, tree)
+    return tree
+
+
+# timer trees that have been read, with the directory as key
+_cache = dict()
+
+
+def _read_mpas_timers(filename):
+    """
+    Read the table of built-in MPAS timers from a log file.  Each row has the
+    level of the timer, its name (indented by its level), then a value for
+    each column in the header: the total time, calls, min, max and avg
+    followed by percentages
+    """
+    timers = list()
+    parents = list()
+    value_count = None
+    with open(filename) as f:
+        for line in f:
+            tokens = line.split()
+            if value_count is None:
+                if len(tokens) > 0 and tokens[0] == 'timer_name':
+                    value_count = len(tokens) - 1
+                continue
+            if len(tokens) == 0:
+                if len(timers) > 0:
+                    break
+                continue
+            if not tokens[0].isdigit() or len(tokens) < value_count + 2:
+                break
+            level = int(tokens[0])
+            name_end = len(tokens) - value_count
+            values = tokens[name_end:]
+            name = ' '.join(tokens[1:name_end])
+            del parents[level - 1:]
+            parent = parents[-1] if len(parents) > 0 else None
+            timer = Timer(name, level, parent, total=float(values[0]),
+                          calls=int(float(values[1])),
+                          min_time=float(values[2]),
+                          max_time=float(values[3]),
+                          avg_time=float(values[4]))
+            parents.append(timer)
+            timers.append(timer)
+    return timers
+
+
+def _read_gptl_timers(filenames):
+    """
+    Read the GPTL timers for thread 0 from the timing file of each rank and
+    combine them into one tree with the min, max and average across ranks
+    """
+    if len(filenames) == 0:
+        return TimerTree(list())
+
+    # all ranks have the same columns, so we only need to figure out how many
+    # values there are in each row once
+    value_count = None
+    rank_tables = list()
+    for filename in filenames:
+        table, value_count = _read_gptl_table(filename, value_count)
+        rank_tables.append(table)
+
+    # the tree is defined by the first rank, then totals are combined across
+    # ranks for timers with the same path
+    timers = list()
+    by_path = dict()
+    parents = list()
+    for level, path, name, calls, _ in rank_tables[0]:
+        del parents[level - 1:]
+        parent = parents[-1] if len(parents) > 0 else None
+        timer = Timer(name, level, parent, total=0., calls=calls,
+                      min_time=0., max_time=0., avg_time=0.)
+        parents.append(timer)
+        timers.append(timer)
+        by_path[path] = (timer, list())
+
+    for table in rank_tables:
+        for _, path, _, _, wallclock in table:
+            if path in by_path:
+                by_path[path][1].append(wallclock)
+
+    for timer, totals in by_path.values():
+        timer.total = float(numpy.amax(totals))
+        timer.min = float(numpy.amin(totals))
+        timer.max = timer.total
+        timer.avg = float(numpy.mean(totals))
+
+    return TimerTree(timers)
+
+
+def _read_gptl_table(filename, value_count=None):
+    """
+    Read the table of timers for thread 0 from a GPTL timing file.  Each row
+    has the name of the timer (indented by 2 spaces per level and preceded by
+    a ``*`` if it has more than one parent), the number of calls, the number
+    of recursive calls and the wallclock time, followed by other statistics.
+    Returns the table and the number of values in each row.
+    """
+    rows = list()
+    in_table = False
+    with open(filename) as f:
+        for line in f:
+            tokens = line.split()
+            if not in_table:
+                in_table = 'Called' in tokens and 'Wallclock' in tokens
+                continue
+            if len(tokens) == 0:
+                if len(rows) > 0:
+                    break
+                continue
+            if tokens[0] == '*':
+                # a timer with multiple parents
+                line = line.replace('*', ' ', 1)
+                tokens = tokens[1:]
+            indent = len(line) - len(line.lstrip())
+            rows.append((indent, tokens))
+
+    if len(rows) == 0:
+        return list(), value_count
+
+    if value_count is None:
+        # every row has the same number of values, but the names of some
+        # timers end in a number, so the row with the fewest trailing numbers
+        # tells us how many values there are
+        value_count = min([_count_values(tokens) for _, tokens in rows])
+    base_indent = rows[0][0]
+
+    table = list()
+    names = list()
+    for indent, tokens in rows:
+        name_end = len(tokens) - value_count
+        level = max(1, (indent - base_indent) // 2 + 1)
+        name = ' '.join(tokens[0:name_end])
+        del names[level - 1:]
+        names.append(name)
+        table.append((level, '/'.join(names), name, int(tokens[name_end]),
+                      float(tokens[name_end + 2])))
+    return table, value_count
+
+
+def _count_values(tokens):
+    """
+    Count the numerical values (or ``-``) at the end of a row of a GPTL timer
+    table, after the name of the timer
+    """
+    count = 0
+    for token in reversed(tokens[1:]):
+        if not _is_value(token):
+            break
+        count += 1
+    return count
+
+
+def _is_value(token):
+    """ Whether a token in a timer table is a value rather than a name """
+    if token == '-':
+        return True
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
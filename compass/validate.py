@@ -1,8 +1,15 @@
+import math
 import os
 import numpy
 import xarray
-import re
-import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from compass.perf import record_timers, check_timers
+from compass.timers import read_timers
+
+# the maximum number of elements of a variable to read at once when comparing
+# variables
+_max_chunk_size = 2**24
 
 
 def compare_variables(test_case, variables, filename1, filename2=None,
@@ -50,53 +57,118 @@ def compare_variables(test_case, variables, filename1, filename2=None,
     quiet : bool, optional
         Whether to print
     """
-    work_dir = test_case.work_dir
+    comparison = dict(variables=variables, filename1=filename1,
+                      filename2=filename2, l1_norm=l1_norm, l2_norm=l2_norm,
+                      linf_norm=linf_norm)
+    compare_variable_sets(test_case, [comparison], quiet=quiet)
 
-    if test_case.validation is not None:
-        validation = test_case.validation
-    else:
-        validation = {'internal_pass': None,
-                      'baseline_pass': None}
 
-    if filename2 is not None:
-        internal_pass = _compare_variables(
-            variables, os.path.join(work_dir, filename1),
-            os.path.join(work_dir, filename2), l1_norm, l2_norm, linf_norm,
-            quiet)
+def compare_variable_sets(test_case, comparisons, quiet=True, threads=None):
+    """
+    Perform several comparisons of variables between files in the current test
+    case and/or with the baseline results, all at once.  Each file is opened
+    only once and each chunk of a variable in ``filename1`` is read only once,
+    even if it is compared both with ``filename2`` and with the baseline.
+    Variables are compared in parallel on a pool of threads.  As in
+    :py:func:`compass.validate.compare_variables()`, the results are added to
+    the test case's "validation" dictionary.
 
-        if validation['internal_pass'] is None:
-            validation['internal_pass'] = internal_pass
-        else:
-            validation['internal_pass'] = \
-                validation['internal_pass'] and internal_pass
+    Parameters
+    ----------
+    test_case : compass.TestCase
+        An object describing a test case to validate
 
-    if test_case.baseline_dir is not None:
-        baseline_root = test_case.baseline_dir
-        baseline_pass = True
-
-        result = _compare_variables(
-            variables, os.path.join(work_dir, filename1),
-            os.path.join(baseline_root, filename1), l1_norm=0.0, l2_norm=0.0,
-            linf_norm=0.0, quiet=quiet)
-        baseline_pass = baseline_pass and result
-
-        if filename2 is not None:
-            result = _compare_variables(
-                variables, os.path.join(work_dir, filename2),
-                os.path.join(baseline_root, filename2), l1_norm=0.0,
-                l2_norm=0.0, linf_norm=0.0, quiet=quiet)
-            baseline_pass = baseline_pass and result
-
-        if validation['baseline_pass'] is None:
-            validation['baseline_pass'] = baseline_pass
-        else:
-            validation['baseline_pass'] = \
-                validation['baseline_pass'] and baseline_pass
+    comparisons : list of dict
+        A list of comparisons, each a dictionary with the keyword arguments
+        ``variables``, ``filename1`` and (optionally) ``filename2``,
+        ``l1_norm``, ``l2_norm`` and ``linf_norm`` to
+        :py:func:`compass.validate.compare_variables()`
 
-    test_case.validation = validation
+    quiet : bool, optional
+        Whether to print
+
+    threads : int, optional
+        The number of threads to use to compare variables.  By default, the
+        ``threads`` config option in the ``parallel`` section is used
+
+    Returns
+    -------
+    results : list of dict
+        The result of each comparison of a variable between two files, with
+        keys ``variable``, ``filename1``, ``filename2``, ``baseline`` (whether
+        this is a comparison with the baseline), ``pass`` and ``norms`` (a
+        dictionary of the largest ``l1``, ``l2`` and ``linf`` norms over all
+        time indices).  These results are also appended to the
+        ``comparisons`` list in the test case's "validation" dictionary.
+    """
+    tasks = list()
+    for comparison in comparisons:
+        tasks.extend(_get_comparison_tasks(test_case, **comparison))
 
+    filenames = list()
+    for task in tasks:
+        for filename in [task['filename1'], task['filename2']]:
+            if filename not in filenames:
+                filenames.append(filename)
+
+    for filename in filenames:
+        if not os.path.exists(filename):
+            raise OSError('File {} does not exist.'.format(filename))
 
-def compare_timers(timers, config, work_dir, rundir1, rundir2=None):
+    # comparisons of the same variable in the same file share reads
+    jobs = dict()
+    for index, task in enumerate(tasks):
+        key = (task['variable'], task['filename1'])
+        if key not in jobs:
+            jobs[key] = list()
+        jobs[key].append(index)
+
+    if threads is None:
+        config = test_case.config
+        if config is not None and config.has_option('parallel', 'threads'):
+            threads = config.getint('parallel', 'threads')
+        else:
+            threads = 1
+    threads = max(1, min(threads, len(jobs)))
+
+    datasets = dict()
+    results = [None] * len(tasks)
+    try:
+        # the datasets are opened lazily so variables are only read one chunk
+        # at a time when norms are computed
+        for filename in filenames:
+            datasets[filename] = xarray.open_dataset(filename)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = dict()
+            for (variable, filename1), indices in jobs.items():
+                job_tasks = [tasks[index] for index in indices]
+                future = executor.submit(_compare_variable, variable,
+                                         filename1, job_tasks, datasets,
+                                         quiet)
+                for index in indices:
+                    futures[index] = future
+
+            # output is printed in the same order as if the comparisons were
+            # performed one after the other
+            for index, task in enumerate(tasks):
+                job_results = futures[index].result()
+                key = (task['variable'], task['filename1'])
+                result, lines = job_results[jobs[key].index(index)]
+                for line in lines:
+                    print(line)
+                results[index] = result
+    finally:
+        for ds in datasets.values():
+            ds.close()
+
+    _update_validation(test_case, tasks, results)
+
+    return results
+
+
+def compare_timers(timers, config, work_dir, rundir1, rundir2=None,
+                   test_case=None):
     """
     Compare variables between files in the current test case and/or with the
     baseline results.
@@ -124,6 +196,14 @@ def compare_timers(timers, config, work_dir, rundir1, rundir2=None):
         between files within the current test case.  If a baseline directory
         was provided, the ``timers`` from this file will also be compared with
         those in the corresponding baseline directory.
+
+    test_case : compass.TestCase, optional
+        The test case that ran the model.  If provided and the ``record``
+        option in the ``perf`` config section is ``True``, the ``timers``
+        from ``rundir1`` (and ``rundir2``) are recorded in the timer database
+        and compared with previous runs (see :py:mod:`compass.perf`).  The
+        result is added to the test case's "validation" dictionary as
+        ``perf_pass``.
     """
 
     if rundir2 is not None:
@@ -140,32 +220,89 @@ def compare_timers(timers, config, work_dir, rundir1, rundir2=None):
             _compute_timers(os.path.join(baseline_root, rundir2),
                             os.path.join(work_dir, rundir2), timers)
 
+    if test_case is not None and config.has_option('perf', 'record') and \
+            config.getboolean('perf', 'record'):
+        for rundir in [rundir1, rundir2]:
+            if rundir is not None:
+                _check_timer_regressions(test_case, timers, rundir)
 
-def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
-                       linf_norm, quiet):
-    """ compare fields in the two files """
 
-    for filename in [filename1, filename2]:
-        if not os.path.exists(filename):
-            raise OSError('File {} does not exist.'.format(filename))
+def _get_comparison_tasks(test_case, variables, filename1, filename2=None,
+                          l1_norm=0.0, l2_norm=0.0, linf_norm=0.0):
+    """
+    Get a list of the comparisons of single variables between two files that
+    make up a call to ``compare_variables()``
+    """
+    work_dir = test_case.work_dir
+    pairs = list()
+    if filename2 is not None:
+        pairs.append((os.path.join(work_dir, filename1),
+                      os.path.join(work_dir, filename2),
+                      (l1_norm, l2_norm, linf_norm), False))
+
+    if test_case.baseline_dir is not None:
+        baseline_root = test_case.baseline_dir
+        for filename in [filename1, filename2]:
+            if filename is not None:
+                pairs.append((os.path.join(work_dir, filename),
+                              os.path.join(baseline_root, filename),
+                              (0.0, 0.0, 0.0), True))
+
+    tasks = list()
+    for full_filename1, full_filename2, thresholds, baseline in pairs:
+        for variable in variables:
+            tasks.append(dict(variable=variable, filename1=full_filename1,
+                              filename2=full_filename2, thresholds=thresholds,
+                              baseline=baseline))
+    return tasks
+
+
+def _update_validation(test_case, tasks, results):
+    """ Add the results of comparisons to the "validation" dictionary """
+    if test_case.validation is not None:
+        validation = test_case.validation
+    else:
+        validation = {'internal_pass': None,
+                      'baseline_pass': None}
+    if 'comparisons' not in validation:
+        validation['comparisons'] = list()
 
-    ds1 = xarray.open_dataset(filename1)
-    ds2 = xarray.open_dataset(filename2)
+    for task, result in zip(tasks, results):
+        if task['baseline']:
+            key = 'baseline_pass'
+        else:
+            key = 'internal_pass'
+        if validation[key] is None:
+            validation[key] = result['pass']
+        else:
+            validation[key] = validation[key] and result['pass']
+        validation['comparisons'].append(result)
 
-    all_pass = True
+    test_case.validation = validation
 
-    for variable in variables:
-        for ds, filename in [(ds1, filename1), (ds2, filename2)]:
-            if variable not in ds:
-                raise ValueError('Variable {} not in {}.'.format(
-                    variable, filename))
 
-        da1 = ds1[variable]
+def _compare_variable(variable, filename1, tasks, datasets, quiet):
+    """
+    Compare a variable in one file with the same variable in each of the
+    files in ``tasks``, returning the result and the output for each
+    """
+    ds1 = datasets[filename1]
+    if variable not in ds1:
+        raise ValueError('Variable {} not in {}.'.format(variable, filename1))
+    da1 = ds1[variable]
+
+    das2 = list()
+    for task in tasks:
+        filename2 = task['filename2']
+        ds2 = datasets[filename2]
+        if variable not in ds2:
+            raise ValueError('Variable {} not in {}.'.format(
+                variable, filename2))
         da2 = ds2[variable]
 
         if not numpy.all(da1.dims == da2.dims):
-            raise ValueError("Dimensions for variable {} don't match between "
-                             "files {} and {}.".format(
+            raise ValueError("Dimensions for variable {} don't match "
+                             "between files {} and {}.".format(
                                  variable, filename1, filename2))
 
         for dim in da1.sizes:
@@ -173,97 +310,184 @@ def _compare_variables(variables, filename1, filename2, l1_norm, l2_norm,
                 raise ValueError("Field sizes for variable {} don't match "
                                  "files {} and {}.".format(
                                      variable, filename1, filename2))
+        das2.append(da2)
 
+    outputs = list()
+    for task in tasks:
+        lines = list()
         if not quiet:
-            print("    Pass thresholds are:")
-            if l1_norm is not None:
-                print("       L1: {:16.14e}".format(l1_norm))
-            if l2_norm is not None:
-                print("       L2: {:16.14e}".format(l2_norm))
-            if linf_norm is not None:
-                print("       L_Infinity: {:16.14e}".format(
-                    linf_norm))
-        variable_pass = True
-        if 'Time' in da1.dims:
-            time_range = range(0, da1.sizes['Time'])
-            time_str = ', '.join(['{}'.format(j) for j in time_range])
-            print('{} Time index: {}'.format(variable.ljust(20), time_str))
-            for time_index in time_range:
-                slice1 = da1.isel(Time=time_index)
-                slice2 = da2.isel(Time=time_index)
-                result = _compute_norms(slice1, slice2, quiet, l1_norm,
-                                        l2_norm, linf_norm,
-                                        time_index=time_index)
-                variable_pass = variable_pass and result
-
+            l1_norm, l2_norm, linf_norm = task['thresholds']
+            lines.append("    Pass thresholds are:")
+            lines.append("       L1: {:16.14e}".format(l1_norm))
+            lines.append("       L2: {:16.14e}".format(l2_norm))
+            lines.append("       L_Infinity: {:16.14e}".format(linf_norm))
+        outputs.append(lines)
+
+    if 'Time' in da1.dims:
+        time_indices = range(0, da1.sizes['Time'])
+        time_str = ', '.join(['{}'.format(j) for j in time_indices])
+        header = '{} Time index: {}'.format(variable.ljust(20), time_str)
+    else:
+        time_indices = [None]
+        header = '{}'.format(variable)
+    for lines in outputs:
+        lines.append(header)
+
+    # if any difference means failure, we can stop looking at a variable
+    # as soon as we find one
+    stop_early = [task['thresholds'] == (0.0, 0.0, 0.0) for task in tasks]
+
+    variable_pass = [True] * len(tasks)
+    max_norms = [numpy.zeros(3) for task in tasks]
+    for time_index in time_indices:
+        active = [index for index in range(len(tasks)) if
+                  variable_pass[index] or not stop_early[index]]
+        if len(active) == 0:
+            break
+        if time_index is None:
+            slice1 = da1
+            slices2 = [das2[index] for index in active]
         else:
-            print('{}'.format(variable))
-            result = _compute_norms(da1, da2, quiet, l1_norm, l2_norm,
-                                    linf_norm)
-            variable_pass = variable_pass and result
-
-        # ANSI fail text: https://stackoverflow.com/a/287944/7728169
-        start_fail = '\033[91m'
-        start_pass = '\033[92m'
-        end = '\033[0m'
-        pass_str = '{}PASS{}'.format(start_pass, end)
-        fail_str = '{}FAIL{}'.format(start_fail, end)
-
-        if variable_pass:
-            print('  {} {}\n'.format(pass_str, filename1))
+            slice1 = da1.isel(Time=time_index)
+            slices2 = [das2[index].isel(Time=time_index) for index in active]
+        all_norms = _compute_norms(
+            slice1, slices2, [stop_early[index] for index in active])
+        for index, norms in zip(active, all_norms):
+            result, diff_str = _check_norms(norms, tasks[index]['thresholds'],
+                                            time_index)
+            if not quiet or not result:
+                outputs[index].append(diff_str)
+            variable_pass[index] = variable_pass[index] and result
+            max_norms[index] = numpy.maximum(max_norms[index], norms[0:3])
+
+    # ANSI fail text: https://stackoverflow.com/a/287944/7728169
+    start_fail = '\033[91m'
+    start_pass = '\033[92m'
+    end = '\033[0m'
+    pass_str = '{}PASS{}'.format(start_pass, end)
+    fail_str = '{}FAIL{}'.format(start_fail, end)
+
+    job_results = list()
+    for index, task in enumerate(tasks):
+        lines = outputs[index]
+        if variable_pass[index]:
+            lines.append('  {} {}\n'.format(pass_str, filename1))
         else:
-            print('  {} {}\n'.format(fail_str, filename1))
-        print('       {}\n'.format(filename2))
-        all_pass = all_pass and variable_pass
+            lines.append('  {} {}\n'.format(fail_str, filename1))
+        lines.append('       {}\n'.format(task['filename2']))
+        l1_norm, l2_norm, linf_norm = max_norms[index]
+        result = {'variable': variable,
+                  'filename1': filename1,
+                  'filename2': task['filename2'],
+                  'baseline': task['baseline'],
+                  'pass': variable_pass[index],
+                  'norms': {'l1': float(l1_norm),
+                            'l2': float(l2_norm),
+                            'linf': float(linf_norm)}}
+        job_results.append((result, lines))
+
+    return job_results
+
+
+def _compute_norms(da1, others, stop_early):
+    """
+    Compute norms between a variable in one DataArray and in each of a list of
+    other DataArrays, reading the data in chunks along the first dimension and
+    accumulating the norms.  Each chunk of ``da1`` is read only once.  The
+    L1 and L2 norms are bit-for-bit identical to ``numpy.linalg.norm()`` of
+    the whole variable if it is a single chunk.  Otherwise, the sums for each
+    chunk are added with ``math.fsum()``, so the norms may differ from a
+    single pass over the whole variable in the last bits.
+    """
 
-    return all_pass
+    count = len(others)
+    l1_sums = [list() for index in range(count)]
+    l2_sums = [list() for index in range(count)]
+    linf_norm = [0.] * count
+    stopped = [False] * count
+    for chunk in _get_chunks(da1):
+        active = [index for index in range(count) if not stopped[index]]
+        if len(active) == 0:
+            break
+        data1 = _read_chunk(da1, chunk)
+        for index in active:
+            diff = numpy.abs(data1 - _read_chunk(others[index], chunk))
+            diff = diff.ravel()
+            if diff.size == 0:
+                continue
+            if not numpy.issubdtype(diff.dtype, numpy.inexact):
+                diff = diff.astype(float)
 
+            # these are the same operations as numpy.linalg.norm() so the
+            # norms are identical when the whole array is a single chunk
+            l1_sums[index].append(numpy.linalg.norm(diff, ord=1))
+            l2_sums[index].append(diff.dot(diff))
+            linf_norm[index] = numpy.maximum(
+                linf_norm[index], numpy.linalg.norm(diff, ord=numpy.inf))
 
-def _compute_norms(da1, da2, quiet, max_l1_norm, max_l2_norm, max_linf_norm,
-                   time_index=None):
-    """ Compute norms between variables in two DataArrays """
+            if stop_early[index] and linf_norm[index] > 0.:
+                stopped[index] = True
 
-    da1 = _rename_duplicate_dims(da1)
-    da2 = _rename_duplicate_dims(da2)
+    norms = list()
+    for index in range(count):
+        l1_norm = _sum_chunks(l1_sums[index])
+        l2_norm = numpy.sqrt(_sum_chunks(l2_sums[index]))
+        norms.append((l1_norm, l2_norm, linf_norm[index], stopped[index]))
+    return norms
+
+
+def _sum_chunks(sums):
+    """
+    Add up the sums for each chunk, keeping the type of the sum if there is
+    only one chunk
+    """
+    if len(sums) == 0:
+        return 0.
+    if len(sums) == 1:
+        return sums[0]
+    return math.fsum(sums)
 
-    result = True
-    diff = numpy.abs(da1 - da2).values.ravel()
 
-    l1_norm = numpy.linalg.norm(diff, ord=1)
-    l2_norm = numpy.linalg.norm(diff, ord=2)
-    linf_norm = numpy.linalg.norm(diff, ord=numpy.inf)
+def _check_norms(norms, thresholds, time_index=None):
+    """
+    Check norms against the maximum allowed values, returning whether they
+    pass and a string describing them
+    """
+    l1_norm, l2_norm, linf_norm, stopped = norms
+    max_l1_norm, max_l2_norm, max_linf_norm = thresholds
+
+    result = True
 
     if time_index is None:
         diff_str = ''
     else:
         diff_str = '{:d}: '.format(time_index)
 
-    if l1_norm is not None:
-        if max_l1_norm < l1_norm:
-            result = False
+    if max_l1_norm < l1_norm:
+        result = False
     diff_str = '{} l1: {:16.14e} '.format(diff_str, l1_norm)
 
-    if l2_norm is not None:
-        if max_l2_norm < l2_norm:
-            result = False
+    if max_l2_norm < l2_norm:
+        result = False
     diff_str = '{} l2: {:16.14e} '.format(diff_str, l2_norm)
 
-    if linf_norm is not None:
-        if max_linf_norm < linf_norm:
-            result = False
+    if max_linf_norm < linf_norm:
+        result = False
     diff_str = '{} linf: {:16.14e} '.format(diff_str, linf_norm)
 
-    if not quiet or not result:
-        print(diff_str)
+    if stopped:
+        diff_str = '{} (stopped at the first difference)'.format(diff_str)
 
-    return result
+    return result, diff_str
 
 
 def _compute_timers(base_directory, comparison_directory, timers):
     """ Find timers and compute speedup between two run directories """
+    tree1 = read_timers(base_directory)
+    tree2 = read_timers(comparison_directory)
     for timer in timers:
-        timer1_found, timer1 = _find_timer_value(timer, base_directory)
-        timer2_found, timer2 = _find_timer_value(timer, comparison_directory)
+        timer1_found, timer1 = _find_timer_value(timer, tree1)
+        timer2_found, timer2 = _find_timer_value(timer, tree2)
 
         if timer1_found and timer2_found:
             if timer2 > 0.:
@@ -280,63 +504,68 @@ def _compute_timers(base_directory, comparison_directory, timers):
             print("          Speedup: {}".format(speedup))
 
 
-def _find_timer_value(timer_name, directory):
-    """ Find a timer in the given directory """
-    # Build a regular expression for any two characters with a space between
-    # them.
-    regex = re.compile(r'(\S) (\S)')
-
-    sub_timer_name = timer_name.replace(' ', '_')
-
-    timer = 0.0
-    timer_found = False
-    for file in os.listdir(directory):
-        if not timer_found:
-            # Compare files written using built in MPAS timers
-            if fnmatch.fnmatch(file, "log.*.out"):
-                timer_line_size = 6
-                name_index = 1
-                total_index = 2
-            # Compare files written using GPTL timers
-            elif fnmatch.fnmatch(file, "timing.*"):
-                timer_line_size = 6
-                name_index = 0
-                total_index = 3
-            else:
-                continue
+def _check_timer_regressions(test_case, timers, rundir):
+    """
+    Record the timers from a run of the model and check them for regressions
+    compared with previous runs
+    """
+    tree = read_timers(os.path.join(test_case.work_dir, rundir))
+    values = dict()
+    for timer in timers:
+        timer_found, value = _find_timer_value(timer, tree)
+        if timer_found:
+            values[timer] = value
+
+    if len(values) == 0:
+        return
+
+    record_timers(test_case, values, rundir)
+    regressions = check_timers(test_case, list(values), rundir)
+    for result in regressions:
+        print('Timer {} in {} is slower than in previous runs:'.format(
+            result['timer'], rundir))
+        print('             Time: {}'.format(result['value']))
+        print('    Previous runs: {} +/- {} ({} runs)'.format(
+            result['mean'], result['std'], result['n']))
+        print('   Percent Change: {}%'.format(100. * result['slowdown']))
 
-            with open(os.path.join(directory, file), "r") as stats_file:
-                for block in iter(lambda: stats_file.readline(), ""):
-                    new_block = regex.sub(r"\1_\2", block[2:])
-                    new_block_arr = new_block.split()
-                    if len(new_block_arr) >= timer_line_size:
-                        if sub_timer_name.find(new_block_arr[name_index]) >= 0:
-                            try:
-                                timer = \
-                                    timer + float(new_block_arr[total_index])
-                                timer_found = True
-                            except ValueError:
-                                pass
-
-    return timer_found, timer
-
-
-def _rename_duplicate_dims(da):
-    dims = list(da.dims)
-    new_dims = list(dims)
-    duplicates = False
-    for index, dim in enumerate(dims):
-        if dim in dims[index+1:]:
-            duplicates = True
-            suffix = 2
-            for other_index, other in enumerate(dims[index+1:]):
-                if other == dim:
-                    new_dims[other_index + index + 1] = \
-                        '{}_{}'.format(dim, suffix)
-                    suffix += 1
-
-    if not duplicates:
-        return da
-
-    da = xarray.DataArray(data=da.values, dims=new_dims)
-    return da
+    if test_case.validation is not None:
+        validation = test_case.validation
+    else:
+        validation = {'internal_pass': None,
+                      'baseline_pass': None}
+    perf_pass = len(regressions) == 0
+    if validation.get('perf_pass') is not None:
+        perf_pass = perf_pass and validation['perf_pass']
+    validation['perf_pass'] = perf_pass
+    test_case.validation = validation
+
+
+def _find_timer_value(timer_name, tree):
+    """ Find the total time of a timer in a timer tree """
+    timer = tree.find(timer_name)
+    if timer is None:
+        return False, 0.0
+    return True, timer.total
+
+
+def _get_chunks(da):
+    """
+    Get slices along the first dimension of a DataArray that each have no more
+    than ``_max_chunk_size`` elements (but at least one index)
+    """
+    if da.ndim == 0:
+        return [None]
+    dim_size = da.shape[0]
+    inner_size = max(int(numpy.prod(da.shape[1:])), 1)
+    chunk_length = max(_max_chunk_size // inner_size, 1)
+    return [slice(start, min(start + chunk_length, dim_size)) for start in
+            range(0, dim_size, chunk_length)]
+
+
+def _read_chunk(da, chunk):
+    """ Read a chunk of data along the first dimension of a DataArray """
+    if chunk is None:
+        return da.values
+    # positional indexing reads only this chunk from the file
+    return da[chunk].values
@@ -33,7 +33,7 @@ install_requires = \
      'pyamg',
      'rasterio',
      'requests',
-     'scipy',
+     'scipy>=1.6',
      'xarray']
 
 here = os.path.abspath(os.path.dirname(__file__))